@@ -0,0 +1,3 @@
+from ._calculator import NequIPCalculator
+
+__all__ = [NequIPCalculator]
@@ -0,0 +1,202 @@
+import os
+from typing import List, Optional, Union
+
+import numpy as np
+import torch
+
+from ase.calculators.calculator import (
+    Calculator,
+    PropertyNotImplementedError,
+    all_changes,
+)
+from ase.stress import full_3x3_to_voigt_6_stress
+
+from kim_nequip.data import driver_graph
+
+
+class NequIPCalculator(Calculator):
+    """ASE calculator running a model exported by ``kim-nequip-port``, without the KIM API.
+
+    The inputs of the model are built as the KIM TorchML driver does (see
+    ``kim_nequip.data.driver_graph``), with a skin added to the cutoffs: the graphs
+    and all the tensors fed to the model are kept between calls, and only rebuilt
+    when an atom has moved by more than half the skin, or the cell, the periodic
+    boundary conditions or the atoms change. The edges in the skin are beyond the
+    cutoff and do not change the results.
+
+    When only the energy is requested, the energy-only method of the export is used
+    if it has one. The stress is the virial of the forces on all the (contributing and padding)
+    atoms, so it is only available for fully periodic systems.
+
+    Args:
+        model: the exported TorchScript model, or the path to it
+        r_max: cutoff of a convolution
+        n_layers: number of convolutions of the model
+        species: chemical symbols of the types of the model, in order
+        skin: extra distance added to the cutoffs of the reused graphs
+        reorder: if ``"morton"`` or ``"hilbert"``, sort the atoms along that curve in the graphs
+        device: device to run the model on
+    """
+
+    implemented_properties = ["energy", "energies", "free_energy", "forces", "stress"]
+
+    def __init__(
+        self,
+        model: Union[str, torch.jit.ScriptModule],
+        r_max: float,
+        n_layers: int,
+        species: List[str],
+        skin: float = 1.0,
+        reorder: Optional[str] = None,
+        device: Union[str, torch.device] = "cpu",
+        **kwargs,
+    ):
+        Calculator.__init__(self, **kwargs)
+        if isinstance(model, (str, os.PathLike)):
+            model = torch.jit.load(str(model), map_location=device)
+        self.model = model.to(device)
+        self.model.eval()
+        self.r_max = float(r_max)
+        self.n_layers = int(n_layers)
+        self.species = list(species)
+        self.skin = float(skin)
+        self.reorder = reorder
+        self.device = torch.device(device)
+        self.dtype = next(
+            (b.dtype for b in self.model.buffers() if b.is_floating_point()),
+            torch.float64,
+        )
+        # per-atom energies need the energies before the sum, which models exported
+        # before it was added do not have
+        self._per_atom = hasattr(self.model, "model") and hasattr(
+            self.model.model, "atomic_energies"
+        )
+        self._graph = None
+
+    @classmethod
+    def from_kim_model(cls, path: str, **kwargs):
+        """Load the model of a KIM model folder written by ``kim-nequip-port --save-kim-model``."""
+        with open(os.path.join(path, "file.param")) as f:
+            lines = [
+                line.strip()
+                for line in f
+                if line.strip() and not line.strip().startswith("#")
+            ]
+        n_species = int(lines[0])
+        species = lines[1].split()
+        assert len(species) == n_species
+        r_max, n_layers, model_name = float(lines[3]), int(lines[4]), lines[5]
+        return cls(
+            model=os.path.join(path, os.path.basename(model_name)),
+            r_max=r_max,
+            n_layers=n_layers,
+            species=species,
+            **kwargs,
+        )
+
+    def _needs_rebuild(self, atoms, system_changes) -> bool:
+        if self._graph is None:
+            return True
+        if any(c in system_changes for c in ("numbers", "cell", "pbc", "initial_charges", "initial_magmoms")):
+            return True
+        displacement = np.linalg.norm(atoms.positions - self._graph["positions"], axis=1)
+        return displacement.max(initial=0.0) > 0.5 * self.skin
+
+    def _build(self, atoms):
+        try:
+            types = [self.species.index(s) for s in atoms.get_chemical_symbols()]
+        except ValueError:
+            raise ValueError(
+                f"The model only supports {self.species}, got {sorted(set(atoms.get_chemical_symbols()))}"
+            )
+        g = driver_graph(
+            atoms.positions,
+            types,
+            r_max=self.r_max,
+            n_layers=self.n_layers,
+            cell=atoms.cell[:],
+            pbc=tuple(atoms.pbc),
+            reorder=self.reorder,
+            skin=self.skin,
+        )
+        cell = torch.as_tensor(atoms.cell[:], dtype=self.dtype)
+        self._graph = {
+            "positions": atoms.positions.copy(),
+            "species": g["species"].view(-1, 1).to(self.device),
+            "edge_indices": [e.to(self.device) for e in g["edge_indices"]],
+            "contributing": g["contributing"].to(self.device),
+            "image": g["image"].to(self.device),
+            # offsets of the images from the atoms, constant until the cell changes
+            "offset": (g["shift"].to(self.dtype) @ cell).to(self.device),
+            "coords": torch.empty(
+                (len(g["image"]), 3), dtype=self.dtype, device=self.device
+            ),
+            "local": (g["contributing"] == 0).to(self.device),
+        }
+
+    def calculate(self, atoms=None, properties=["energy"], system_changes=all_changes):
+        Calculator.calculate(self, atoms, properties, system_changes)
+        atoms = self.atoms
+        if self._needs_rebuild(atoms, system_changes):
+            self._build(atoms)
+        g = self._graph
+        n_atoms = len(atoms)
+
+        coords = g["coords"]
+        with torch.no_grad():
+            pos = torch.as_tensor(atoms.positions, dtype=self.dtype, device=self.device)
+            torch.add(pos[g["image"]], g["offset"], out=coords)
+        if set(properties) <= {"energy", "free_energy"} and hasattr(self.model, "energy"):
+            # energy-only method of the export, without the backward pass
+            energy = float(
+                self.model.energy(
+                    g["species"], coords, *g["edge_indices"], g["contributing"]
+                )
+            )
+            self.results["energy"] = energy
+            self.results["free_energy"] = energy
+            return
+        coords.requires_grad_(True)
+        energies = None
+        if self._per_atom and "energies" in properties:
+            # the forward of the export (with its checkpointing, ...) otherwise
+            atomic = self.model.model.atomic_energies(
+                g["species"], coords, *g["edge_indices"]
+            )
+            atomic = atomic[g["local"]].view(-1) * self.model.scale_by
+            energy = atomic.sum()
+            (grad,) = torch.autograd.grad([energy], [coords])
+            forces = -grad
+            energies = torch.zeros(n_atoms, dtype=self.dtype, device=self.device)
+            energies.index_add_(0, g["image"][g["local"]], atomic.detach())
+        else:
+            energy, forces = self.model(
+                g["species"], coords, *g["edge_indices"], g["contributing"]
+            )
+        coords.requires_grad_(False)
+        forces = forces.detach()
+
+        energy = float(energy.detach())
+        self.results["energy"] = energy
+        self.results["free_energy"] = energy
+        self.results["forces"] = (
+            torch.zeros((n_atoms, 3), dtype=self.dtype, device=self.device)
+            .index_add_(0, g["image"], forces)
+            .cpu()
+            .numpy()
+        )
+        if energies is not None:
+            self.results["energies"] = energies.cpu().numpy()
+        elif "energies" in properties:
+            raise PropertyNotImplementedError(
+                "Per-atom energies need a model exported with atomic_energies"
+            )
+        if atoms.pbc.all():
+            # the energy depends on the positions of the padding atoms too, which follow the strain
+            virial = coords.detach().T @ forces
+            stress = -0.5 * (virial + virial.T) / atoms.get_volume()
+            self.results["stress"] = full_3x3_to_voigt_6_stress(stress.cpu().numpy())
+        elif "stress" in properties:
+            raise PropertyNotImplementedError(
+                "The stress is only available for fully periodic systems"
+            )
@@ -5,7 +5,7 @@ Authors: Albert Musaelian
 
 import warnings
 from copy import deepcopy
-from typing import Union, Tuple, Dict, Optional, List, Set, Sequence
+from typing import Union, Tuple, Dict, Optional, List, Set, Sequence, Any
 from collections.abc import Mapping
 
 import numpy as np
@@ -31,6 +31,7 @@ _DEFAULT_LONG_FIELDS: Set[str] = {
     AtomicDataDict.ATOMIC_NUMBERS_KEY,
     AtomicDataDict.ATOM_TYPE_KEY,
     AtomicDataDict.BATCH_KEY,
+    AtomicDataDict.ORIGINAL_INDEX_KEY,
 }
 _DEFAULT_NODE_FIELDS: Set[str] = {
     AtomicDataDict.POSITIONS_KEY,
@@ -41,6 +42,7 @@ _DEFAULT_NODE_FIELDS: Set[str] = {
     AtomicDataDict.FORCE_KEY,
     AtomicDataDict.PER_ATOM_ENERGY_KEY,
     AtomicDataDict.BATCH_KEY,
+    AtomicDataDict.ORIGINAL_INDEX_KEY,
 }
 _DEFAULT_EDGE_FIELDS: Set[str] = {
     AtomicDataDict.EDGE_CELL_SHIFT_KEY,
@@ -84,6 +86,7 @@ def register_fields(
     _EDGE_FIELDS.update(edge_fields)
     _GRAPH_FIELDS.update(graph_fields)
     _LONG_FIELDS.update(long_fields)
+    _FIELD_SCHEMA.clear()
     if len(set.union(_NODE_FIELDS, _EDGE_FIELDS, _GRAPH_FIELDS)) < (
         len(_NODE_FIELDS) + len(_EDGE_FIELDS) + len(_GRAPH_FIELDS)
     ):
@@ -107,6 +110,54 @@ def deregister_fields(*fields: Sequence[str]) -> None:
         _NODE_FIELDS.discard(f)
         _EDGE_FIELDS.discard(f)
         _GRAPH_FIELDS.discard(f)
+    _FIELD_SCHEMA.clear()
+
+
+# Cache of (category, is_long) for every field seen by ``_process_dict``,
+# so that the field registries are not searched again for every frame.
+# Cleared whenever fields are (de)registered.
+_FIELD_SCHEMA: Dict[str, Tuple[Optional[str], bool]] = {}
+
+
+def _field_schema(key: str) -> Tuple[Optional[str], bool]:
+    """Get whether ``key`` is a ``"node"``, ``"edge"`` or ``"graph"`` field (or ``None``), and whether it is long."""
+    schema = _FIELD_SCHEMA.get(key, None)
+    if schema is None:
+        if key in _NODE_FIELDS:
+            category = "node"
+        elif key in _EDGE_FIELDS:
+            category = "edge"
+        elif key in _GRAPH_FIELDS:
+            category = "graph"
+        else:
+            category = None
+        schema = (category, key in _LONG_FIELDS)
+        _FIELD_SCHEMA[key] = schema
+    return schema
+
+
+def _convert_field(v, is_long: bool):
+    """Convert one value to a ``torch.Tensor`` of the right dtype, if it is array-like."""
+    if is_long:
+        # Any property used as an index must be long (or byte or bool, but those are not relevant for atomic scale systems)
+        # int32 would pass later checks, but is actually disallowed by torch
+        return torch.as_tensor(v, dtype=torch.long)
+    elif isinstance(v, bool):
+        return torch.as_tensor(v)
+    if isinstance(v, list):
+        # convert once, rather than probing the dtype and then converting again
+        v = np.asarray(v)
+    if isinstance(v, np.ndarray):
+        if np.issubdtype(v.dtype, np.floating):
+            return torch.as_tensor(v, dtype=torch.get_default_dtype())
+        else:
+            return torch.as_tensor(v)
+    elif np.issubdtype(type(v), np.floating):
+        # Force scalars to be tensors with a data dimension
+        # This makes them play well with irreps
+        return torch.as_tensor(v, dtype=torch.get_default_dtype())
+    # tensors (including scalar ones, which get a data dimension below) are kept
+    return v
 
 
 def _process_dict(kwargs, ignore_fields=[]):
@@ -115,71 +166,96 @@ def _process_dict(kwargs, ignore_fields=[]):
     for k, v in kwargs.items():
         if k in ignore_fields:
             continue
-
-        if k in _LONG_FIELDS:
-            # Any property used as an index must be long (or byte or bool, but those are not relevant for atomic scale systems)
-            # int32 would pass later checks, but is actually disallowed by torch
-            kwargs[k] = torch.as_tensor(v, dtype=torch.long)
-        elif isinstance(v, bool):
-            kwargs[k] = torch.as_tensor(v)
-        elif isinstance(v, np.ndarray):
-            if np.issubdtype(v.dtype, np.floating):
-                kwargs[k] = torch.as_tensor(v, dtype=torch.get_default_dtype())
-            else:
-                kwargs[k] = torch.as_tensor(v)
-        elif isinstance(v, list):
-            ele_dtype = np.array(v).dtype
-            if np.issubdtype(ele_dtype, np.floating):
-                kwargs[k] = torch.as_tensor(v, dtype=torch.get_default_dtype())
-            else:
-                kwargs[k] = torch.as_tensor(v)
-        elif np.issubdtype(type(v), np.floating):
-            # Force scalars to be tensors with a data dimension
-            # This makes them play well with irreps
-            kwargs[k] = torch.as_tensor(v, dtype=torch.get_default_dtype())
-        elif isinstance(v, torch.Tensor) and len(v.shape) == 0:
-            # ^ this tensor is a scalar; we need to give it
-            # a data dimension to play nice with irreps
-            kwargs[k] = v
+        kwargs[k] = _convert_field(v, _field_schema(k)[1])
 
     if AtomicDataDict.BATCH_KEY in kwargs:
         num_frames = kwargs[AtomicDataDict.BATCH_KEY].max() + 1
     else:
         num_frames = 1
+    num_nodes = (
+        kwargs[AtomicDataDict.POSITIONS_KEY].shape[0]
+        if AtomicDataDict.POSITIONS_KEY in kwargs
+        else None
+    )
+    num_edges = (
+        kwargs[AtomicDataDict.EDGE_INDEX_KEY].shape[1]
+        if AtomicDataDict.EDGE_INDEX_KEY in kwargs
+        else None
+    )
 
     for k, v in kwargs.items():
         if k in ignore_fields:
             continue
+        category, _ = _field_schema(k)
 
         if len(v.shape) == 0:
             kwargs[k] = v.unsqueeze(-1)
             v = kwargs[k]
 
-        if k in set.union(_NODE_FIELDS, _EDGE_FIELDS) and len(v.shape) == 1:
+        if (category == "node" or category == "edge") and len(v.shape) == 1:
             kwargs[k] = v.unsqueeze(-1)
             v = kwargs[k]
 
-        if (
-            k in _NODE_FIELDS
-            and AtomicDataDict.POSITIONS_KEY in kwargs
-            and v.shape[0] != kwargs[AtomicDataDict.POSITIONS_KEY].shape[0]
-        ):
+        if category == "node" and num_nodes is not None and v.shape[0] != num_nodes:
             raise ValueError(
                 f"{k} is a node field but has the wrong dimension {v.shape}"
             )
-        elif (
-            k in _EDGE_FIELDS
-            and AtomicDataDict.EDGE_INDEX_KEY in kwargs
-            and v.shape[0] != kwargs[AtomicDataDict.EDGE_INDEX_KEY].shape[1]
-        ):
+        elif category == "edge" and num_edges is not None and v.shape[0] != num_edges:
             raise ValueError(
                 f"{k} is a edge field but has the wrong dimension {v.shape}"
             )
-        elif k in _GRAPH_FIELDS:
+        elif category == "graph":
             if num_frames > 1 and v.shape[0] != num_frames:
                 raise ValueError(f"Wrong shape for graph property {k}")
 
 
+def _process_frames_dict(fields: Dict[str, Any]) -> Optional[Dict[str, torch.Tensor]]:
+    """Convert and validate fields stacked over frames (leading dimension) in one go.
+
+    This is the whole-array counterpart of ``_process_dict``: every field is converted
+    to a tensor of the target dtype once, and shapes are checked for all frames at once.
+
+    Returns:
+        The converted fields, with the same per-frame shapes ``_process_dict`` would give,
+        or ``None`` if some field is not a homogeneous array (e.g. ragged frames).
+    """
+    out = {}
+    for k, v in fields.items():
+        if isinstance(v, np.ndarray) and v.dtype == object:
+            return None
+        if not isinstance(v, (np.ndarray, torch.Tensor)):
+            return None
+        category, is_long = _field_schema(k)
+        v = _convert_field(v, is_long)
+        if v.ndim == 1:
+            # per-frame scalars get a data dimension
+            v = v.unsqueeze(-1)
+        if (category == "node" or category == "edge") and v.ndim == 2:
+            v = v.unsqueeze(-1)
+        out[k] = v
+
+    num_frames = set(len(v) for v in out.values())
+    if len(num_frames) > 1:
+        raise ValueError(
+            f"This dataset is invalid: expected all fields to have same length (same number of examples), but they had shapes { {f: v.shape for f, v in out.items() } }"
+        )
+    if AtomicDataDict.POSITIONS_KEY in out:
+        num_nodes = out[AtomicDataDict.POSITIONS_KEY].shape[1]
+        for k, v in out.items():
+            if _field_schema(k)[0] == "node" and v.shape[1] != num_nodes:
+                raise ValueError(
+                    f"{k} is a node field but has the wrong dimension {v.shape[1:]}"
+                )
+    if AtomicDataDict.EDGE_INDEX_KEY in out:
+        num_edges = out[AtomicDataDict.EDGE_INDEX_KEY].shape[-1]
+        for k, v in out.items():
+            if _field_schema(k)[0] == "edge" and v.shape[1] != num_edges:
+                raise ValueError(
+                    f"{k} is a edge field but has the wrong dimension {v.shape[1:]}"
+                )
+    return out
+
+
 class AtomicData(Data):
     """A neighbor graph for points in (periodic triclinic) real space.
 
@@ -329,6 +405,66 @@ class AtomicData(Data):
 
         return cls(edge_index=edge_index, pos=torch.as_tensor(pos), **kwargs)
 
+    @classmethod
+    def from_frames(
+        cls,
+        fields: Dict[str, Sequence],
+        fixed_fields: Dict[str, Any] = {},
+        include_frames: Optional[Sequence[int]] = None,
+    ) -> List["AtomicData"]:
+        """Build ``AtomicData`` for many frames from fields stacked over frames.
+
+        Homogeneous arrays (same number of atoms/edges in every frame) are converted and
+        validated as whole arrays, and ``fixed_fields`` only once, instead of once per
+        frame; the frames are then built without repeating these checks. Ragged fields
+        fall back to the per-frame constructors.
+
+        If ``edge_index`` is not given, the neighbor graphs are built with ``from_points``,
+        in which case ``r_max`` and ``pos`` must be present.
+
+        Args:
+            fields: maps field names to array-likes whose first dimension indexes frames.
+            fixed_fields: fields with the same value for every frame.
+            include_frames: the frames to build; defaults to all of them.
+
+        Returns:
+            list of ``AtomicData``, one per included frame.
+        """
+        all_keys = set(fields.keys()).union(fixed_fields.keys())
+        if AtomicDataDict.EDGE_INDEX_KEY in all_keys:
+            # This is already a graph, just build it
+            constructor = cls
+        else:
+            # do neighborlist from points
+            constructor = cls.from_points
+            assert "r_max" in all_keys
+            assert AtomicDataDict.POSITIONS_KEY in all_keys
+
+        if include_frames is None:
+            include_frames = range(len(next(iter(fields.values()))))
+
+        converted = _process_frames_dict(fields)
+        if converted is None:
+            # ragged data, convert and validate frame by frame
+            return [
+                constructor(**{**{f: v[i] for f, v in fields.items()}, **fixed_fields})
+                for i in include_frames
+            ]
+
+        AtomicDataDict.validate_keys(all_keys, graph_required=False)
+        fixed_fields = dict(fixed_fields)
+        _process_dict(
+            fixed_fields, ignore_fields=["r_max"] if constructor is not cls else []
+        )
+        return [
+            constructor(
+                **{f: v[i] for f, v in converted.items()},
+                **fixed_fields,
+                _validate=False,
+            )
+            for i in include_frames
+        ]
+
     @classmethod
     def from_ase(
         cls,
@@ -360,7 +496,7 @@ class AtomicData(Data):
         Returns:
             A ``AtomicData``.
         """
-        from nequip.ase import NequIPCalculator
+        from kim_nequip.ase import NequIPCalculator
 
         assert "pos" not in kwargs
 
@@ -8,6 +8,15 @@ from .AtomicData import (
     _GRAPH_FIELDS,
 )
 from .dataset import AtomicDataset, AtomicInMemoryDataset, NpzDataset, ASEDataset
+from ._statistics import StreamingStatistics
+from ._reorder import reorder_atoms, restore_atom_order, spatial_permutation
+from ._driver import (
+    driver_graph,
+    driver_graph_from_data,
+    batch_driver_graphs,
+    subdomain_graphs,
+    fold_to_atoms,
+)
 # from .dataloader import DataLoader, Collater
 from ._build import dataset_from_config
 from ._test_data import EMTTestDataset
@@ -21,6 +30,15 @@ __all__ = [
     AtomicInMemoryDataset,
     NpzDataset,
     ASEDataset,
+    StreamingStatistics,
+    reorder_atoms,
+    restore_atom_order,
+    spatial_permutation,
+    driver_graph,
+    driver_graph_from_data,
+    batch_driver_graphs,
+    subdomain_graphs,
+    fold_to_atoms,
     # DataLoader,
     # Collater,
     dataset_from_config,
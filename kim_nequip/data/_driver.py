@@ -0,0 +1,340 @@
+"""Emulation of the inputs that the KIM TorchML model driver gives to a deployed model.
+
+The driver hands the model the contributing atoms together with the padding
+(ghost) atoms inside the influence distance ``n_layers * r_max``, and one staged
+edge graph per convolution: ``edge_index0`` has the contributing atoms as centers,
+``edge_index1`` all atoms within one cutoff of them, and so on (see ``docs/gnn.md``).
+This module builds the same inputs from a periodic configuration, so that a
+deployed model can be run, and checked, without the KIM API.
+"""
+from typing import Dict, Any, List, Optional, Union
+
+import numpy as np
+import torch
+
+import ase.geometry
+import ase.neighborlist
+
+from . import AtomicDataDict
+from .AtomicData import AtomicData, PBC
+from ._reorder import (
+    inverse_permutation,
+    spatial_permutation,
+    sort_edges_by_destination,
+)
+
+
+def driver_graph(
+    pos,
+    atom_types,
+    r_max: float,
+    n_layers: int,
+    cell=None,
+    pbc: PBC = False,
+    reorder: Optional[str] = None,
+    bits: int = 10,
+    skin: float = 0.0,
+) -> Dict[str, Any]:
+    """Build the staged graphs of a configuration as the KIM TorchML driver does.
+
+    Args:
+        pos: [n_atom, 3] positions of the atoms in the cell
+        atom_types: [n_atom] species index of the atoms
+        r_max: cutoff of a single convolution
+        n_layers: number of convolutions, the influence distance is ``n_layers * r_max``
+        cell: [3, 3] cell vectors, ignored if ``pbc`` is False
+        pbc: periodic boundary conditions
+        reorder: if ``"morton"`` or ``"hilbert"``, the contributing and the padding atoms
+            are each sorted along that space-filling curve, and the edges of every graph
+            are sorted by destination
+        bits: resolution of the space-filling curve
+        skin: extra distance added to the cutoffs, so that the graphs stay valid (with some
+            edges beyond ``r_max``) until an atom moves by more than ``skin / 2``; the
+            coordinates are then ``pos[image] + shift @ cell``
+
+    Returns:
+        dict with
+
+        - ``species``: [n_all] species of contributing and padding atoms
+        - ``coords``: [n_all, 3] their coordinates
+        - ``edge_indices``: list of ``n_layers`` [2, n_edge] staged graphs, ``edge_index0`` first
+        - ``contributing``: [n_all] 0 for contributing atoms and 1 for padding atoms
+        - ``image``: [n_all] index of the atom of the input that each atom is an image of
+        - ``shift``: [n_all, 3] cell shift of every atom from the atom of the input
+    """
+    if isinstance(pbc, bool):
+        pbc = (pbc,) * 3
+    if isinstance(pos, torch.Tensor):
+        pos = pos.detach().cpu().numpy()
+    pos = np.asarray(pos, dtype=np.float64)
+    atom_types = torch.as_tensor(atom_types, dtype=torch.long).view(-1)
+    n_atoms = len(pos)
+
+    image = np.arange(n_atoms)
+    image_shift = np.zeros((n_atoms, 3), dtype=np.int64)
+    all_pos = pos
+    if any(pbc):
+        if isinstance(cell, torch.Tensor):
+            cell = cell.detach().cpu().numpy()
+        cell = ase.geometry.complete_cell(np.asarray(cell, dtype=np.float64).reshape(3, 3))
+        # every periodic image within the influence distance of a contributing atom
+        j, shift = ase.neighborlist.primitive_neighbor_list(
+            "jS",
+            pbc,
+            cell,
+            pos,
+            cutoff=float(n_layers * r_max + skin),
+            self_interaction=False,
+            use_scaled_positions=False,
+        )
+        ghost = np.any(shift != 0, axis=1)
+        ghosts = np.unique(
+            np.concatenate([j[ghost, None], shift[ghost]], axis=1), axis=0
+        )
+        image = np.concatenate([image, ghosts[:, 0]])
+        image_shift = np.concatenate([image_shift, ghosts[:, 1:]])
+        all_pos = np.concatenate([pos, pos[ghosts[:, 0]] + ghosts[:, 1:] @ cell])
+
+    return _stage_graphs(
+        all_pos,
+        image,
+        image_shift,
+        n_atoms,
+        atom_types,
+        r_max=r_max,
+        n_layers=n_layers,
+        reorder=reorder,
+        bits=bits,
+        skin=skin,
+    )
+
+
+def _stage_graphs(
+    all_pos: np.ndarray,
+    image: np.ndarray,
+    image_shift: np.ndarray,
+    n_atoms: int,
+    atom_types: torch.Tensor,
+    r_max: float,
+    n_layers: int,
+    reorder: Optional[str] = None,
+    bits: int = 10,
+    skin: float = 0.0,
+) -> Dict[str, Any]:
+    """The staged graphs of ``all_pos``, the first ``n_atoms`` of which are the contributing atoms."""
+    first, second = ase.neighborlist.primitive_neighbor_list(
+        "ij",
+        (False,) * 3,
+        ase.geometry.complete_cell(np.zeros((3, 3))),
+        all_pos,
+        cutoff=float(r_max + skin),
+        self_interaction=False,
+        use_scaled_positions=False,
+    )
+    edge_index = torch.as_tensor(np.stack([first, second]), dtype=torch.long)
+
+    # number of hops from the contributing atoms, up to n_layers
+    n_all = len(all_pos)
+    level = torch.full((n_all,), n_layers + 1, dtype=torch.long)
+    level[:n_atoms] = 0
+    for hop in range(1, n_layers + 1):
+        reached = edge_index[1][level[edge_index[0]] == hop - 1]
+        level[reached] = torch.clamp(level[reached], max=hop)
+
+    # drop the padding atoms that no convolution reaches
+    keep = level <= n_layers
+    new_index = torch.cumsum(keep, dim=0) - 1
+    edge_index = edge_index[:, keep[edge_index[0]] & keep[edge_index[1]]]
+    edge_index = new_index[edge_index]
+    level = level[keep]
+    coords = torch.as_tensor(all_pos)[keep]
+    image = torch.as_tensor(image, dtype=torch.long)[keep]
+    image_shift = torch.as_tensor(image_shift, dtype=torch.long)[keep]
+    contributing = (level > 0).long()
+
+    if reorder is not None:
+        perm = spatial_permutation(coords, method=reorder, bits=bits, batch=contributing)
+        inv = inverse_permutation(perm)
+        coords, image, image_shift, level, contributing = (
+            coords[perm],
+            image[perm],
+            image_shift[perm],
+            level[perm],
+            contributing[perm],
+        )
+        edge_index = inv[edge_index]
+
+    edge_indices: List[torch.Tensor] = []
+    for layer in range(n_layers):
+        e = edge_index[:, level[edge_index[0]] <= layer]
+        if reorder is not None:
+            e = e[:, sort_edges_by_destination(e, len(coords))]
+        edge_indices.append(e)
+
+    return {
+        "species": atom_types[image],
+        "coords": coords,
+        "edge_indices": edge_indices,
+        "contributing": contributing,
+        "image": image,
+        "shift": image_shift,
+    }
+
+
+def driver_graph_from_data(
+    data: Union[AtomicData, AtomicDataDict.Type],
+    r_max: float,
+    n_layers: int,
+    reorder: Optional[str] = None,
+    bits: int = 10,
+) -> Dict[str, Any]:
+    """``driver_graph`` of a single (not batched) frame of ``AtomicData``."""
+    pbc = data[AtomicDataDict.PBC_KEY] if AtomicDataDict.PBC_KEY in data else False
+    cell = data[AtomicDataDict.CELL_KEY] if AtomicDataDict.CELL_KEY in data else None
+    if isinstance(pbc, torch.Tensor):
+        pbc = tuple(bool(p) for p in pbc.view(-1))
+    return driver_graph(
+        data[AtomicDataDict.POSITIONS_KEY],
+        data[AtomicDataDict.ATOM_TYPE_KEY],
+        r_max=r_max,
+        n_layers=n_layers,
+        cell=cell,
+        pbc=pbc,
+        reorder=reorder,
+        bits=bits,
+    )
+
+
+def subdomain_graphs(
+    pos,
+    atom_types,
+    domains: List,
+    r_max: float,
+    n_layers: int,
+    cell=None,
+    pbc: PBC = False,
+    halo: Optional[float] = None,
+    reorder: Optional[str] = None,
+    bits: int = 10,
+) -> List[Dict[str, Any]]:
+    """``driver_graph`` of every spatial subdomain of a configuration, as seen by one process.
+
+    The atoms of a subdomain are its contributing atoms; all the (periodic images of)
+    atoms within ``halo`` of them are its padding atoms, as after a halo exchange.
+
+    Args:
+        domains: the indices of the atoms owned by every subdomain
+        halo: width of the halo, by default the influence distance ``n_layers * r_max``;
+            narrower halos give wrong energies near the subdomain boundaries
+
+    Returns:
+        one dict per subdomain, as returned by ``driver_graph``
+    """
+    if isinstance(pbc, bool):
+        pbc = (pbc,) * 3
+    if isinstance(pos, torch.Tensor):
+        pos = pos.detach().cpu().numpy()
+    pos = np.asarray(pos, dtype=np.float64)
+    atom_types = torch.as_tensor(atom_types, dtype=torch.long).view(-1)
+    halo = float(n_layers * r_max if halo is None else halo)
+    if any(pbc):
+        if isinstance(cell, torch.Tensor):
+            cell = cell.detach().cpu().numpy()
+        cell = ase.geometry.complete_cell(np.asarray(cell, dtype=np.float64).reshape(3, 3))
+    else:
+        cell = ase.geometry.complete_cell(np.zeros((3, 3)))
+
+    # the neighbors within the halo of every atom, shared by all the subdomains
+    first, second, shift = ase.neighborlist.primitive_neighbor_list(
+        "ijS",
+        pbc,
+        cell,
+        pos,
+        cutoff=halo,
+        self_interaction=False,
+        use_scaled_positions=False,
+    )
+    graphs = []
+    for members in domains:
+        members = np.asarray(members, dtype=np.int64)
+        owned = np.zeros(len(pos), dtype=bool)
+        owned[members] = True
+        near = owned[first] & ~(owned[second] & np.all(shift == 0, axis=1))
+        ghosts = np.unique(
+            np.concatenate([second[near, None], shift[near]], axis=1), axis=0
+        ).reshape(-1, 4)
+        graphs.append(
+            _stage_graphs(
+                np.concatenate([pos[members], pos[ghosts[:, 0]] + ghosts[:, 1:] @ cell]),
+                np.concatenate([members, ghosts[:, 0]]),
+                np.concatenate([np.zeros((len(members), 3), dtype=np.int64), ghosts[:, 1:]]),
+                len(members),
+                atom_types,
+                r_max=r_max,
+                n_layers=n_layers,
+                reorder=reorder,
+                bits=bits,
+            )
+        )
+    return graphs
+
+
+def batch_driver_graphs(graphs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Concatenate the ``driver_graph`` of several configurations into one batch.
+
+    Returns:
+        dict with the keys of ``driver_graph``, where ``edge_indices`` are offset to the
+        concatenated atoms and ``image`` to the concatenated atoms of the inputs, and
+
+        - ``batch``: [n_all] index of the configuration of every atom
+        - ``num_atoms``: [n_config] number of input atoms of every configuration
+    """
+    if len(graphs) == 0:
+        raise ValueError("Cannot batch an empty list of graphs")
+    n_layers = len(graphs[0]["edge_indices"])
+    if any(len(g["edge_indices"]) != n_layers for g in graphs):
+        raise ValueError("All graphs should have the same number of edge graphs")
+
+    # the atoms of the input are the contributing ones
+    num_atoms = torch.as_tensor(
+        [int((g["contributing"] == 0).sum()) for g in graphs], dtype=torch.long
+    )
+    atom_offsets = torch.cumsum(num_atoms, dim=0) - num_atoms
+    node_offset = 0
+    edge_indices: List[List[torch.Tensor]] = [[] for _ in range(n_layers)]
+    for g in graphs:
+        for layer, e in enumerate(g["edge_indices"]):
+            edge_indices[layer].append(e + node_offset)
+        node_offset += len(g["coords"])
+
+    return {
+        "species": torch.cat([g["species"] for g in graphs]),
+        "coords": torch.cat([g["coords"] for g in graphs]),
+        "edge_indices": [torch.cat(e, dim=1) for e in edge_indices],
+        "contributing": torch.cat([g["contributing"] for g in graphs]),
+        "image": torch.cat(
+            [g["image"] + offset for g, offset in zip(graphs, atom_offsets)]
+        ),
+        "shift": torch.cat([g["shift"] for g in graphs]),
+        "batch": torch.cat(
+            [
+                torch.full((len(g["coords"]),), i, dtype=torch.long)
+                for i, g in enumerate(graphs)
+            ]
+        ),
+        "num_atoms": num_atoms,
+    }
+
+
+def fold_to_atoms(
+    values: torch.Tensor, image: torch.Tensor, n_atoms: int
+) -> torch.Tensor:
+    """Sum per-atom ``values`` of contributing and padding atoms onto the atoms of the input.
+
+    This inverts both the periodic padding and any reordering of ``driver_graph``,
+    e.g. to get the forces of the input atoms from the forces on all coordinates.
+    """
+    out = torch.zeros(
+        (n_atoms,) + values.shape[1:], dtype=values.dtype, device=values.device
+    )
+    return out.index_add_(0, image.to(values.device), values)
@@ -25,6 +25,8 @@ PBC_KEY: Final[str] = "pbc"
 ATOMIC_NUMBERS_KEY: Final[str] = "atomic_numbers"
 # [n_atom, 1] long tensor
 ATOM_TYPE_KEY: Final[str] = "atom_types"
+# [n_atom] long tensor, the index of each atom before a reordering
+ORIGINAL_INDEX_KEY: Final[str] = "original_index"
 
 BASIC_STRUCTURE_KEYS: Final[List[str]] = [
     POSITIONS_KEY,
@@ -53,6 +55,8 @@ PER_ATOM_ENERGY_KEY: Final[str] = "atomic_energy"
 TOTAL_ENERGY_KEY: Final[str] = "total_energy"
 FORCE_KEY: Final[str] = "forces"
 PARTIAL_FORCE_KEY: Final[str] = "partial_forces"
+# [n_atom, n_atom, 3] sparse COO pairwise partial forces of the edges, see ``edge_partial_forces``
+EDGE_PARTIAL_FORCE_KEY: Final[str] = "edge_partial_forces"
 STRESS_KEY: Final[str] = "stress"
 VIRIAL_KEY: Final[str] = "virial"
 
@@ -61,6 +65,7 @@ ALL_ENERGY_KEYS: Final[List[str]] = [
     TOTAL_ENERGY_KEY,
     FORCE_KEY,
     PARTIAL_FORCE_KEY,
+    EDGE_PARTIAL_FORCE_KEY,
     STRESS_KEY,
     VIRIAL_KEY,
 ]
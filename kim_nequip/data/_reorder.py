@@ -0,0 +1,156 @@
+"""Spatial reordering of atoms along space-filling curves.
+
+Message passing gathers ``h[edge_src]`` and scatters into ``edge_dst``; when the
+atom indices follow the input order these accesses jump all over memory. Sorting
+the atoms along a Morton (Z-order) or Hilbert curve puts spatial neighbors next to
+each other, and sorting the edges by destination makes the scatter sequential.
+"""
+from typing import Union, Tuple, Optional
+
+import torch
+
+from . import AtomicDataDict
+from .AtomicData import AtomicData, _NODE_FIELDS, _EDGE_FIELDS
+
+
+def inverse_permutation(perm: torch.Tensor) -> torch.Tensor:
+    inv = torch.empty_like(perm)
+    inv[perm] = torch.arange(perm.size(0), device=perm.device)
+    return inv
+
+
+def _quantize(pos: torch.Tensor, bits: int) -> torch.Tensor:
+    """Map positions onto the integer grid ``[0, 2**bits)`` of their bounding box."""
+    pos = pos.detach().to(torch.float64)
+    lo = pos.min(dim=0).values
+    extent = (pos.max(dim=0).values - lo).clamp(min=1e-12)
+    n = (1 << bits) - 1
+    return torch.round((pos - lo) / extent * n).long().clamp(0, n)
+
+
+def _interleave(x: torch.Tensor, bits: int) -> torch.Tensor:
+    """Interleave the bits of ``x[:, 0]``, ``x[:, 1]``, ``x[:, 2]``, most significant first."""
+    code = torch.zeros(len(x), dtype=torch.long, device=x.device)
+    for b in range(bits):
+        for d in range(3):
+            code |= ((x[:, d] >> b) & 1) << (3 * b + 2 - d)
+    return code
+
+
+def morton_code(pos: torch.Tensor, bits: int = 10) -> torch.Tensor:
+    return _interleave(_quantize(pos, bits), bits)
+
+
+def hilbert_code(pos: torch.Tensor, bits: int = 10) -> torch.Tensor:
+    """Hilbert index with Skilling's transpose algorithm (AIP Conf. Proc. 707, 381 (2004))."""
+    x = _quantize(pos, bits)
+    x = [x[:, d].clone() for d in range(3)]
+    # inverse undo excess work
+    q = 1 << (bits - 1)
+    while q > 1:
+        p = q - 1
+        for d in range(3):
+            flip = (x[d] & q) != 0
+            t = (x[0] ^ x[d]) & p
+            x0 = torch.where(flip, x[0] ^ p, x[0] ^ t)
+            if d > 0:
+                x[d] = torch.where(flip, x[d], x[d] ^ t)
+            x[0] = x0
+        q >>= 1
+    # gray encode
+    for d in range(1, 3):
+        x[d] = x[d] ^ x[d - 1]
+    t = torch.zeros_like(x[0])
+    q = 1 << (bits - 1)
+    while q > 1:
+        t = torch.where((x[2] & q) != 0, t ^ (q - 1), t)
+        q >>= 1
+    return _interleave(torch.stack([xi ^ t for xi in x], dim=1), bits)
+
+
+_CURVES = {"morton": morton_code, "hilbert": hilbert_code}
+
+
+def spatial_permutation(
+    pos: torch.Tensor,
+    method: str = "morton",
+    bits: int = 10,
+    batch: Optional[torch.Tensor] = None,
+) -> torch.Tensor:
+    """The order of the atoms along a space-filling curve.
+
+    Args:
+        pos: [n_atom, 3] positions
+        method: ``"morton"`` or ``"hilbert"``
+        bits: resolution of the curve along each direction, at most 21
+        batch: [n_atom] frame index; if given, atoms are only reordered within their frame
+
+    Returns:
+        ``perm`` such that ``pos[perm]`` is sorted along the curve.
+    """
+    if method not in _CURVES:
+        raise ValueError(
+            f"Unknown reordering `{method}`, should be one of {list(_CURVES)}"
+        )
+    if not 0 < bits <= 21:
+        raise ValueError(f"bits should be in (0, 21], got {bits}")
+    if len(pos) < 2:
+        return torch.arange(len(pos), device=pos.device)
+    perm = torch.argsort(_CURVES[method](pos, bits), stable=True)
+    if batch is not None:
+        perm = perm[torch.argsort(batch[perm], stable=True)]
+    return perm
+
+
+def sort_edges_by_destination(
+    edge_index: torch.Tensor, num_nodes: int
+) -> torch.Tensor:
+    """The order of the edges sorted by destination (``edge_index[0]``), then source."""
+    return torch.argsort(edge_index[0] * num_nodes + edge_index[1], stable=True)
+
+
+def reorder_atoms(
+    data: Union[AtomicData, AtomicDataDict.Type],
+    method: str = "morton",
+    bits: int = 10,
+) -> Tuple[Union[AtomicData, AtomicDataDict.Type], torch.Tensor]:
+    """Permute the atoms of ``data`` along a space-filling curve and sort its edges by destination.
+
+    All registered node and edge fields are permuted accordingly, and the original
+    index of every atom is stored under ``AtomicDataDict.ORIGINAL_INDEX_KEY``, so that
+    per-atom outputs can be put back in the input order with ``restore_atom_order``.
+
+    Returns:
+        the reordered data (a shallow copy) and the permutation ``perm``; atom ``i``
+        of the returned data is atom ``perm[i]`` of the input.
+    """
+    pos = data[AtomicDataDict.POSITIONS_KEY]
+    num_nodes = len(pos)
+    batch = data[AtomicDataDict.BATCH_KEY] if AtomicDataDict.BATCH_KEY in data else None
+    perm = spatial_permutation(pos, method=method, bits=bits, batch=batch)
+    inv = inverse_permutation(perm)
+
+    new = data.clone() if isinstance(data, AtomicData) else dict(data)
+    keys = list(new.keys) if isinstance(new, AtomicData) else list(new.keys())
+    for k in keys:
+        if k in _NODE_FIELDS:
+            new[k] = new[k][perm]
+    if AtomicDataDict.ORIGINAL_INDEX_KEY not in keys:
+        new[AtomicDataDict.ORIGINAL_INDEX_KEY] = perm
+
+    if AtomicDataDict.EDGE_INDEX_KEY in keys:
+        edge_index = inv[new[AtomicDataDict.EDGE_INDEX_KEY]]
+        order = sort_edges_by_destination(edge_index, num_nodes)
+        new[AtomicDataDict.EDGE_INDEX_KEY] = edge_index[:, order]
+        for k in keys:
+            if k in _EDGE_FIELDS:
+                new[k] = new[k][order]
+
+    return new, perm
+
+
+def restore_atom_order(values: torch.Tensor, perm: torch.Tensor) -> torch.Tensor:
+    """Put per-atom ``values`` of reordered data back in the input order of the atoms."""
+    out = torch.empty_like(values)
+    out[perm] = values
+    return out
@@ -0,0 +1,391 @@
+"""Streaming, mergeable statistics over chunks of atomic data.
+
+The accumulators here never need the whole dataset at once: every chunk is
+folded into running moments using Welford's method (in the batched/parallel
+form of Chan et al.), and two partial accumulators can be merged exactly. This
+lets workers compute partial statistics over disjoint parts of a dataset that
+are then combined in the parent process.
+
+See https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm
+"""
+from typing import Dict, Any, List, Union, Callable, Optional, Tuple
+
+import numpy as np
+
+import torch
+
+from kim_nequip.data import AtomicDataDict, _NODE_FIELDS, _EDGE_FIELDS, _GRAPH_FIELDS
+from kim_nequip.utils.batch_ops import bincount
+from kim_nequip.utils.regressor import solver, IncrementalRidgeSolver
+
+
+def _pad_bins(t: torch.Tensor, n_bins: int) -> torch.Tensor:
+    if len(t) >= n_bins:
+        return t
+    return torch.cat((t, t.new_zeros((n_bins - len(t),) + t.shape[1:])), dim=0)
+
+
+class WelfordAccumulator:
+    """Running count, mean and sum of squared deviations, optionally per bin.
+
+    Args:
+        binned: if True, samples are accumulated into bins given by an index tensor
+            (for example atom types); otherwise everything goes into a single bin.
+    """
+
+    def __init__(self, binned: bool = False):
+        self.binned = binned
+        self.count: Optional[torch.Tensor] = None
+        self.mean: Optional[torch.Tensor] = None
+        self.m2: Optional[torch.Tensor] = None
+
+    @property
+    def n_bins(self) -> int:
+        return 0 if self.count is None else len(self.count)
+
+    def accumulate(self, x: torch.Tensor, bins: Optional[torch.Tensor] = None):
+        """Fold a chunk of samples ``x`` of shape ``[N, ...]`` into the running moments."""
+        x = x.to(torch.float64)
+        if self.binned:
+            assert bins is not None and bins.shape == x.shape[:1]
+            n_bins = max(self.n_bins, int(bins.max()) + 1) if len(bins) > 0 else 1
+            count = torch.zeros(n_bins, dtype=torch.float64).index_add_(
+                0, bins, torch.ones(len(x), dtype=torch.float64)
+            )
+            total = x.new_zeros((n_bins,) + x.shape[1:]).index_add_(0, bins, x)
+            cnt = count.view((-1,) + (1,) * (x.ndim - 1))
+            mean = total / cnt.clamp(min=1)
+            m2 = x.new_zeros(mean.shape).index_add_(0, bins, (x - mean[bins]).square())
+        else:
+            count = torch.as_tensor([float(len(x))], dtype=torch.float64)
+            if len(x) > 0:
+                mean = x.mean(dim=0, keepdim=True)
+                m2 = (x - mean).square().sum(dim=0, keepdim=True)
+            else:
+                mean = x.new_zeros((1,) + x.shape[1:])
+                m2 = x.new_zeros((1,) + x.shape[1:])
+        self._combine(count, mean, m2)
+        return self
+
+    def merge(self, other: "WelfordAccumulator"):
+        """Merge another accumulator's moments into this one."""
+        assert self.binned == other.binned
+        if other.count is not None:
+            self._combine(other.count, other.mean, other.m2)
+        return self
+
+    def _combine(self, count, mean, m2):
+        if self.count is None:
+            self.count, self.mean, self.m2 = count, mean, m2
+            return
+        n_bins = max(self.n_bins, len(count))
+        count_a, mean_a, m2_a = (
+            _pad_bins(t, n_bins) for t in (self.count, self.mean, self.m2)
+        )
+        count_b, mean_b, m2_b = (_pad_bins(t, n_bins) for t in (count, mean, m2))
+        n = count_a + count_b
+        shape = (-1,) + (1,) * (mean_a.ndim - 1)
+        n_safe = n.clamp(min=1).view(shape)
+        delta = mean_b - mean_a
+        self.mean = mean_a + delta * (count_b.view(shape) / n_safe)
+        self.m2 = m2_a + m2_b + delta.square() * (
+            (count_a * count_b).view(shape) / n_safe
+        )
+        self.count = n
+
+    def std(self, unbiased: bool = True) -> torch.Tensor:
+        shape = (-1,) + (1,) * (self.m2.ndim - 1)
+        dof = self.count - 1 if unbiased else self.count
+        return torch.sqrt(self.m2 / dof.view(shape))
+
+
+class HistogramAccumulator:
+    """Running counts of the distinct values seen, e.g. a neighbor-count histogram."""
+
+    def __init__(self):
+        self.values: Optional[torch.Tensor] = None
+        self.counts: Optional[torch.Tensor] = None
+
+    def accumulate(self, x: torch.Tensor):
+        uniq, counts = torch.unique(torch.flatten(x), return_counts=True, sorted=True)
+        return self._combine(uniq, counts)
+
+    def merge(self, other: "HistogramAccumulator"):
+        if other.values is not None:
+            self._combine(other.values, other.counts)
+        return self
+
+    def _combine(self, values, counts):
+        if self.values is None:
+            self.values, self.counts = values, counts
+            return self
+        values = torch.cat((self.values, values.to(self.values.dtype)))
+        counts = torch.cat((self.counts, counts))
+        self.values, inverse = torch.unique(values, return_inverse=True, sorted=True)
+        self.counts = counts.new_zeros(len(self.values)).index_add_(0, inverse, counts)
+        return self
+
+
+class StreamingStatistics:
+    """Single-pass, mergeable version of ``AtomicInMemoryDataset.statistics``.
+
+    Accepts the same ``fields`` and ``modes`` and returns results in the same format,
+    but consumes the dataset chunk by chunk through ``accumulate``. Two instances
+    built with the same arguments can be combined with ``merge``.
+
+    The only statistic that keeps per-frame state is ``per_species_mean_std`` of a
+    per-graph quantity with the default composition down sampling, which needs the
+    (``n_frames x n_types``) composition matrix for the per-composition quantiles.
+    With ``down_sampling: False`` in its ``kwargs`` only XᵀX and Xᵀy are accumulated.
+    No per-node data is ever retained.
+
+    Args:
+        fields: field names or callables, see ``AtomicInMemoryDataset.statistics``.
+        modes: the statistic to compute for each field.
+        unbiased: whether to use unbiased standard deviations.
+        kwargs: options for individual ``per_species_`` modes, keyed by ``field + mode``.
+    """
+
+    def __init__(
+        self,
+        fields: List[Union[str, Callable]],
+        modes: List[str],
+        unbiased: bool = True,
+        kwargs: Optional[Dict[str, dict]] = {},
+    ):
+        assert len(modes) == len(fields)
+        self.fields = fields
+        self.modes = modes
+        self.unbiased = unbiased
+        self.kwargs = dict(kwargs)
+        self._states: List[Any] = [None] * len(fields)
+        self._dtypes: List[Optional[torch.dtype]] = [None] * len(fields)
+
+    def accumulate(self, data: Dict[str, Any], fixed_fields: Dict[str, Any] = {}):
+        """Fold one (already transformed) batched chunk into the running statistics.
+
+        Args:
+            data: dict of the batched fields of the chunk, as from ``Batch.to_dict()``.
+                Must contain ``AtomicDataDict.BATCH_KEY`` with contiguous graph indexes.
+            fixed_fields: fields that are constant across all frames.
+        """
+        batch = data[AtomicDataDict.BATCH_KEY]
+        num_graphs = int(batch.max()) + 1 if len(batch) > 0 else 0
+        num_nodes = len(batch)
+        num_edges = (
+            data[AtomicDataDict.EDGE_INDEX_KEY].shape[1]
+            if AtomicDataDict.EDGE_INDEX_KEY in data
+            else 0
+        )
+
+        atom_types: Optional[torch.Tensor] = None
+        for ifield, field in enumerate(self.fields):
+            arr, arr_is_per = self._get_field(field, data, fixed_fields)
+            if arr_is_per == "node":
+                arr = arr.view(num_nodes, -1)
+            elif arr_is_per == "graph":
+                arr = arr.view(num_graphs, -1)
+            elif arr_is_per == "edge":
+                arr = arr.view(num_edges, -1)
+            if self._dtypes[ifield] is None:
+                self._dtypes[ifield] = arr.dtype
+
+            ana_mode = self.modes[ifield]
+            state = self._states[ifield]
+            if ana_mode == "count":
+                if state is None:
+                    state = HistogramAccumulator()
+                state.accumulate(arr)
+
+            elif ana_mode == "rms":
+                if state is None:
+                    state = WelfordAccumulator()
+                state.accumulate(arr.reshape(-1, 1).square())
+
+            elif ana_mode == "mean_std":
+                if state is None:
+                    state = WelfordAccumulator()
+                state.accumulate(arr)
+
+            elif ana_mode.startswith("per_atom_"):
+                if arr_is_per != "graph":
+                    raise ValueError(
+                        f"It doesn't make sense to ask for `{ana_mode}` since `{field}` is not per-graph"
+                    )
+                _, N = torch.unique_consecutive(batch, return_counts=True)
+                arr = arr / N.unsqueeze(-1)
+                if state is None:
+                    state = WelfordAccumulator()
+                if ana_mode == "per_atom_mean_std":
+                    state.accumulate(arr)
+                elif ana_mode == "per_atom_rms":
+                    state.accumulate(arr.reshape(-1, 1).square())
+                else:
+                    raise NotImplementedError(
+                        f"{ana_mode[len('per_atom_'):]} for per-atom analysis is not implemented"
+                    )
+
+            elif ana_mode.startswith("per_species_"):
+                if atom_types is None:
+                    if AtomicDataDict.ATOM_TYPE_KEY in data:
+                        atom_types = data[AtomicDataDict.ATOM_TYPE_KEY]
+                    else:
+                        atom_types = fixed_fields[AtomicDataDict.ATOM_TYPE_KEY]
+                        atom_types = (
+                            atom_types.unsqueeze(0)
+                            .expand((num_graphs,) + atom_types.shape)
+                            .reshape(-1)
+                        )
+                    atom_types = atom_types.view(-1)
+                sub_mode = ana_mode[len("per_species_") :]
+                if arr_is_per == "graph":
+                    if sub_mode != "mean_std":
+                        raise NotImplementedError(
+                            f"{sub_mode} for per species analysis is not implemented for shape {arr.shape}"
+                        )
+                    algorithm_kwargs = self.kwargs.get(
+                        self._field_name(ifield) + ana_mode, {}
+                    )
+                    if not algorithm_kwargs.get("down_sampling", True):
+                        # no per-composition quantiles needed: only keep XᵀX and Xᵀy
+                        if state is None:
+                            state = IncrementalRidgeSolver()
+                        state.accumulate(bincount(atom_types, batch), arr)
+                    else:
+                        if state is None:
+                            state = ([], [])
+                        state[0].append(bincount(atom_types, batch))
+                        state[1].append(arr)
+                elif arr_is_per == "node":
+                    if state is None:
+                        state = WelfordAccumulator(binned=True)
+                    if sub_mode == "mean_std":
+                        state.accumulate(arr, bins=atom_types)
+                    elif sub_mode == "rms":
+                        state.accumulate(arr.square(), bins=atom_types)
+                    else:
+                        raise NotImplementedError(
+                            f"{sub_mode} for per species analysis is not implemented"
+                        )
+                else:
+                    raise NotImplementedError
+
+            else:
+                raise NotImplementedError(f"Cannot handle statistics mode {ana_mode}")
+            self._states[ifield] = state
+        return self
+
+    def merge(self, other: "StreamingStatistics"):
+        """Merge the partial statistics of ``other`` (same fields and modes) into this one."""
+        assert len(self.fields) == len(other.fields) and self.modes == other.modes
+        for ifield, (mine, theirs) in enumerate(zip(self._states, other._states)):
+            if theirs is None:
+                continue
+            if self._dtypes[ifield] is None:
+                self._dtypes[ifield] = other._dtypes[ifield]
+            if mine is None:
+                self._states[ifield] = theirs
+            elif isinstance(mine, tuple):
+                mine[0].extend(theirs[0])
+                mine[1].extend(theirs[1])
+            else:
+                mine.merge(theirs)
+        return self
+
+    def result(self) -> List[tuple]:
+        """Return the statistics in the format of ``AtomicInMemoryDataset.statistics``."""
+        out: list = []
+        for ifield, (ana_mode, state) in enumerate(zip(self.modes, self._states)):
+            if state is None:
+                raise RuntimeError("No data has been accumulated")
+            dtype = self._dtypes[ifield]
+            if not dtype.is_floating_point:
+                dtype = torch.get_default_dtype()
+            if ana_mode == "count":
+                out.append((state.values, state.counts))
+            elif ana_mode in ("rms", "per_atom_rms"):
+                out.append((torch.sqrt(state.mean.squeeze()).to(dtype),))
+            elif ana_mode in ("mean_std", "per_atom_mean_std"):
+                out.append(
+                    (
+                        state.mean.squeeze(0).to(dtype),
+                        state.std(unbiased=self.unbiased).squeeze(0).to(dtype),
+                    )
+                )
+            elif isinstance(state, IncrementalRidgeSolver):
+                algorithm_kwargs = self.kwargs.get(
+                    self._field_name(ifield) + ana_mode, {}
+                )
+                mean, cov = state.solve(alpha=algorithm_kwargs.get("alpha", 0.001))
+                out.append((mean.to(dtype), cov.to(dtype)))
+            elif isinstance(state, tuple):
+                # per-species of a per-graph quantity
+                N, arr = state
+                n_types = max(n.shape[1] for n in N)
+                N = torch.cat(
+                    [
+                        torch.nn.functional.pad(n, (0, n_types - n.shape[1]))
+                        for n in N
+                    ],
+                    dim=0,
+                )
+                N = N.type(torch.get_default_dtype())
+                algorithm_kwargs = self.kwargs.get(
+                    self._field_name(ifield) + ana_mode, {}
+                )
+                out.append(solver(N, torch.cat(arr, dim=0), **algorithm_kwargs))
+            elif ana_mode == "per_species_mean_std":
+                out.append(
+                    (
+                        state.mean.to(dtype),
+                        state.std(unbiased=self.unbiased).to(dtype),
+                    )
+                )
+            elif ana_mode == "per_species_rms":
+                square = state.mean
+                for _ in range(square.ndim - 1):
+                    square = square.mean(dim=-1)
+                out.append((torch.sqrt(square).to(dtype),))
+        return out
+
+    def _field_name(self, ifield: int) -> str:
+        field = self.fields[ifield]
+        return field if isinstance(field, str) else ""
+
+    @staticmethod
+    def _get_field(
+        field: Union[str, Callable], data: Dict[str, Any], fixed_fields: Dict[str, Any]
+    ) -> Tuple[torch.Tensor, str]:
+        if callable(field):
+            arr, arr_is_per = field(data)
+            # all statistics must be on floating
+            arr = arr.to(torch.get_default_dtype())
+            assert arr_is_per in ("node", "graph", "edge")
+            return arr, arr_is_per
+
+        if field in fixed_fields:
+            arr = fixed_fields[field]
+        elif field in data:
+            arr = data[field]
+        else:
+            raise RuntimeError(f"The field key `{field}` is not present in this dataset")
+        if field in _NODE_FIELDS:
+            arr_is_per = "node"
+        elif field in _GRAPH_FIELDS:
+            arr_is_per = "graph"
+        elif field in _EDGE_FIELDS:
+            arr_is_per = "edge"
+        else:
+            raise RuntimeError(
+                f"Only per-node and per-graph fields can have statistics computed; `{field}` has not been registered as either. If it is per-node or per-graph, please register it as such using `kim_nequip.data.register_fields`"
+            )
+        if arr is None:
+            raise ValueError(
+                f"Cannot compute statistics over field `{field}` whose value is None!"
+            )
+        if not isinstance(arr, torch.Tensor):
+            if np.issubdtype(arr.dtype, np.floating):
+                arr = torch.as_tensor(arr, dtype=torch.get_default_dtype())
+            else:
+                arr = torch.as_tensor(arr)
+        return arr, arr_is_per
@@ -6,7 +6,8 @@ import functools
 import itertools
 import yaml
 import hashlib
-from os.path import dirname, basename, abspath
+import os
+from os.path import dirname, basename, abspath, isfile
 from typing import Tuple, Dict, Any, List, Callable, Union, Optional, Sequence
 
 import ase
@@ -34,6 +35,8 @@ from kim_nequip.utils.savenload import atomic_write
 from kim_nequip.utils.multiprocessing import num_tasks
 from .transforms import TypeMapper
 from .AtomicData import _process_dict
+from ._statistics import StreamingStatistics
+from ._reorder import reorder_atoms
 
 
 class AtomicDataset(Dataset):
@@ -56,11 +59,51 @@ class AtomicDataset(Dataset):
         stride: int = 1,
         unbiased: bool = True,
         kwargs: Optional[Dict[str, dict]] = {},
+        chunk_size: Optional[int] = None,
+        num_workers: int = 1,
     ) -> List[tuple]:
-        # TODO: If needed, this can eventually be implimented for general AtomicDataset by computing an online running mean and using Welford's method for a stable running standard deviation: https://jonisalonen.com/2013/deriving-welfords-method-for-computing-variance/
-        # That would be needed if we have lazy loading datasets.
-        # TODO: When lazy-loading datasets are implimented, how to deal with statistics, sampling, and subsets?
-        raise NotImplementedError("not implimented for general AtomicDataset yet")
+        """Compute the statistics of ``fields`` in a single streaming pass over the dataset.
+
+        Frames are loaded with ``get``, batched ``chunk_size`` at a time and folded into
+        mergeable Welford accumulators (see ``kim_nequip.data._statistics``), so the
+        dataset never has to be materialized as a whole. The arguments and return
+        values are the same as for ``AtomicInMemoryDataset.statistics``.
+
+        Args:
+            chunk_size: number of frames per chunk. Defaults to 64.
+            num_workers: number of worker processes, each computing partial
+                statistics over an interleaved subset of the chunks.
+        """
+        if len(fields) == 0:
+            return []
+        from kim_nequip.utils._global_options import _get_latest_global_options
+
+        # ^ avoid import loop
+        if chunk_size is None:
+            chunk_size = 64
+        indices = list(self.indices())[::stride]
+        reader = functools.partial(
+            _statistics_reader,
+            world_size=num_workers,
+            dataset=self,
+            indices=indices,
+            chunk_size=chunk_size,
+            stats_kwargs=dict(
+                fields=fields, modes=modes, unbiased=unbiased, kwargs=kwargs
+            ),
+            global_options=_get_latest_global_options(),
+        )
+        if num_workers > 1:
+            # see ASEDataset.get_data for the choice of start method
+            ctx = mp.get_context("forkserver")
+            with ctx.Pool(processes=num_workers) as p:
+                partials = p.map(reader, list(range(num_workers)))
+            stats = partials[0]
+            for partial in partials[1:]:
+                stats.merge(partial)
+        else:
+            stats = reader(rank=0)
+        return stats.result()
 
     @property
     def type_mapper(self) -> Optional[TypeMapper]:
@@ -72,7 +115,9 @@ class AtomicDataset(Dataset):
         pnames = list(inspect.signature(self.__init__).parameters)
         IGNORE_KEYS = {
             # the type mapper is applied after saving, not before, so doesn't matter to cache validity
-            "type_mapper"
+            "type_mapper",
+            # frames are selected from the chunked cache when loading, see AtomicInMemoryDataset
+            "include_frames",
         }
         params = {
             k: getattr(self, k)
@@ -81,7 +126,7 @@ class AtomicDataset(Dataset):
         }
         # Add other relevant metadata:
         params["dtype"] = str(torch.get_default_dtype())
-        params["nequip_version"] = nequip.__version__
+        params["nequip_version"] = kim_nequip.__version__
         return params
 
     @property
@@ -99,6 +144,83 @@ class AtomicDataset(Dataset):
         return f"{self.root}/processed_dataset_{param_hash}"
 
 
+def _hash_files(
+    paths: List[str], prefix_size: Optional[int] = None, block_size: int = 1 << 20
+) -> Tuple[int, str, Optional[str]]:
+    """Content hash of the concatenation of ``paths``.
+
+    Returns:
+        the total size, the sha1 of the whole content, and the sha1 of its first
+        ``prefix_size`` bytes (``None`` if not requested or the content is shorter).
+    """
+    sha1 = hashlib.sha1()
+    prefix_sha1 = None
+    size = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                if prefix_size is not None and size < prefix_size <= size + len(block):
+                    prefix = sha1.copy()
+                    prefix.update(block[: prefix_size - size])
+                    prefix_sha1 = prefix.hexdigest()
+                sha1.update(block)
+                size += len(block)
+    return size, sha1.hexdigest(), prefix_sha1
+
+
+class _ChunkFrames:
+    """The frame indexes that fall into the cache chunks to be (re)processed.
+
+    Supports only ``in``, which is all ``get_data`` implementations need from ``include_frames``.
+    """
+
+    def __init__(
+        self, chunk_size: int, include: Optional[set] = None, exclude: set = set()
+    ):
+        self.chunk_size = chunk_size
+        self.include = include
+        self.exclude = exclude
+
+    def __contains__(self, i) -> bool:
+        chunk = int(i) // self.chunk_size
+        return chunk not in self.exclude and (
+            self.include is None or chunk in self.include
+        )
+
+
+def _statistics_reader(
+    rank: int,
+    world_size: int,
+    dataset: AtomicDataset,
+    indices: List[int],
+    chunk_size: int,
+    stats_kwargs: dict,
+    global_options: dict,
+) -> StreamingStatistics:
+    """Accumulate partial statistics over every ``world_size``-th chunk of ``indices``."""
+    if world_size > 1:
+        from kim_nequip.utils._global_options import _set_global_options
+
+        # ^ avoid import loop
+        _set_global_options(global_options)
+    stats = StreamingStatistics(**stats_kwargs)
+    fixed_fields = getattr(dataset, "fixed_fields", None) or {}
+    if dataset.transform is not None:
+        fixed_fields = dataset.transform(fixed_fields, types_required=False)
+    for start in range(rank * chunk_size, len(indices), world_size * chunk_size):
+        chunk = Batch.from_data_list(
+            [dataset.get(i) for i in indices[start : start + chunk_size]],
+            exclude_keys=fixed_fields.keys(),
+        ).to_dict()
+        if dataset.transform is not None:
+            chunk = dataset.transform(chunk, types_required=False)
+        stats.accumulate(chunk, fixed_fields)
+    return stats
+
+
 class AtomicInMemoryDataset(AtomicDataset):
     r"""Base class for all datasets that fit in memory.
 
@@ -106,6 +228,13 @@ class AtomicInMemoryDataset(AtomicDataset):
     By default, the raw file will be stored at root/raw and the processed torch
     file will be at root/process.
 
+    The processed data is cached in chunks of ``CACHE_CHUNK_SIZE`` consecutive frames,
+    in a directory keyed by the graph-construction parameters (``r_max``, ``pbc``, ...)
+    and validated against a content hash of the raw files. Only the chunks holding
+    ``include_frames`` are processed, and they are reused by later runs that select
+    other frames. If the raw file has only been appended to since the last run, the
+    complete chunks are kept and only the new frames are processed.
+
     Subclasses must implement:
      - ``raw_file_names``
      - ``get_data()``
@@ -121,6 +250,9 @@ class AtomicInMemoryDataset(AtomicDataset):
         extra_fixed_fields (dict, optional): extra key that are not stored in data but needed for AtomicData initialization
         include_frames (list, optional): the frames to process with the constructor.
         type_mapper (TypeMapper): the transformation to map atomic information to species index. Optional
+        reorder_atoms (str, optional): ``"morton"`` or ``"hilbert"`` to sort the atoms of every
+            frame along that space-filling curve, and their edges by destination, when processing.
+            The original atom order is kept in ``AtomicDataDict.ORIGINAL_INDEX_KEY``.
     """
 
     def __init__(
@@ -132,6 +264,7 @@ class AtomicInMemoryDataset(AtomicDataset):
         extra_fixed_fields: Dict[str, Any] = {},
         include_frames: Optional[List[int]] = None,
         type_mapper: Optional[TypeMapper] = None,
+        reorder_atoms: Optional[str] = None,
     ):
         # TO DO, this may be simplified
         # See if a subclass defines some inputs
@@ -146,6 +279,7 @@ class AtomicInMemoryDataset(AtomicDataset):
         self.force_fixed_keys = force_fixed_keys
         self.extra_fixed_fields = extra_fixed_fields
         self.include_frames = include_frames
+        self.reorder_atoms = reorder_atoms
 
         self.data = None
         self.fixed_fields = None
@@ -165,14 +299,9 @@ class AtomicInMemoryDataset(AtomicDataset):
         # Then pre-process the data if disk files are not found
         super().__init__(root=root, type_mapper=type_mapper)
         if self.data is None:
-            self.data, self.fixed_fields, include_frames = torch.load(
-                self.processed_paths[0]
-            )
-            if not np.all(include_frames == self.include_frames):
-                raise ValueError(
-                    f"the include_frames is changed. "
-                    f"please delete the processed folder and rerun {self.processed_paths[0]}"
-                )
+            # the cache exists: check it against the raw data, process what is
+            # missing and load the selected frames
+            self.process()
 
     def len(self):
         if self.data is None:
@@ -183,9 +312,11 @@ class AtomicInMemoryDataset(AtomicDataset):
     def raw_file_names(self):
         raise NotImplementedError()
 
+    CACHE_CHUNK_SIZE: int = 1000
+
     @property
     def processed_file_names(self) -> List[str]:
-        return ["data.pth", "params.yaml"]
+        return ["manifest.yaml", "params.yaml"]
 
     def get_data(
         self,
@@ -214,23 +345,38 @@ class AtomicInMemoryDataset(AtomicDataset):
             if download_path.endswith(".zip"):
                 extract_zip(download_path, self.raw_dir)
 
-    def process(self):
-        data = self.get_data()
+    def _get_data_list(
+        self, frames: "_ChunkFrames"
+    ) -> Tuple[Dict[int, AtomicData], Dict[str, Any], int]:
+        """Build the ``AtomicData`` of the raw frames whose index is ``in frames``.
+
+        Returns:
+            the data keyed by frame index, the fixed fields and the total number of raw frames.
+        """
+        # get_data (e.g. of ASEDataset) only builds the frames in include_frames
+        include_frames = self.include_frames
+        self.include_frames = frames
+        try:
+            data = self.get_data()
+        finally:
+            self.include_frames = include_frames
+
         if len(data) == 1:
 
             # It's a data list
-            data_list = data[0]
-            if not (self.include_frames is None or data[0] is None):
-                data_list = [data_list[i] for i in self.include_frames]
-            assert all(isinstance(e, AtomicData) for e in data_list)
-            assert all(AtomicDataDict.BATCH_KEY not in e for e in data_list)
+            num_frames = len(data[0])
+            data_list = {i: e for i, e in enumerate(data[0]) if i in frames}
+            assert all(isinstance(e, AtomicData) for e in data_list.values())
+            assert all(AtomicDataDict.BATCH_KEY not in e for e in data_list.values())
 
-            fields, fixed_fields = {}, {}
+            fixed_fields = {}
 
             # take the force_fixed_keys away from the fields
-            for key in self.force_fixed_keys:
-                if key in data_list[0]:
-                    fixed_fields[key] = data_list[0][key]
+            if len(data_list) > 0:
+                first = next(iter(data_list.values()))
+                for key in self.force_fixed_keys:
+                    if key in first:
+                        fixed_fields[key] = first[key]
 
             fixed_fields.update(self.extra_fixed_fields)
 
@@ -262,38 +408,150 @@ class AtomicInMemoryDataset(AtomicDataset):
                 raise ValueError(
                     f"This dataset is invalid: expected all fields to have same length (same number of examples), but they had shapes { {f: v.shape for f, v in fields.items() } }"
                 )
-            num_examples = next(iter(num_examples))
+            num_frames = next(iter(num_examples))
+
+            # Make AtomicData from it, converting and validating whole arrays at once:
+            frame_ids = [i for i in range(num_frames) if i in frames]
+            data_list = dict(
+                zip(
+                    frame_ids,
+                    AtomicData.from_frames(
+                        fields, fixed_fields, include_frames=frame_ids
+                    ),
+                )
+            )
 
-            include_frames = self.include_frames
-            if include_frames is None:
-                include_frames = range(num_examples)
+        else:
+            raise ValueError("Invalid return from `self.get_data()`")
 
-            # Make AtomicData from it:
-            if AtomicDataDict.EDGE_INDEX_KEY in all_keys:
-                # This is already a graph, just build it
-                constructor = AtomicData
-            else:
-                # do neighborlist from points
-                constructor = AtomicData.from_points
-                assert "r_max" in all_keys
-                assert AtomicDataDict.POSITIONS_KEY in all_keys
+        if self.reorder_atoms is not None:
+            data_list = {
+                i: reorder_atoms(d, method=self.reorder_atoms)[0]
+                for i, d in data_list.items()
+            }
+            # the atoms of every frame are permuted differently, so their per-node fields
+            # cannot be fixed: they are kept, permuted, in the data of every frame
+            node_keys = [k for k in fixed_fields if k in _NODE_FIELDS]
+            for key in node_keys:
+                if not all(key in d for d in data_list.values()):
+                    raise ValueError(
+                        f"The per-node fixed field `{key}` is not in the data of every "
+                        "frame, so it cannot be permuted with `reorder_atoms`"
+                    )
+                del fixed_fields[key]
 
-            data_list = [
-                constructor(**{**{f: v[i] for f, v in fields.items()}, **fixed_fields})
-                for i in include_frames
-            ]
+        return data_list, fixed_fields, num_frames
 
+    def _chunk_path(self, chunk: int) -> str:
+        return f"{self.processed_dir}/chunk_{chunk}.pth"
+
+    def process(self):
+        chunk_size = self.CACHE_CHUNK_SIZE
+        manifest_path, params_path = self.processed_paths
+        fixed_fields_path = f"{self.processed_dir}/fixed_fields.pth"
+
+        manifest = None
+        if isfile(manifest_path):
+            with open(manifest_path, "r") as f:
+                manifest = yaml.safe_load(f)
+            if manifest.get("chunk_size") != chunk_size:
+                manifest = None
+        raw_size, raw_sha1, prefix_sha1 = _hash_files(
+            self.raw_paths, prefix_size=None if manifest is None else manifest["raw_size"]
+        )
+
+        # which cached chunks (chunk index -> number of frames) are still valid
+        chunks: Dict[int, int] = {}
+        num_frames: Optional[int] = None
+        if manifest is not None:
+            if manifest["raw_sha1"] == raw_sha1:
+                chunks = manifest["chunks"]
+                num_frames = manifest["num_frames"]
+            elif raw_size > manifest["raw_size"] and prefix_sha1 == manifest["raw_sha1"]:
+                # frames were only appended: complete chunks are unchanged
+                chunks = {c: n for c, n in manifest["chunks"].items() if n == chunk_size}
+                logging.info(
+                    f"Raw data was appended to, reusing {len(chunks)} cached chunks"
+                )
+            for c in set(manifest["chunks"]) - set(chunks):
+                if isfile(self._chunk_path(c)):
+                    os.remove(self._chunk_path(c))
+
+        if self.include_frames is None:
+            wanted = None
+            if num_frames is not None:
+                wanted = set(range((num_frames + chunk_size - 1) // chunk_size))
         else:
-            raise ValueError("Invalid return from `self.get_data()`")
+            wanted = {int(i) // chunk_size for i in self.include_frames}
 
-        # Batch it for efficient saving
+        if wanted is None or not wanted.issubset(chunks):
+            frames = _ChunkFrames(
+                chunk_size,
+                include=None if wanted is None else wanted - set(chunks),
+                exclude=set(chunks),
+            )
+            data_list, fixed_fields, num_frames = self._get_data_list(frames)
+
+            # type conversion
+            _process_dict(fixed_fields, ignore_fields=["r_max"])
+
+            # Batch each chunk for efficient saving
+            new_chunks: Dict[int, List[AtomicData]] = {}
+            for i in sorted(data_list.keys()):
+                new_chunks.setdefault(i // chunk_size, []).append(data_list[i])
+            del data_list
+            for c, chunk_list in new_chunks.items():
+                # use atomic writes to avoid race conditions between
+                # different trainings that use the same dataset
+                # since those separate trainings should all produce the same results,
+                # it doesn't matter if they overwrite each others cached'
+                # datasets. It only matters that they don't simultaneously try
+                # to write the _same_ file, corrupting it.
+                with atomic_write(self._chunk_path(c), binary=True) as f:
+                    torch.save(
+                        Batch.from_data_list(
+                            chunk_list, exclude_keys=fixed_fields.keys()
+                        ),
+                        f,
+                    )
+                chunks[c] = len(chunk_list)
+            with atomic_write(fixed_fields_path, binary=True) as f:
+                torch.save(fixed_fields, f)
+            with atomic_write(manifest_path, binary=False) as f:
+                yaml.dump(
+                    dict(
+                        raw_size=raw_size,
+                        raw_sha1=raw_sha1,
+                        num_frames=num_frames,
+                        chunk_size=chunk_size,
+                        chunks=chunks,
+                    ),
+                    f,
+                )
+            with atomic_write(params_path, binary=False) as f:
+                yaml.dump(self._get_parameters(), f)
+            logging.info(f"Cached {len(new_chunks)} processed chunks to disk")
+            del new_chunks
+        else:
+            fixed_fields = torch.load(fixed_fields_path)
+
+        # Load the selected frames from the cached chunks
+        include_frames = self.include_frames
+        if include_frames is None:
+            include_frames = range(num_frames)
+        loaded: Dict[int, Batch] = {}
+        data_list = []
+        for i in include_frames:
+            c = int(i) // chunk_size
+            if c not in loaded:
+                loaded[c] = torch.load(self._chunk_path(c))
+            data_list.append(loaded[c].get_example(int(i) - c * chunk_size))
+        del loaded
+
+        # Batch it for efficient access
         # This limits an AtomicInMemoryDataset to a maximum of LONG_MAX atoms _overall_, but that is a very big number and any dataset that large is probably not "InMemory" anyway
         data = Batch.from_data_list(data_list, exclude_keys=fixed_fields.keys())
         del data_list
-        del fields
-
-        # type conversion
-        _process_dict(fixed_fields, ignore_fields=["r_max"])
 
         total_MBs = sum(item.numel() * item.element_size() for _, item in data) / (
             1024 * 1024
@@ -303,19 +561,6 @@ class AtomicInMemoryDataset(AtomicDataset):
         )
         del total_MBs
 
-        # use atomic writes to avoid race conditions between
-        # different trainings that use the same dataset
-        # since those separate trainings should all produce the same results,
-        # it doesn't matter if they overwrite each others cached'
-        # datasets. It only matters that they don't simultaneously try
-        # to write the _same_ file, corrupting it.
-        with atomic_write(self.processed_paths[0], binary=True) as f:
-            torch.save((data, fixed_fields, self.include_frames), f)
-        with atomic_write(self.processed_paths[1], binary=False) as f:
-            yaml.dump(self._get_parameters(), f)
-
-        logging.info("Cached processed data to disk")
-
         self.data = data
         self.fixed_fields = fixed_fields
 
@@ -333,6 +578,8 @@ class AtomicInMemoryDataset(AtomicDataset):
         stride: int = 1,
         unbiased: bool = True,
         kwargs: Optional[Dict[str, dict]] = {},
+        chunk_size: Optional[int] = None,
+        num_workers: int = 1,
     ) -> List[tuple]:
         """Compute the statistics of ``fields`` in the dataset.
 
@@ -365,6 +612,12 @@ class AtomicInMemoryDataset(AtomicDataset):
 
             kwargs: other options for individual statistics modes.
 
+            chunk_size: if given, compute the statistics in a single streaming pass over
+                chunks of this many frames (see ``AtomicDataset.statistics``) instead of
+                on the fully materialized, transformed fields.
+
+            num_workers: number of worker processes for the streaming pass.
+
         Returns:
             List of statistics. For fields of floating dtype the statistics are the two-tuple (mean, std); for fields of integer dtype the statistics are a one-tuple (bincounts,)
         """
@@ -374,6 +627,17 @@ class AtomicInMemoryDataset(AtomicDataset):
         if len(fields) == 0:
             return []
 
+        if chunk_size is not None or num_workers > 1:
+            return super().statistics(
+                fields=fields,
+                modes=modes,
+                stride=stride,
+                unbiased=unbiased,
+                kwargs=kwargs,
+                chunk_size=chunk_size,
+                num_workers=num_workers,
+            )
+
         if self._indices is not None:
             graph_selector = torch.as_tensor(self._indices)[::stride]
             # note that self._indices is _not_ necessarily in order,
@@ -699,6 +963,7 @@ class NpzDataset(AtomicInMemoryDataset):
         extra_fixed_fields: Dict[str, Any] = {},
         include_frames: Optional[List[int]] = None,
         type_mapper: TypeMapper = None,
+        reorder_atoms: Optional[str] = None,
     ):
         self.key_mapping = key_mapping
         self.npz_fixed_field_keys = npz_fixed_field_keys
@@ -712,6 +977,7 @@ class NpzDataset(AtomicInMemoryDataset):
             extra_fixed_fields=extra_fixed_fields,
             include_frames=include_frames,
             type_mapper=type_mapper,
+            reorder_atoms=reorder_atoms,
         )
 
     @property
@@ -867,6 +1133,7 @@ class ASEDataset(AtomicInMemoryDataset):
         type_mapper: TypeMapper = None,
         key_mapping: Optional[dict] = None,
         include_keys: Optional[List[str]] = None,
+        reorder_atoms: Optional[str] = None,
     ):
         self.ase_args = {}
         self.ase_args.update(getattr(type(self), "ASE_ARGS", dict()))
@@ -885,6 +1152,7 @@ class ASEDataset(AtomicInMemoryDataset):
             extra_fixed_fields=extra_fixed_fields,
             include_frames=include_frames,
             type_mapper=type_mapper,
+            reorder_atoms=reorder_atoms,
         )
 
     @classmethod
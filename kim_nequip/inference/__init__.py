@@ -0,0 +1,17 @@
+from ._batching import BatchedEvaluator, pack, bucket_size
+from ._domain import decompose, partition
+from ._incremental import IncrementalEnergy
+from ._partial import partial_forces
+from ._hessian import hessian, frequencies
+
+__all__ = [
+    BatchedEvaluator,
+    pack,
+    bucket_size,
+    decompose,
+    partition,
+    IncrementalEnergy,
+    partial_forces,
+    hessian,
+    frequencies,
+]
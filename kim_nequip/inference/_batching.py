@@ -0,0 +1,228 @@
+"""Evaluation of many configurations of different sizes with the batched model.
+
+The configurations are packed into batches under a budget of atoms and edges
+(first-fit decreasing), concatenated with ``Batch.from_data_list`` and evaluated
+by the model exported with ``kim-nequip-port --batched-model``. Every batch is
+padded up to one of a few geometrically growing sizes, so that the TorchScript
+executor only ever sees a small set of shapes.
+"""
+import math
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import torch
+
+import ase
+
+from kim_nequip.data import AtomicData, driver_graph, driver_graph_from_data
+from kim_nequip.utils.torch_geometric import Batch, Data
+
+
+def bucket_size(n: int, base: int = 64, growth: float = 1.5) -> int:
+    """The smallest ``ceil(base * growth**k)`` that is at least ``n``."""
+    if n <= base:
+        return base
+    k = math.ceil(math.log(n / base) / math.log(growth) - 1e-9)
+    return int(math.ceil(base * growth**k))
+
+
+def pack(
+    sizes: Sequence[Tuple[int, int]],
+    max_atoms: int,
+    max_edges: Optional[int] = None,
+) -> List[List[int]]:
+    """Group items into bins of at most ``max_atoms`` atoms and ``max_edges`` edges.
+
+    Uses first-fit decreasing on the number of atoms; an item larger than the budget
+    gets a bin of its own.
+
+    Args:
+        sizes: ``(n_atoms, n_edges)`` of every item
+
+    Returns:
+        the indices of the items in every bin
+    """
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i][0], reverse=True)
+    bins: List[List[int]] = []
+    loads: List[List[int]] = []
+    for i in order:
+        n_atoms, n_edges = sizes[i]
+        for b, (atoms, edges) in enumerate(loads):
+            if atoms + n_atoms <= max_atoms and (
+                max_edges is None or edges + n_edges <= max_edges
+            ):
+                bins[b].append(i)
+                loads[b] = [atoms + n_atoms, edges + n_edges]
+                break
+        else:
+            bins.append([i])
+            loads.append([n_atoms, n_edges])
+    return bins
+
+
+class BatchedEvaluator:
+    """Energies and forces of many configurations with a batched model.
+
+    Args:
+        model: the model exported with ``--batched-model``, or the path to it
+        r_max: cutoff of a convolution
+        n_layers: number of convolutions of the model
+        species: chemical symbols of the types of the model, in order; needed for ``ase.Atoms``
+        max_atoms: budget of atoms (contributing and padding) per batch
+        max_edges: budget of edges, summed over the edge graphs, per batch
+        pad: pad every batch to a bucket size of atoms and of edges of every graph
+        bucket_base: smallest bucket of atoms; that of the edges of a graph is ``bucket_base``
+            times the average number of edges per atom and graph of the configurations
+        bucket_growth: ratio between consecutive buckets
+        device: device to run the model on
+    """
+
+    def __init__(
+        self,
+        model: Union[str, torch.jit.ScriptModule],
+        r_max: float,
+        n_layers: int,
+        species: Optional[List[str]] = None,
+        max_atoms: int = 4096,
+        max_edges: Optional[int] = None,
+        pad: bool = True,
+        bucket_base: int = 64,
+        bucket_growth: float = 1.5,
+        device: Union[str, torch.device] = "cpu",
+    ):
+        if isinstance(model, str):
+            model = torch.jit.load(model, map_location=device)
+        self.model = model.to(device)
+        self.model.eval()
+        self.r_max = float(r_max)
+        self.n_layers = int(n_layers)
+        self.species = species
+        self.max_atoms = max_atoms
+        self.max_edges = max_edges
+        self.pad = pad
+        self.bucket_base = bucket_base
+        self.bucket_growth = bucket_growth
+        self.device = torch.device(device)
+        self.dtype = next(
+            (b.dtype for b in self.model.buffers() if b.is_floating_point()),
+            torch.float64,
+        )
+
+    def graph(self, config: Union[ase.Atoms, AtomicData]) -> Dict:
+        """The ``driver_graph`` of an ``ase.Atoms`` or a single-frame ``AtomicData``."""
+        if isinstance(config, ase.Atoms):
+            if self.species is None:
+                raise ValueError("`species` is needed to evaluate ase.Atoms")
+            return driver_graph(
+                config.positions,
+                [self.species.index(s) for s in config.get_chemical_symbols()],
+                r_max=self.r_max,
+                n_layers=self.n_layers,
+                cell=config.cell[:],
+                pbc=tuple(config.pbc),
+            )
+        return driver_graph_from_data(config, r_max=self.r_max, n_layers=self.n_layers)
+
+    def _batch(self, graphs: List[Dict], edge_base: int) -> Batch:
+        data_list = []
+        for g in graphs:
+            fields = {f"edge_index{k}": e for k, e in enumerate(g["edge_indices"])}
+            data = Data(
+                species=g["species"].view(-1, 1),
+                pos=g["coords"].to(self.dtype),
+                contributing=g["contributing"],
+                **fields,
+            )
+            data.num_nodes = len(g["coords"])
+            data_list.append(data)
+        batch = Batch.from_data_list(data_list)
+        if self.pad:
+            self._pad(batch, edge_base)
+        return batch
+
+    def _pad(self, batch: Batch, edge_base: int):
+        """Append atoms, far from the configurations, and edges between two of them.
+
+        The padding atoms are not contributing and only connected to each other, so they
+        change neither the energies nor the forces. The padding edges all join the first
+        and the last padding atom, placed at half the cutoff from each other: the model
+        drops the edges beyond the cutoff (unless exported with ``--keep-all-edges``), and
+        these are kept, so every graph of the batch keeps its bucket size.
+        """
+        n = batch.num_nodes
+        n_pad = bucket_size(n + 2, self.bucket_base, self.bucket_growth) - n
+        lo = batch.pos.min().item() - 2 * self.r_max
+        pad_pos = torch.zeros((n_pad, 3), dtype=batch.pos.dtype)
+        pad_pos[:, 0] = lo - 2 * self.r_max * torch.arange(n_pad, dtype=batch.pos.dtype)
+        # the other end of the padding edges, within the cutoff of the first padding atom only
+        pad_pos[-1] = torch.tensor([lo, 0.5 * self.r_max, 0.0], dtype=batch.pos.dtype)
+        batch.pos = torch.cat([batch.pos, pad_pos])
+        batch.species = torch.cat([batch.species, batch.species.new_zeros((n_pad, 1))])
+        batch.contributing = torch.cat(
+            [batch.contributing, batch.contributing.new_ones(n_pad)]
+        )
+        batch.batch = torch.cat(
+            [batch.batch, batch.batch.new_full((n_pad,), int(batch.batch[-1]))]
+        )
+        for k in range(self.n_layers):
+            e = batch[f"edge_index{k}"]
+            e_pad = bucket_size(e.shape[1], edge_base, self.bucket_growth) - e.shape[1]
+            # into the first padding atom, so the edges stay sorted by destination
+            pad_edges = torch.stack(
+                [
+                    torch.full((e_pad,), n, dtype=e.dtype),
+                    torch.full((e_pad,), n + n_pad - 1, dtype=e.dtype),
+                ]
+            )
+            batch[f"edge_index{k}"] = torch.cat([e, pad_edges], dim=1)
+        batch.num_nodes = n + n_pad
+
+    def __call__(
+        self, configs: Sequence[Union[ase.Atoms, AtomicData]], forces: bool = True
+    ) -> Dict:
+        """Evaluate ``configs``.
+
+        Args:
+            configs: the configurations
+            forces: if False, only the energies are computed, without autograd
+
+        Returns:
+            dict with ``"energy"``, a [n_config] tensor, and ``"forces"``, a list of
+            [n_atom, 3] tensors (``None`` if ``forces`` is False), both in the order of
+            ``configs``, and ``"batches"``, the indices of the configurations in every batch.
+        """
+        graphs = [self.graph(c) for c in configs]
+        sizes = [
+            (len(g["coords"]), sum(e.shape[1] for e in g["edge_indices"]))
+            for g in graphs
+        ]
+        bins = pack(sizes, self.max_atoms, self.max_edges)
+        edges_per_atom = sum(s[1] for s in sizes) / max(1, sum(s[0] for s in sizes))
+        edge_base = max(1, int(self.bucket_base * edges_per_atom / self.n_layers))
+
+        energies = torch.zeros(len(configs), dtype=self.dtype)
+        all_forces: List[Optional[torch.Tensor]] = [None] * len(configs)
+        for members in bins:
+            batch = self._batch([graphs[i] for i in members], edge_base).to(self.device)
+            inputs = (
+                batch.species,
+                batch.pos.requires_grad_(forces),
+                *[batch[f"edge_index{k}"] for k in range(self.n_layers)],
+                batch.contributing,
+                batch.batch,
+            )
+            if not forces:
+                e = self.model.energies(*inputs).cpu()
+                for j, i in enumerate(members):
+                    energies[i] = e[j]
+                continue
+            e, f = self.model(*inputs)
+            e, f = e.detach().cpu(), f.detach().cpu()
+            ptr = batch.ptr.cpu()
+            for j, i in enumerate(members):
+                g = graphs[i]
+                n_atoms = int((g["contributing"] == 0).sum())
+                energies[i] = e[j]
+                all_forces[i] = torch.zeros((n_atoms, 3), dtype=f.dtype).index_add_(
+                    0, g["image"], f[ptr[j] : ptr[j + 1]]
+                )
+        return {"energy": energies, "forces": all_forces, "batches": bins}
@@ -0,0 +1,190 @@
+"""Emulation of the spatial domain decomposition of a parallel MD code.
+
+A parallel run with the KIM driver gives every process the atoms of its
+subdomain as contributing atoms and those of a halo around it as padding atoms.
+The exported model computes the energy of the contributing atoms and the forces
+on all of them, and the forces on the padding atoms are sent back to their
+owners. This module does the same with a pool of processes on one machine and
+compares the result with that of a single domain, to check a model and tune the
+decomposition and the halo before running at scale.
+"""
+import functools
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+import ase
+
+from kim_nequip.data import driver_graph, subdomain_graphs
+from kim_nequip.utils.multiprocessing import num_tasks
+
+
+def partition(atoms: ase.Atoms, grid: Sequence[int]) -> List[np.ndarray]:
+    """Split the atoms into the ``grid[0] x grid[1] x grid[2]`` cells of a regular grid of the simulation cell.
+
+    Returns:
+        the indices of the atoms of every subdomain, empty subdomains included
+    """
+    grid = np.asarray(grid, dtype=np.int64)
+    frac = atoms.cell.scaled_positions(atoms.positions)
+    # wrap along the periodic directions, clamp along the others
+    frac = np.where(atoms.pbc, frac % 1.0, np.clip(frac, 0.0, 1.0 - 1e-12))
+    cell_index = np.minimum((frac * grid).astype(np.int64), grid - 1)
+    domain = np.ravel_multi_index(cell_index.T, grid)
+    return [np.flatnonzero(domain == d) for d in range(int(np.prod(grid)))]
+
+
+_MODELS = {}
+
+
+def _evaluate(
+    graph: Dict, model_path: str, repeats: int = 1, threads: int = 1
+) -> Tuple[float, np.ndarray, float]:
+    """Energy of the contributing atoms of ``graph``, forces on all its atoms, and the best time of ``repeats`` calls."""
+    torch.set_num_threads(threads)
+    if model_path not in _MODELS:
+        _MODELS[model_path] = torch.jit.load(model_path)
+    model = _MODELS[model_path]
+    dtype = next(
+        (b.dtype for b in model.buffers() if b.is_floating_point()), torch.float64
+    )
+    best = float("inf")
+    for _ in range(repeats):
+        coords = graph["coords"].to(dtype).requires_grad_(True)
+        start = time.perf_counter()
+        energy, forces = model(
+            graph["species"].view(-1, 1),
+            coords,
+            *graph["edge_indices"],
+            graph["contributing"],
+        )
+        best = min(best, time.perf_counter() - start)
+    return float(energy.detach()), forces.detach().cpu().numpy(), best
+
+
+def decompose(
+    atoms: ase.Atoms,
+    model_path: str,
+    r_max: float,
+    n_layers: int,
+    species: List[str],
+    grid: Sequence[int] = (2, 2, 2),
+    halo: Optional[float] = None,
+    n_workers: Optional[int] = None,
+    repeats: int = 3,
+) -> Dict:
+    """Run ``atoms`` on ``grid`` subdomains in a pool of processes, and compare with a single domain.
+
+    Args:
+        atoms: the configuration
+        model_path: the exported model; every worker loads it
+        r_max: cutoff of a convolution
+        n_layers: number of convolutions of the model
+        species: chemical symbols of the types of the model, in order
+        grid: number of subdomains along each cell vector
+        halo: width of the halos, by default the influence distance ``n_layers * r_max``
+        n_workers: size of the pool, by default the number of subdomains, capped by ``num_tasks()``
+        repeats: every evaluation is timed as the best of that many calls, the first of
+            which also compiles the model
+
+    Returns:
+        dict with
+
+        - ``energy`` and ``forces``: stitched from the subdomains
+        - ``reference_energy`` and ``reference_forces``: of the single domain
+        - ``energy_deviation`` and ``max_force_deviation``: absolute differences between the two
+        - ``domain_atoms``: [n_domain, 2] contributing and padding atoms of every subdomain
+        - ``domain_times``: time of every subdomain
+        - ``serial_time``: time of the single domain
+        - ``parallel_time``: estimated time of the parallel run, with the subdomains dealt
+          round-robin to the workers, each on its own core (the compute times are measured
+          in the workers, so this does not depend on the cores of this machine)
+        - ``wall_time``: measured time of the pool, including its startup and all repeats
+        - ``speedup`` and ``parallel_efficiency``: ``serial_time / parallel_time``, and divided
+          by the number of workers
+        - ``halo_overhead``: number of atoms of all the subdomains over that of the configuration
+        - ``load_imbalance``: slowest over average subdomain time
+    """
+    types = [species.index(s) for s in atoms.get_chemical_symbols()]
+    n_atoms = len(atoms)
+    domains = [d for d in partition(atoms, grid) if len(d) > 0]
+    graphs = subdomain_graphs(
+        atoms.positions,
+        types,
+        domains,
+        r_max=r_max,
+        n_layers=n_layers,
+        cell=atoms.cell[:],
+        pbc=tuple(atoms.pbc),
+        halo=halo,
+    )
+    if n_workers is None:
+        n_workers = min(len(domains), num_tasks())
+    evaluate = functools.partial(_evaluate, model_path=model_path, repeats=repeats)
+
+    # reference: one domain with all the atoms
+    reference = driver_graph(
+        atoms.positions,
+        types,
+        r_max=r_max,
+        n_layers=n_layers,
+        cell=atoms.cell[:],
+        pbc=tuple(atoms.pbc),
+    )
+    ref_energy, ref_forces, serial_time = evaluate(reference)
+    ref_forces = _fold(ref_forces, reference["image"], n_atoms)
+
+    start = time.perf_counter()
+    if n_workers > 1:
+        # see ASEDataset.get_data for the choice of start method
+        ctx = mp.get_context("forkserver")
+        with ctx.Pool(processes=n_workers) as p:
+            results = p.map(evaluate, graphs, chunksize=1)
+    else:
+        results = [evaluate(g) for g in graphs]
+    wall_time = time.perf_counter() - start
+
+    energy = sum(r[0] for r in results)
+    forces = np.zeros((n_atoms, 3))
+    for g, (_, f, _) in zip(graphs, results):
+        forces += _fold(f, g["image"], n_atoms)
+
+    domain_times = np.array([r[2] for r in results])
+    # the subdomains are dealt round-robin to the workers
+    worker_times = np.zeros(n_workers)
+    for d, t in enumerate(domain_times):
+        worker_times[d % n_workers] += t
+    parallel_time = float(worker_times.max())
+    speedup = serial_time / parallel_time
+    domain_atoms = np.array(
+        [
+            [int((g["contributing"] == 0).sum()), int((g["contributing"] != 0).sum())]
+            for g in graphs
+        ]
+    )
+    return {
+        "energy": energy,
+        "forces": forces,
+        "reference_energy": ref_energy,
+        "reference_forces": ref_forces,
+        "energy_deviation": abs(energy - ref_energy),
+        "max_force_deviation": float(np.abs(forces - ref_forces).max()),
+        "domain_atoms": domain_atoms,
+        "domain_times": domain_times,
+        "serial_time": serial_time,
+        "parallel_time": parallel_time,
+        "wall_time": wall_time,
+        "speedup": speedup,
+        "parallel_efficiency": speedup / n_workers,
+        "halo_overhead": float(domain_atoms.sum()) / n_atoms,
+        "load_imbalance": float(domain_times.max() / domain_times.mean()),
+    }
+
+
+def _fold(forces: np.ndarray, image: torch.Tensor, n_atoms: int) -> np.ndarray:
+    out = np.zeros((n_atoms, 3))
+    np.add.at(out, image.numpy(), forces)
+    return out
@@ -0,0 +1,180 @@
+"""Hessians of the exported models from batched Hessian-vector products.
+
+The gradient of the energy is computed once with ``create_graph``, and the
+Hessian is then probed with many directions per backward pass (see
+``kim_nequip.nn.batched_vjp``). The block of two atoms can only be nonzero if
+they are within ``2 * n_layers * r_max`` of each other, so atoms further apart
+than twice that distance can be displaced together in one direction and their
+columns told apart afterwards (a distance-2 coloring, as for compressed
+Jacobians). For supercells much larger than this distance, the number of
+directions no longer grows with the number of atoms.
+"""
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import torch
+
+import ase
+import ase.neighborlist
+import ase.units
+
+from kim_nequip.data import driver_graph
+from kim_nequip.nn import batched_vjp
+
+from ._partial import _network
+
+
+def _pairs(atoms: ase.Atoms, cutoff: float) -> np.ndarray:
+    """[n_pair, 2] unique pairs of atoms, self-pairs included, with an image within ``cutoff``."""
+    n = len(atoms)
+    cell_lengths = np.linalg.norm(atoms.cell[:], axis=1)
+    if all(atoms.pbc) and cutoff >= 0.5 * cell_lengths.sum():
+        # every point of the cell is that close to an image of every other
+        i, j = np.meshgrid(np.arange(n), np.arange(n), indexing="ij")
+        return np.stack([i.ravel(), j.ravel()], axis=1)
+    i, j = ase.neighborlist.neighbor_list("ij", atoms, cutoff, self_interaction=False)
+    pairs = np.concatenate(
+        [np.stack([i, j], axis=1), np.stack([np.arange(n)] * 2, axis=1)]
+    )
+    return np.unique(pairs, axis=0)
+
+
+def _coloring(n: int, conflicts: np.ndarray) -> np.ndarray:
+    """Greedy coloring of ``n`` nodes, so that no pair of ``conflicts`` has the same color."""
+    order = np.argsort(conflicts[:, 0], kind="stable")
+    conflicts = conflicts[order]
+    ptr = np.searchsorted(conflicts[:, 0], np.arange(n + 1))
+    color = np.full(n, -1, dtype=np.int64)
+    for a in range(n):
+        used = set(color[conflicts[ptr[a] : ptr[a + 1], 1]].tolist())
+        c = 0
+        while c in used:
+            c += 1
+        color[a] = c
+    return color
+
+
+def hessian(
+    model: Union[str, torch.nn.Module],
+    atoms: ase.Atoms,
+    r_max: float,
+    n_layers: int,
+    species: List[str],
+    cutoff: Optional[float] = None,
+    batch_size: Optional[int] = None,
+    dense: bool = False,
+) -> Dict:
+    """Hessian of the energy w.r.t. the positions of the atoms of a configuration.
+
+    Args:
+        model: the exported model or the path to it, or a ``KLIFFGraphNetwork``
+        atoms: the configuration; with periodic boundary conditions, the Hessian is that
+            of the atoms of the cell, each moved with all its images
+        r_max: cutoff of a convolution
+        n_layers: number of convolutions of the model
+        species: chemical symbols of the types of the model, in order
+        cutoff: distance beyond which the blocks are taken as zero, by default
+            ``2 * n_layers * r_max``, beyond which they are. A shorter one gives fewer
+            directions, but adds the blocks it drops onto the kept ones of other atoms.
+        batch_size: number of directions per backward pass, by default 1 on CPU, where
+            vmapping the backward pass is no faster than looping, and 32 on GPU
+        dense: also return the [3n_atom, 3n_atom] matrix
+
+    Returns:
+        dict with
+
+        - ``pairs``: [n_pair, 2] atoms of the blocks, self-pairs included
+        - ``blocks``: [n_pair, 3, 3] ``d2E / dr_a dr_b`` of every pair ``(a, b)``
+        - ``colors``: color of every atom; ``3 * max(colors + 1)`` directions were used
+        - ``hessian``: the dense matrix, if ``dense``
+    """
+    if isinstance(model, str):
+        model = torch.jit.load(model)
+    net, scale = _network(model)
+    buffer = next(b for b in net.buffers() if b.is_floating_point())
+    dtype, device = buffer.dtype, buffer.device
+    n = len(atoms)
+    if batch_size is None:
+        batch_size = 32 if device.type == "cuda" else 1
+    if cutoff is None:
+        cutoff = 2 * n_layers * r_max
+
+    pairs = _pairs(atoms, cutoff)
+    # two atoms within 2 * cutoff may both reach a third one, so need different colors
+    colors = _coloring(n, _pairs(atoms, 2 * cutoff))
+    n_colors = int(colors.max()) + 1
+
+    g = driver_graph(
+        atoms.positions,
+        [species.index(s) for s in atoms.get_chemical_symbols()],
+        r_max=r_max,
+        n_layers=n_layers,
+        cell=atoms.cell[:],
+        pbc=tuple(atoms.pbc),
+    )
+    g = {k: v.to(device) if isinstance(v, torch.Tensor) else v for k, v in g.items()}
+    pos = torch.as_tensor(atoms.positions, dtype=dtype, device=device).requires_grad_(True)
+    # every atom moves with all its images
+    offset = g["coords"].to(dtype) - pos.detach()[g["image"]]
+    coords = pos[g["image"]] + offset
+    # the exported model is in eval mode, where the segment aggregation uses
+    # torch.segment_reduce, which has no double backward; train mode does not
+    training = net.training
+    net.train()
+    try:
+        energy = scale * net(
+            g["species"].view(-1, 1),
+            coords,
+            *[e.to(device) for e in g["edge_indices"]],
+            g["contributing"],
+        )
+    finally:
+        net.train(training)
+    (grad,) = torch.autograd.grad([energy], [pos], create_graph=True)
+
+    # one direction per color and Cartesian component: all the atoms of the color moved along it
+    color = torch.as_tensor(colors, device=device)
+    directions = torch.zeros((n_colors, 3, n, 3), dtype=dtype, device=device)
+    atom_index = torch.arange(n, device=device)
+    for alpha in range(3):
+        directions[color, alpha, atom_index, alpha] = 1.0
+    directions = directions.view(3 * n_colors, n, 3)
+    products = torch.cat(
+        [
+            batched_vjp(
+                grad, pos, directions[k : k + batch_size], batched=batch_size > 1
+            ).detach()
+            for k in range(0, len(directions), batch_size)
+        ]
+    ).view(n_colors, 3, n, 3)
+
+    # the row of atom a in the product of the color of b is the column of b
+    a = torch.as_tensor(pairs[:, 0], device=device)
+    b = torch.as_tensor(pairs[:, 1], device=device)
+    blocks = products[color[b], :, a, :].transpose(1, 2)
+    result = {
+        "energy": float(energy.detach()),
+        "pairs": pairs,
+        "blocks": blocks,
+        "colors": colors,
+    }
+    if dense:
+        full = torch.zeros((n, 3, n, 3), dtype=dtype, device=device)
+        full[a, :, b, :] = blocks
+        result["hessian"] = full.view(3 * n, 3 * n)
+    return result
+
+
+def frequencies(hessian: torch.Tensor, masses: np.ndarray) -> np.ndarray:
+    """Vibrational frequencies, in cm^-1 as in ``ase.vibrations``, of a dense Hessian in eV/Å^2.
+
+    Imaginary frequencies are returned as negative numbers.
+    """
+    m = np.repeat(np.asarray(masses, dtype=np.float64), 3) ** -0.5
+    h = np.asarray(hessian, dtype=np.float64)
+    h = 0.5 * (h + h.T) * m[:, None] * m[None, :]
+    eig = np.linalg.eigvalsh(h)
+    # as in ase.vibrations.VibrationsData
+    s = ase.units._hbar * 1e10 / np.sqrt(ase.units._e * ase.units._amu)
+    energies = s * np.sign(eig) * np.sqrt(np.abs(eig))
+    return energies / ase.units.invcm
@@ -0,0 +1,318 @@
+"""Incremental energies of local moves, for Monte Carlo.
+
+Moving (or changing the species of) a few atoms only changes the node features
+of the atoms within ``k`` hops of them after the ``k``-th convolution, and so
+only the energies of the atoms within ``n_layers`` hops. ``IncrementalEnergy``
+keeps the node features of every layer of the current configuration, and for a
+proposed move recomputes each convolution on the subgraph of the atoms it
+changes (and their neighbors), which costs O(neighbors**n_layers) instead of
+O(n_atoms).
+"""
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import torch
+
+import ase
+
+from kim_nequip.data import driver_graph
+from kim_nequip.nn._segment import segment_lengths
+
+
+def _csr(index: torch.Tensor, n: int):
+    """``(ptr, order)`` such that ``order[ptr[i]:ptr[i + 1]]`` are the positions of ``i`` in ``index``."""
+    order = torch.sort(index, stable=True)[1]
+    ptr = index.new_zeros(n + 1)
+    ptr[1:] = torch.cumsum(torch.bincount(index, minlength=n), 0)
+    return ptr, order
+
+
+def _select(ptr: torch.Tensor, order: torch.Tensor, nodes: torch.Tensor) -> torch.Tensor:
+    """Positions of all of ``nodes`` in the index of ``_csr``, grouped by node."""
+    start = ptr[nodes]
+    count = ptr[nodes + 1] - start
+    first = torch.cumsum(count, 0) - count
+    offset = torch.repeat_interleave(start - first, count)
+    return order[offset + torch.arange(len(offset), device=offset.device)]
+
+
+def _patch(
+    base: torch.Tensor, rows: torch.Tensor, values: torch.Tensor, index: torch.Tensor
+) -> torch.Tensor:
+    """``base[index]``, with the (sorted) ``rows`` of ``base`` replaced by ``values``."""
+    out = base[index]
+    at = torch.searchsorted(rows, index).clamp(max=len(rows) - 1)
+    hit = rows[at] == index
+    out[hit] = values[at[hit]]
+    return out
+
+
+class IncrementalEnergy:
+    """Energy of a configuration and energy changes of moves of a few of its atoms.
+
+    The graphs are built with a skin as in ``NequIPCalculator``: a move is evaluated
+    incrementally as long as no atom is more than ``skin / 2`` away from where it was
+    when they were built, and otherwise by a full evaluation on new graphs.
+
+    Example::
+
+        mc = IncrementalEnergy("MY_MODEL_NAME.pt", atoms, r_max=5.0, n_layers=3, species=["Si"])
+        delta = mc.propose(7, positions=atoms.positions[7] + step)
+        if accept(delta):
+            mc.accept()
+
+    Args:
+        model: the exported TorchScript model or the path to it, or a ``KLIFFGraphNetwork``
+            (whose energies are not scaled)
+        atoms: the initial configuration
+        r_max: cutoff of a convolution
+        n_layers: number of convolutions of the model
+        species: chemical symbols of the types of the model, in order
+        skin: extra distance added to the cutoffs of the graphs
+        device: device to run the model on
+    """
+
+    def __init__(
+        self,
+        model: Union[str, torch.nn.Module],
+        atoms: ase.Atoms,
+        r_max: float,
+        n_layers: int,
+        species: List[str],
+        skin: float = 1.0,
+        device: Union[str, torch.device] = "cpu",
+    ):
+        if isinstance(model, str):
+            model = torch.jit.load(model, map_location=device)
+        model = model.to(device)
+        model.eval()
+        # the exported wrapper holds the network and the energy scale
+        if hasattr(model, "scale_by"):
+            self.scale = float(model.scale_by)
+            self.net = model.model
+        else:
+            self.scale = 1.0
+            self.net = model
+        self.r_max = float(r_max)
+        self.n_layers = int(n_layers)
+        self.species = list(species)
+        self.skin = float(skin)
+        self.device = torch.device(device)
+        self.dtype = next(
+            (b.dtype for b in model.buffers() if b.is_floating_point()), torch.float64
+        )
+        self.cell = np.array(atoms.cell[:])
+        self.pbc = tuple(atoms.pbc)
+        self._state = self._evaluate(
+            np.array(atoms.positions, dtype=np.float64),
+            np.array([self.species.index(s) for s in atoms.get_chemical_symbols()]),
+        )
+        self._pending: Optional[Dict] = None
+
+    @property
+    def energy(self) -> float:
+        """Energy of the current configuration."""
+        return self._state["energy"]
+
+    @property
+    def positions(self) -> np.ndarray:
+        return self._state["positions"].copy()
+
+    @property
+    def symbols(self) -> List[str]:
+        return [self.species[t] for t in self._state["types"]]
+
+    def _conv(self, k, x_embed, h, pos, edge_index):
+        """The ``k``-th convolution, with its edge embeddings."""
+        net = self.net
+        if net.prune_edges:
+            edge_index = net[2].prune(pos, edge_index)
+        edge_vec, edge_sh = net[1](pos, edge_index)
+        _, edge_length_embeddings = net[2](edge_vec)
+        segments: Optional[torch.Tensor] = None
+        if net.segment_aggregation:
+            segments = segment_lengths(edge_index[0], pos.shape[0])
+        return net[4 + k](x_embed, h, edge_length_embeddings, edge_sh, edge_index, segments)
+
+    def _head(self, x, h):
+        """[n, 1] energies of nodes with output features ``h``, yet to scale."""
+        net = self.net
+        k = 4 + self.n_layers
+        return net[k + 2](x, net[k + 1](net[k](h)))
+
+    @torch.no_grad()
+    def _evaluate(self, positions: np.ndarray, types: np.ndarray) -> Dict:
+        """Graphs, features of every layer and energy of a whole configuration."""
+        g = driver_graph(
+            positions,
+            types,
+            r_max=self.r_max,
+            n_layers=self.n_layers,
+            cell=self.cell,
+            pbc=self.pbc,
+            skin=self.skin,
+        )
+        n_all = len(g["image"])
+        image = g["image"]
+        cell = torch.as_tensor(self.cell, dtype=self.dtype)
+        offset = g["shift"].to(self.dtype) @ cell
+        # the convolutions take the graphs last first
+        graphs = [
+            g["edge_indices"][self.n_layers - 1 - k].to(self.device)
+            for k in range(self.n_layers)
+        ]
+        state = {
+            "positions": positions,
+            "reference": positions.copy(),
+            "types": types,
+            "image": _csr(image.to(self.device), len(positions)),
+            "offset": offset.to(self.device),
+            "species": g["species"].view(-1, 1).to(self.device),
+            "coords": g["coords"].to(self.dtype).to(self.device),
+            "local": (g["contributing"] == 0).to(self.device),
+            "graphs": graphs,
+            # edges by source, to find the atoms a change reaches, and by destination,
+            # to gather the inputs of their convolutions
+            "by_src": [_csr(e[1], n_all) for e in graphs],
+            "by_dst": [_csr(e[0], n_all) for e in graphs],
+        }
+
+        x = state["species"]
+        x_embed = self.net[0](x.squeeze(-1)).to(dtype=self.dtype, device=self.device)
+        h = self.net[3](x_embed)
+        features = [h]
+        for k, edge_index in enumerate(state["graphs"]):
+            h = self._conv(k, x_embed, h, state["coords"], edge_index)
+            features.append(h)
+        atomic = self._head(x, h)
+        state["x_embed"] = x_embed
+        state["features"] = features
+        state["atomic"] = atomic
+        state["energy"] = self.scale * float(atomic[state["local"]].sum())
+        return state
+
+    def propose(
+        self,
+        indices: Union[int, Sequence[int]],
+        positions: Optional[np.ndarray] = None,
+        symbols: Optional[Union[str, Sequence[str]]] = None,
+    ) -> float:
+        """Energy change of moving atoms ``indices`` to ``positions`` and/or changing them to ``symbols``.
+
+        The move is kept until ``accept`` or ``reject``, or the next ``propose``
+        (which discards it). A swap of atoms ``i`` and ``j`` is
+        ``propose([i, j], symbols=[symbols[j], symbols[i]])``.
+
+        Returns:
+            the energy of the proposed configuration minus the current energy
+        """
+        state = self._state
+        indices = np.atleast_1d(np.asarray(indices, dtype=np.int64))
+        new_positions = state["positions"].copy()
+        new_types = state["types"].copy()
+        if positions is not None:
+            new_positions[indices] = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        if symbols is not None:
+            symbols = [symbols] if isinstance(symbols, str) else list(symbols)
+            new_types[indices] = [self.species.index(s) for s in symbols]
+
+        displacement = np.linalg.norm(new_positions[indices] - state["reference"][indices], axis=1)
+        if displacement.max(initial=0.0) > 0.5 * self.skin:
+            new_state = self._evaluate(new_positions, new_types)
+            self._pending = {"state": new_state}
+            return new_state["energy"] - state["energy"]
+
+        self._pending = self._local(indices, new_positions, new_types)
+        return self._pending["delta"]
+
+    @torch.no_grad()
+    def _local(self, indices: np.ndarray, new_positions: np.ndarray, new_types: np.ndarray) -> Dict:
+        state = self._state
+        # all the images of the atoms that change, and the atom of every one
+        atom = torch.unique(torch.as_tensor(indices, device=self.device))
+        ptr, order = state["image"]
+        node_atom = torch.repeat_interleave(atom, ptr[atom + 1] - ptr[atom])
+        nodes = _select(ptr, order, atom)
+        nodes, sort = torch.sort(nodes)
+        node_atom = node_atom[sort]
+
+        dev = self.device
+        pos_moved = (
+            torch.as_tensor(new_positions[node_atom.cpu().numpy()], dtype=self.dtype, device=dev)
+            + state["offset"][nodes]
+        )
+        x_moved = torch.as_tensor(new_types[node_atom.cpu().numpy()], device=dev).view(-1, 1)
+        x_embed_moved = self.net[0](x_moved.squeeze(-1)).to(dtype=self.dtype, device=dev)
+
+        h0 = self.net[3](x_embed_moved)
+        changed, h_changed = nodes, h0
+        features = []
+        for k, edge_index in enumerate(state["graphs"]):
+            # the atoms whose output changes: the changed ones and those they send to
+            reached = edge_index[0][_select(*state["by_src"][k], changed)]
+            out = torch.unique(torch.cat([changed, reached]))
+            # the convolution of the subgraph of their incoming edges
+            edges = _select(*state["by_dst"][k], out)
+            sub_edges = edge_index[:, edges]
+            sub = torch.unique(torch.cat([out, sub_edges[1]]))
+            sub_edges = torch.searchsorted(sub, sub_edges)
+            h_sub = self._conv(
+                k,
+                _patch(state["x_embed"], nodes, x_embed_moved, sub),
+                _patch(state["features"][k], changed, h_changed, sub),
+                _patch(state["coords"], nodes, pos_moved, sub),
+                sub_edges,
+            )
+            changed, h_changed = out, h_sub[torch.searchsorted(sub, out)]
+            features.append((changed, h_changed))
+
+        atomic = self._head(_patch(state["species"], nodes, x_moved, changed), h_changed)
+        local = state["local"][changed]
+        delta = self.scale * float((atomic - state["atomic"][changed])[local].sum())
+        return {
+            "delta": delta,
+            "positions": new_positions,
+            "types": new_types,
+            "nodes": nodes,
+            "coords": pos_moved,
+            "species": x_moved,
+            "x_embed": x_embed_moved,
+            "h0": h0,
+            "features": features,
+            "atomic": atomic,
+        }
+
+    def accept(self):
+        """Make the proposed move the current configuration."""
+        if self._pending is None:
+            raise RuntimeError("No move to accept")
+        p, self._pending = self._pending, None
+        if "state" in p:
+            self._state = p["state"]
+            return
+        state = self._state
+        nodes = p["nodes"]
+        state["coords"][nodes] = p["coords"]
+        state["species"][nodes] = p["species"]
+        state["x_embed"][nodes] = p["x_embed"]
+        state["features"][0][nodes] = p["h0"]
+        for k, (changed, h) in enumerate(p["features"]):
+            state["features"][k + 1][changed] = h
+        state["atomic"][p["features"][-1][0]] = p["atomic"]
+        state["positions"] = p["positions"]
+        state["types"] = p["types"]
+        state["energy"] += p["delta"]
+
+    def reject(self):
+        """Discard the proposed move."""
+        self._pending = None
+
+    def refresh(self) -> float:
+        """Evaluate the current configuration from scratch, on new graphs, and return its energy.
+
+        The energy is otherwise accumulated over the accepted moves.
+        """
+        state = self._state
+        self._state = self._evaluate(state["positions"], state["types"])
+        self._pending = None
+        return self.energy
@@ -0,0 +1,75 @@
+"""Pairwise partial forces of the exported models, from one backward pass.
+
+The edge vectors of every staged graph are made leaves of the autograd graph,
+and the gradient of the energy w.r.t. them gives the pair terms of
+``kim_nequip.nn.edge_partial_forces``.
+"""
+from typing import Dict, Optional, Union
+
+import torch
+
+from kim_nequip.nn import edge_partial_forces
+from kim_nequip.nn._segment import segment_lengths
+
+
+def _network(model: torch.nn.Module):
+    """The ``KLIFFGraphNetwork`` of an exported model (or the network itself) and its energy scale."""
+    if hasattr(model, "scale_by"):
+        return model.model, float(model.scale_by)
+    return model, 1.0
+
+
+def partial_forces(
+    model: Union[torch.nn.Module, torch.jit.ScriptModule],
+    graph: Dict,
+    fold: bool = True,
+) -> Dict[str, torch.Tensor]:
+    """Energy, forces and pairwise partial forces of a configuration.
+
+    Args:
+        model: the exported model, or a ``KLIFFGraphNetwork``
+        graph: the inputs of the model, as built by ``kim_nequip.data.driver_graph``
+        fold: sum the rows and columns of the padding atoms into those of the atoms they
+            are images of (``graph["image"]``)
+
+    Returns:
+        dict with ``"energy"``, ``"forces"`` ([n, 3]) and ``"partial_forces"``, an
+        [n, n, 3] sparse COO tensor whose sum over the first dimension is the forces
+    """
+    net, scale = _network(model)
+    dtype = next((b.dtype for b in net.buffers() if b.is_floating_point()), torch.float64)
+    species = graph["species"].view(-1, 1)
+    coords = graph["coords"].to(dtype)
+    contributing = graph["contributing"]
+    n_all = len(coords)
+
+    x_embed = net[0](species.squeeze(-1)).to(dtype=dtype, device=coords.device)
+    edge_indices, edge_vecs, inputs = [], [], []
+    for edge_index in graph["edge_indices"]:  # edge_index0 first
+        if net.prune_edges:
+            edge_index = net[2].prune(coords, edge_index)
+        edge_vec = (coords[edge_index[1]] - coords[edge_index[0]]).requires_grad_(True)
+        _, edge_length_embeddings = net[2](edge_vec)
+        segments: Optional[torch.Tensor] = None
+        if net.segment_aggregation:
+            segments = segment_lengths(edge_index[0], n_all)
+        edge_indices.append(edge_index)
+        edge_vecs.append(edge_vec)
+        inputs += [edge_length_embeddings, net[1].sh(edge_vec), edge_index, segments]
+
+    h = net.conv_energies(species, x_embed, *inputs)
+    energy = scale * h[contributing == 0].sum()
+    edge_grads = torch.autograd.grad([energy], edge_vecs, allow_unused=True)
+    edge_grads = [
+        torch.zeros_like(v) if g is None else g for v, g in zip(edge_vecs, edge_grads)
+    ]
+    edge_index = torch.cat(edge_indices, dim=1)
+    edge_grad = torch.cat(edge_grads)
+
+    n = n_all
+    if fold and "image" in graph:
+        image = graph["image"].to(edge_index.device)
+        edge_index = image[edge_index]
+        n = int(image.max()) + 1
+    partial, forces = edge_partial_forces(edge_index, edge_grad, n)
+    return {"energy": energy.detach(), "forces": forces, "partial_forces": partial}
@@ -10,7 +10,7 @@ from kim_nequip.utils import load_callable, instantiate
 def model_from_config(
     config,
     initialize: bool = False,
-    # dataset: Optional[AtomicDataset] = None,
+    dataset: Optional[AtomicDataset] = None,
     deploy: bool = False,
 ) -> GraphModuleMixin:
     """Build a model based on `config`.
@@ -65,6 +65,8 @@ def model_from_config(
         params = {}
         if "initialize" in pnames:
             params["initialize"] = initialize
+        if "dataset" in pnames and initialize:
+            params["dataset"] = dataset
         if "config" in pnames:
             params["config"] = config
         if "model" in pnames:
@@ -24,11 +24,13 @@ def ForceOutput(model: GraphModuleMixin) -> GradientOutput:
     )
 
 
-def PartialForceOutput(model: GraphModuleMixin) -> GradientOutput:
+def PartialForceOutput(model: GraphModuleMixin, config) -> GradientOutput:
     r"""Add forces and partial forces to a model that predicts energy.
 
     Args:
         model: the energy model to wrap. Must have ``AtomicDataDict.TOTAL_ENERGY_KEY`` as an output.
+        config: ``partial_force_mode`` is the ``mode`` of ``PartialForceOutput``, ``"jacobian"``
+            by default.
 
     Returns:
         A ``GradientOutput`` wrapping ``model``.
@@ -36,9 +38,12 @@ def PartialForceOutput(model: GraphModuleMixin) -> GradientOutput:
     if (
         AtomicDataDict.FORCE_KEY in model.irreps_out
         or AtomicDataDict.PARTIAL_FORCE_KEY in model.irreps_out
+        or AtomicDataDict.EDGE_PARTIAL_FORCE_KEY in model.irreps_out
     ):
         raise ValueError("This model already has force outputs.")
-    return PartialForceOutputModule(func=model)
+    return PartialForceOutputModule(
+        func=model, mode=config.get("partial_force_mode", "jacobian")
+    )
 
 
 def StressForceOutput(model: GraphModuleMixin) -> GradientOutput:
@@ -79,7 +79,16 @@ def GlobalRescale(
 
         # = Compute shifts and scales =
         if len(str_names) > 0:
-            computed_stats = [torch.tensor(1.0), torch.tensor([0.0])]
+            if dataset is not None:
+                computed_stats = _compute_stats(
+                    str_names=str_names,
+                    dataset=dataset,
+                    stride=config.get("dataset_statistics_stride", 1),
+                    chunk_size=config.get("dataset_statistics_chunk_size", 64),
+                    num_workers=config.get("dataset_statistics_num_workers", 1),
+                )
+            else:
+                computed_stats = [torch.tensor(1.0), torch.tensor([0.0])]
 
         if isinstance(global_scale, str):
             s = global_scale
@@ -200,13 +209,18 @@ def PerSpeciesRescale(
 
         # = Compute shifts and scales =
         if len(str_names) > 0:
-            computed_stats = [torch.tensor(1.0), torch.tensor([0.0])]
-            #     _compute_stats(
-            #     str_names=str_names,
-            #     dataset=dataset,
-            #     stride=config.dataset_statistics_stride,
-            #     kwargs=config.get(module_prefix + "_kwargs", {}),
-            # ))
+            if dataset is not None:
+                computed_stats = _compute_stats(
+                    str_names=str_names,
+                    dataset=dataset,
+                    stride=config.get("dataset_statistics_stride", 1),
+                    kwargs=config.get(module_prefix + "_kwargs", {}),
+                    chunk_size=config.get("dataset_statistics_chunk_size", 64),
+                    num_workers=config.get("dataset_statistics_num_workers", 1),
+                )
+            else:
+                # placeholders, the real values are copied from the deployed model
+                computed_stats = [torch.tensor(1.0), torch.tensor([0.0])]
 
         if isinstance(scales, str):
             s = scales
@@ -263,3 +277,70 @@ def PerSpeciesRescale(
 
     # == Build the model ==
     return model
+
+
+def _compute_stats(
+    str_names: List[str],
+    dataset,
+    stride: int,
+    kwargs: Optional[dict] = {},
+    chunk_size: Optional[int] = None,
+    num_workers: int = 1,
+):
+    """return the values of statistics over dataset
+
+    quantity name should be dataset_key_stat, where key can be any key
+    that exists in the dataset, stat can be mean, std or rms
+    """
+    stat_modes = []
+    stat_fields = []
+    stat_strs = []
+    ids = []
+    tuple_ids = []
+    tuple_id_map = {"mean": 0, "std": 1, "rms": 0}
+    input_kwargs = {}
+    for name in str_names:
+        # remove dataset prefix
+        if name.startswith("dataset_"):
+            name = name[len("dataset_") :]
+        # identify per_species and per_atom modes
+        prefix = ""
+        if name.startswith("per_species_"):
+            name = name[len("per_species_") :]
+            prefix = "per_species_"
+        elif name.startswith("per_atom_"):
+            name = name[len("per_atom_") :]
+            prefix = "per_atom_"
+
+        stat = name.split("_")[-1]
+        field = "_".join(name.split("_")[:-1])
+        if stat in ["mean", "std"]:
+            stat_mode = prefix + "mean_std"
+            stat_str = field + prefix + "mean_std"
+        elif stat in ["rms"]:
+            stat_mode = prefix + "rms"
+            stat_str = field + prefix + "rms"
+        else:
+            raise ValueError(f"Cannot handle {stat} type quantity")
+
+        if stat_str in stat_strs:
+            ids += [stat_strs.index(stat_str)]
+        else:
+            ids += [len(stat_strs)]
+            stat_strs += [stat_str]
+            stat_modes += [stat_mode]
+            stat_fields += [field]
+            if stat_mode.startswith("per_species_"):
+                if field in kwargs:
+                    input_kwargs[field + stat_mode] = kwargs[field]
+        tuple_ids += [tuple_id_map[stat]]
+
+    values = dataset.statistics(
+        fields=stat_fields,
+        modes=stat_modes,
+        stride=stride,
+        kwargs=input_kwargs,
+        chunk_size=chunk_size,
+        num_workers=num_workers,
+    )
+    return [values[idx][tuple_ids[i]] for i, idx in enumerate(ids)]
@@ -30,8 +30,21 @@ def add_avg_num_neighbors(
     var_nn_key: str = "var_num_neighbors"
     ann = config.get(annkey, "auto")
     var_nn = config.get(var_nn_key, None)
-    ann = 99 # manual values, will be changed anyway
-    var_nn = 99
+    if ann == "auto" and initialize and dataset is not None:
+        # single streaming pass, so that the dataset never has to be held in memory;
+        # the "count" histogram of neighbor counts is available the same way
+        ann, var_nn = dataset.statistics(
+            fields=[_add_avg_num_neighbors_helper],
+            modes=["mean_std"],
+            stride=config.get("dataset_statistics_stride", 1),
+            chunk_size=config.get("dataset_statistics_chunk_size", 64),
+            num_workers=config.get("dataset_statistics_num_workers", 1),
+        )[0]
+        ann = ann.item()
+        var_nn = var_nn.item()
+    else:
+        ann = 99 # manual values, will be changed anyway
+        var_nn = 99
     if ann is not None:
         ann = float(ann)
     config[annkey] = ann
@@ -6,7 +6,15 @@ from ._atomwise import (  # noqa: F401
     PerSpeciesScaleShift,
 )  # noqa: F401
 from ._interaction_block import InteractionBlock  # noqa: F401
-from ._grad_output import GradientOutput, PartialForceOutput, StressOutput  # noqa: F401
+from ._uvu_tp import UVUTensorProduct  # noqa: F401
+from ._gate import FusedGate  # noqa: F401
+from ._grad_output import (  # noqa: F401
+    GradientOutput,
+    PartialForceOutput,
+    StressOutput,
+    edge_partial_forces,
+    batched_vjp,
+)
 from ._rescale import RescaleOutput  # noqa: F401
 from ._convnetlayer import ConvNetLayer  # noqa: F401
 from ._util import SaveForOutput  # noqa: F401
@@ -0,0 +1,93 @@
+"""Activation checkpointing that works with the TorchScript-compiled e3nn modules.
+
+``torch.utils.checkpoint`` (non-reentrant) matches the tensors saved by the
+recomputation against those of the original forward, but the compiled tensor
+products of e3nn are re-optimized by the JIT profiling executor between calls and
+save different tensors, and the reentrant variant does not support
+``torch.autograd.grad``. This version recomputes the function in the backward and
+differentiates the recomputed outputs directly, so it supports ``autograd.grad``
+and, for training on forces, double backward.
+"""
+from typing import Callable, List, Optional
+
+import torch
+
+
+class _Recompute(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, fn: Callable, n_inputs: int, *tensors):
+        ctx.fn = fn
+        ctx.n_inputs = n_inputs
+        ctx.save_for_backward(*tensors)
+        with torch.no_grad():
+            return fn(*tensors[:n_inputs])
+
+    @staticmethod
+    def backward(ctx, grad_out):
+        tensors = ctx.saved_tensors
+        params = tensors[ctx.n_inputs :]
+        if torch.is_grad_enabled():
+            # double backward: recompute on the saved tensors themselves, so that
+            # the graph of the gradients reaches the original inputs
+            inputs = tensors[: ctx.n_inputs]
+        else:
+            inputs = [
+                t.detach().requires_grad_(t.requires_grad)
+                for t in tensors[: ctx.n_inputs]
+            ]
+        with torch.enable_grad():
+            out = ctx.fn(*inputs)
+        wrt: List[torch.Tensor] = [
+            t for t in list(inputs) + list(params) if t.requires_grad
+        ]
+        grads = iter(
+            torch.autograd.grad(
+                out,
+                wrt,
+                grad_out,
+                allow_unused=True,
+                create_graph=torch.is_grad_enabled(),
+            )
+        )
+        all_grads = [
+            next(grads) if t.requires_grad else None
+            for t in list(inputs) + list(params)
+        ]
+        return (None, None) + tuple(all_grads)
+
+
+def checkpoint(fn: Callable, module: torch.nn.Module, *inputs: torch.Tensor):
+    """Call ``fn(*inputs)`` without storing its intermediates, recomputing them in the backward.
+
+    Args:
+        fn: function of tensors returning one tensor
+        module: the module holding the parameters used by ``fn``
+        inputs: the tensor arguments of ``fn``
+    """
+    params = [p for p in module.parameters() if p.requires_grad]
+    return _Recompute.apply(fn, len(inputs), *inputs, *params)
+
+
+def grads_or_zeros(
+    outputs: List[torch.Tensor],
+    inputs: List[torch.Tensor],
+    grad_outputs: List[torch.Tensor],
+) -> List[torch.Tensor]:
+    """``torch.autograd.grad``, with zeros for the inputs that ``outputs`` do not depend on.
+
+    Used by the scripted models to recompute their intermediates in the backward by hand,
+    since TorchScript cannot use ``checkpoint``.
+    """
+    optional_grad_outputs: List[Optional[torch.Tensor]] = []
+    for g in grad_outputs:
+        optional_grad_outputs.append(g)
+    grads = torch.autograd.grad(
+        outputs, inputs, grad_outputs=optional_grad_outputs, allow_unused=True
+    )
+    result: List[torch.Tensor] = []
+    for x, g in zip(inputs, grads):
+        if g is None:
+            result.append(torch.zeros_like(x))
+        else:
+            result.append(g)
+    return result
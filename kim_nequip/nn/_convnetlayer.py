@@ -1,9 +1,9 @@
-from typing import Dict, Callable
+from typing import Dict, Callable, Optional, Tuple
 import torch
 import logging
 
 from e3nn import o3
-from e3nn.nn import Gate, NormActivation
+from e3nn.nn import NormActivation
 
 from kim_nequip.data import AtomicDataDict
 from kim_nequip.nn import (
@@ -11,6 +11,8 @@ from kim_nequip.nn import (
     InteractionBlock,
 )
 from kim_nequip.nn.nonlinearities import ShiftedSoftPlus
+from kim_nequip.nn._gate import gate
+from kim_nequip.nn._checkpoint import grads_or_zeros
 from kim_nequip.utils.tp_utils import tp_path_exists
 
 
@@ -25,7 +27,9 @@ acts = {
 class ConvNetLayer(GraphModuleMixin, torch.nn.Module):
     """
     Args:
-
+        fused_gate: for ``nonlinearity_type="gate"``, use ``FusedGate`` instead of
+            ``e3nn.nn.Gate`` (which is still used if the activations are not supported or
+            the outputs differ); off by default
     """
 
     resnet: bool
@@ -41,6 +45,7 @@ class ConvNetLayer(GraphModuleMixin, torch.nn.Module):
         nonlinearity_type: str = "gate",
         nonlinearity_scalars: Dict[int, Callable] = {"e": "ssp", "o": "tanh"},
         nonlinearity_gates: Dict[int, Callable] = {"e": "ssp", "o": "abs"},
+        fused_gate: bool = False,
     ):
         super().__init__()
         # initialization
@@ -98,7 +103,7 @@ class ConvNetLayer(GraphModuleMixin, torch.nn.Module):
 
             # TO DO, it's not that safe to directly use the
             # dictionary
-            equivariant_nonlin = Gate(
+            equivariant_nonlin = gate(
                 irreps_scalars=irreps_scalars,
                 act_scalars=[
                     acts[nonlinearity_scalars[ir.p]] for _, ir in irreps_scalars
@@ -106,6 +111,7 @@ class ConvNetLayer(GraphModuleMixin, torch.nn.Module):
                 irreps_gates=irreps_gates,
                 act_gates=[acts[nonlinearity_gates[ir.p]] for _, ir in irreps_gates],
                 irreps_gated=irreps_gated,
+                fused=fused_gate,
             )
 
             conv_irreps_out = equivariant_nonlin.irreps_in.simplify()
@@ -153,15 +159,82 @@ class ConvNetLayer(GraphModuleMixin, torch.nn.Module):
             AtomicDataDict.NODE_FEATURES_KEY
         ] = self.equivariant_nonlin.irreps_out
 
-    def forward(self, x, h, edge_length_embeddings, edge_sh, edge_index):
+    def forward(
+        self,
+        x,
+        h,
+        edge_length_embeddings,
+        edge_sh,
+        edge_index,
+        edge_segment_lengths: Optional[torch.Tensor] = None,
+    ):
         # save old features for resnet
         old_h = h
         # run convolution
-        h = self.conv(x, h, edge_length_embeddings, edge_sh, edge_index)
+        h = self.conv(
+            x, h, edge_length_embeddings, edge_sh, edge_index, edge_segment_lengths
+        )
         # do nonlinearity
         h = self.equivariant_nonlin(h)
 
         # do resnet
         if self.resnet:
             h = old_h + h
-        return h
\ No newline at end of file
+        return h
+
+    @torch.jit.export
+    def recompute_grad(
+        self,
+        x,
+        h,
+        edge_length_embeddings,
+        edge_sh,
+        edge_index,
+        edge_segment_lengths: Optional[torch.Tensor],
+        grad_out,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Gradients of ``forward`` w.r.t. ``h``, ``edge_length_embeddings`` and ``edge_sh``, for ``grad_out``.
+
+        The layer is recomputed from its inputs. With ``edge_chunk_size``, the sums of the
+        messages are recomputed without autograd and the messages are then differentiated
+        one chunk of edges at a time (``InteractionBlock.messages_grad``), which is how the
+        scripted models, where ``checkpoint_chunks`` is not available, keep the intermediates
+        of a single chunk alive in the backward.
+        """
+        h_in = h.detach().requires_grad_(True)
+        edge_chunk_size: Optional[int] = self.conv.edge_chunk_size
+        if edge_chunk_size is None or edge_index.shape[1] <= edge_chunk_size:
+            embeddings_in = edge_length_embeddings.detach().requires_grad_(True)
+            sh_in = edge_sh.detach().requires_grad_(True)
+            out = self.forward(
+                x, h_in, embeddings_in, sh_in, edge_index, edge_segment_lengths
+            )
+            grads = grads_or_zeros([out], [h_in, embeddings_in, sh_in], [grad_out])
+            return grads[0], grads[1], grads[2]
+
+        messages = self._detached_messages(
+            h, edge_length_embeddings, edge_sh, edge_index, edge_segment_lengths
+        ).requires_grad_(True)
+        out = self.equivariant_nonlin(self.conv.update(x, h_in, messages))
+        if self.resnet:
+            out = h_in + out
+        grads = grads_or_zeros([out], [h_in, messages], [grad_out])
+        grad_h_messages, grad_embeddings, grad_sh = self.conv.messages_grad(
+            h, edge_length_embeddings, edge_sh, edge_index, grads[1]
+        )
+        return grads[0] + grad_h_messages, grad_embeddings, grad_sh
+
+    def _detached_messages(
+        self,
+        h,
+        edge_length_embeddings,
+        edge_sh,
+        edge_index,
+        edge_segment_lengths: Optional[torch.Tensor],
+    ):
+        """``conv.aggregated_messages`` without autograd."""
+        with torch.no_grad():
+            messages = self.conv.aggregated_messages(
+                h, edge_length_embeddings, edge_sh, edge_index, edge_segment_lengths
+            )
+        return messages
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""A gate nonlinearity evaluated with precomputed index maps.
+
+``e3nn.nn.Gate`` extracts the scalars, gates and gated irreps into new tensors,
+applies the activations irrep by irrep, and multiplies the gates in with an
+elementwise tensor product. ``FusedGate`` computes the same function with one
+gather of the scalars and gates, one activation per group of channels (with the
+second-moment normalization of e3nn folded in), and one broadcast multiply of
+the gated components by their gates.
+"""
+from typing import List
+
+import torch
+
+from e3nn.nn import Gate
+
+from kim_nequip.nn.nonlinearities import ShiftedSoftPlus
+
+
+_ACTIVATIONS = [
+    (ShiftedSoftPlus, "ssp"),
+    (torch.nn.functional.silu, "silu"),
+    (torch.tanh, "tanh"),
+    (torch.abs, "abs"),
+]
+
+
+def _activation_name(act) -> str:
+    for f, name in _ACTIVATIONS:
+        if act is f:
+            return name
+    raise ValueError(f"Activation {act} is not supported by FusedGate")
+
+
+def _activation(name: str, x: torch.Tensor) -> torch.Tensor:
+    if name == "ssp":
+        return ShiftedSoftPlus(x)
+    if name == "silu":
+        return torch.nn.functional.silu(x)
+    if name == "tanh":
+        return torch.tanh(x)
+    if name == "abs":
+        return torch.abs(x)
+    return x
+
+
+class FusedGate(torch.nn.Module):
+    """Same function and irreps as ``e3nn.nn.Gate``, with the same arguments.
+
+    The activations must be among ``ShiftedSoftPlus``, ``silu``, ``tanh`` and ``abs``,
+    and the outputs are checked against ``e3nn.nn.Gate`` on a random input when built; a
+    ``ValueError`` is raised otherwise, and ``gate`` falls back to ``e3nn.nn.Gate``. Neither
+    has parameters, so a model trained with one can be exported with the other.
+    """
+
+    act_names: List[str]
+    act_csts: List[float]
+    act_bounds: List[int]
+    n_scalars: int
+    n_gated: int
+    has_scale: bool
+
+    def __init__(
+        self, irreps_scalars, act_scalars, irreps_gates, act_gates, irreps_gated
+    ):
+        super().__init__()
+        act_names = [_activation_name(act) for act in list(act_scalars) + list(act_gates)]
+        # the reference module fixes the layout, the normalization and the irreps
+        ref = Gate(irreps_scalars, act_scalars, irreps_gates, act_gates, irreps_gated)
+        self.irreps_in = ref.irreps_in
+        self.irreps_out = ref.irreps_out
+
+        # which input column goes where
+        with torch.no_grad():
+            columns = torch.arange(self.irreps_in.dim, dtype=torch.float64)[None]
+            scalars, gates, gated = [c[0].round().long() for c in ref.sc(columns)]
+        self.register_buffer(
+            "scalar_index", torch.cat([scalars, gates]), persistent=False
+        )
+        self.register_buffer("gated_index", gated, persistent=False)
+
+        # one activation per irrep of scalars and gates, in that order
+        self.act_names = []
+        self.act_csts = []
+        self.act_bounds = [0]
+        for (mul, _, act), name in zip(
+            ref.act_scalars.paths + ref.act_gates.paths, act_names
+        ):
+            self.act_names.append(name)
+            self.act_csts.append(1.0 if act._is_id else float(act.cst))
+            self.act_bounds.append(self.act_bounds[-1] + mul)
+        self.n_scalars = len(scalars)
+        self.n_gated = len(gated)
+
+        # gate of every gated component, and the normalization of the elementwise product
+        irreps_gated = ref.irreps_gated
+        gate_index = torch.repeat_interleave(
+            torch.arange(irreps_gated.num_irreps),
+            torch.tensor([ir.dim for mul, ir in irreps_gated for _ in range(mul)], dtype=torch.long),
+        )
+        self.register_buffer("gate_index", self.n_scalars + gate_index, persistent=False)
+        with torch.no_grad():
+            scale = ref.mul(
+                torch.ones(1, irreps_gated.dim, dtype=torch.float64),
+                torch.ones(1, ref.irreps_gates.dim, dtype=torch.float64),
+            )[0] if self.n_gated > 0 else torch.ones(0, dtype=torch.float64)
+        self.has_scale = bool((scale - 1).abs().max() > 1e-12) if self.n_gated > 0 else False
+        self.register_buffer(
+            "gated_scale", scale.to(torch.get_default_dtype()), persistent=False
+        )
+
+        # the fused function must be that of the reference, otherwise ``gate`` falls back to it
+        with torch.no_grad():
+            generator = torch.Generator().manual_seed(0)
+            x = torch.randn(8, self.irreps_in.dim, generator=generator)
+            if not torch.allclose(self(x), ref(x), rtol=1e-4, atol=1e-5):
+                raise ValueError(f"FusedGate does not match e3nn.nn.Gate for {self.irreps_in}")
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__} ({self.irreps_in} -> {self.irreps_out})"
+
+    def forward(self, features):
+        s = features.index_select(-1, self.scalar_index)
+        parts: List[torch.Tensor] = []
+        for i, name in enumerate(self.act_names):
+            start = self.act_bounds[i]
+            a = _activation(name, s.narrow(-1, start, self.act_bounds[i + 1] - start))
+            cst = self.act_csts[i]
+            if cst != 1.0:
+                a = a * cst
+            parts.append(a)
+        if len(parts) == 0:
+            a = s
+        elif len(parts) == 1:
+            a = parts[0]
+        else:
+            a = torch.cat(parts, dim=-1)
+        if self.n_gated == 0:
+            return a
+        gated = features.index_select(-1, self.gated_index) * a.index_select(
+            -1, self.gate_index
+        )
+        if self.has_scale:
+            gated = gated * self.gated_scale
+        return torch.cat([a.narrow(-1, 0, self.n_scalars), gated], dim=-1)
+
+
+def gate(
+    irreps_scalars, act_scalars, irreps_gates, act_gates, irreps_gated, fused: bool = False
+):
+    """A ``FusedGate`` if ``fused``, or an ``e3nn.nn.Gate`` (also if the activations are not supported)."""
+    if fused:
+        try:
+            return FusedGate(
+                irreps_scalars, act_scalars, irreps_gates, act_gates, irreps_gated
+            )
+        except ValueError:
+            pass
+    return Gate(irreps_scalars, act_scalars, irreps_gates, act_gates, irreps_gated)
@@ -1,4 +1,4 @@
-from typing import List, Union, Optional
+from typing import List, Union, Optional, Tuple
 import warnings
 
 import torch
@@ -111,6 +111,66 @@ class GradientOutput(GraphModuleMixin, torch.nn.Module):
         return data
 
 
+def edge_partial_forces(
+    edge_index: torch.Tensor, edge_grad: torch.Tensor, num_nodes: int
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Pairwise partial forces from the gradient of the energy w.r.t. the edge vectors.
+
+    An edge ``(i, j)`` of vector ``pos[j] - pos[i]`` and gradient ``g`` contributes ``-g``
+    to the force on ``j`` and ``g`` to that on ``i``, which are both attributed to the
+    center ``i``. For energies that are sums of per-atom terms of the edges of the atom
+    (one convolution), ``partial_forces[i, j]`` is exactly ``-dE_i/dr_j``; with more
+    convolutions it is a decomposition of the forces into pair terms that obey Newton's
+    third law, as used for virials.
+
+    Args:
+        edge_index: [2, n_edge] centers and neighbors; the same pair may appear several times
+        edge_grad: [n_edge, 3] gradient of the energy w.r.t. every edge vector
+        num_nodes: number of atoms
+
+    Returns:
+        the [n_atom, n_atom, 3] partial forces as a coalesced sparse COO tensor (with a dense
+        last dimension), and the [n_atom, 3] forces, their sum over the first dimension
+    """
+    center, neighbor = edge_index[0], edge_index[1]
+    partial_forces = torch.sparse_coo_tensor(
+        torch.cat([edge_index, torch.stack([center, center])], dim=1),
+        torch.cat([-edge_grad, edge_grad]),
+        (num_nodes, num_nodes, 3),
+    ).coalesce()
+    forces = (
+        edge_grad.new_zeros((num_nodes, 3))
+        .index_add(0, neighbor, -edge_grad)
+        .index_add(0, center, edge_grad)
+    )
+    return partial_forces, forces
+
+
+def batched_vjp(
+    output: torch.Tensor, input: torch.Tensor, vectors: torch.Tensor, batched: bool = True
+) -> torch.Tensor:
+    """The vector-Jacobian products ``vectors[k] @ d(output)/d(input)`` for all ``k``.
+
+    With ``batched``, all of them come from one call of ``torch.autograd.grad`` with
+    ``is_grads_batched`` (vmap over the backward pass); if an operation of the graph has
+    no batching rule, or without ``batched``, they are computed one after the other.
+    """
+    if batched:
+        try:
+            (vjp,) = torch.autograd.grad(
+                [output], [input], grad_outputs=[vectors], is_grads_batched=True,
+                retain_graph=True,
+            )
+            return vjp
+        except RuntimeError:
+            pass
+    vjps = []
+    for v in vectors:
+        (vjp,) = torch.autograd.grad([output], [input], grad_outputs=[v], retain_graph=True)
+        vjps.append(vjp)
+    return torch.stack(vjps)
+
+
 @compile_mode("unsupported")
 class PartialForceOutput(GraphModuleMixin, torch.nn.Module):
     r"""Generate partial and total forces from an energy model.
@@ -119,6 +179,12 @@ class PartialForceOutput(GraphModuleMixin, torch.nn.Module):
         func: the energy model
         vectorize: the vectorize option to ``torch.autograd.functional.jacobian``,
             false by default since it doesn't work well.
+        mode: ``"jacobian"`` for the dense [n_atom, n_atom, 3] jacobian of the per-atom energies
+            (one backward pass per atom), under ``PARTIAL_FORCE_KEY``, or ``"edge"`` for the
+            sparse pairwise partial forces of ``edge_partial_forces``, from a single backward
+            pass w.r.t. the edge vectors, under ``EDGE_PARTIAL_FORCE_KEY``. The energy must then
+            only depend on the positions through the edge vectors. With more than one
+            convolution the two differ: only the jacobian is ``-dE_i/dr_j``.
     """
     vectorize: bool
 
@@ -127,10 +193,14 @@ class PartialForceOutput(GraphModuleMixin, torch.nn.Module):
         func: GraphModuleMixin,
         vectorize: bool = False,
         vectorize_warnings: bool = False,
+        mode: str = "jacobian",
     ):
         super().__init__()
+        if mode not in ("jacobian", "edge"):
+            raise ValueError(f"Unknown partial force mode `{mode}`")
         self.func = func
         self.vectorize = vectorize
+        self.mode = mode
         if vectorize_warnings:
             # See https://pytorch.org/docs/stable/generated/torch.autograd.functional.jacobian.html
             torch._C._debug_only_display_vmap_fallback_warnings(True)
@@ -141,10 +211,15 @@ class PartialForceOutput(GraphModuleMixin, torch.nn.Module):
             my_irreps_in={AtomicDataDict.PER_ATOM_ENERGY_KEY: Irreps("0e")},
             irreps_out=func.irreps_out,
         )
-        self.irreps_out[AtomicDataDict.PARTIAL_FORCE_KEY] = Irreps("1o")
+        if mode == "edge":
+            self.irreps_out[AtomicDataDict.EDGE_PARTIAL_FORCE_KEY] = Irreps("1o")
+        else:
+            self.irreps_out[AtomicDataDict.PARTIAL_FORCE_KEY] = Irreps("1o")
         self.irreps_out[AtomicDataDict.FORCE_KEY] = Irreps("1o")
 
     def forward(self, data: AtomicDataDict.Type) -> AtomicDataDict.Type:
+        if self.mode == "edge":
+            return self._edge_forward(data)
         data = data.copy()
         out_data = {}
 
@@ -171,6 +246,55 @@ class PartialForceOutput(GraphModuleMixin, torch.nn.Module):
 
         return out_data
 
+    def _edge_forward(self, data: AtomicDataDict.Type) -> AtomicDataDict.Type:
+        data = data.copy()
+        # the edge vectors as leaves: one backward pass gives the gradient of every edge
+        edge_vec = AtomicDataDict.with_edge_vectors(data.copy(), with_lengths=False)[
+            AtomicDataDict.EDGE_VECTORS_KEY
+        ]
+        edge_vec = edge_vec.detach().requires_grad_(True)
+        data[AtomicDataDict.EDGE_VECTORS_KEY] = edge_vec
+        data.pop(AtomicDataDict.EDGE_LENGTH_KEY, None)
+        out_data = self.func(data)
+
+        (edge_grad,) = torch.autograd.grad(
+            [out_data[AtomicDataDict.PER_ATOM_ENERGY_KEY].sum()],
+            [edge_vec],
+            create_graph=self.training,  # needed to allow gradients of this output during training
+        )
+        partial_forces, forces = edge_partial_forces(
+            data[AtomicDataDict.EDGE_INDEX_KEY],
+            edge_grad,
+            data[AtomicDataDict.POSITIONS_KEY].shape[0],
+        )
+        out_data[AtomicDataDict.EDGE_PARTIAL_FORCE_KEY] = partial_forces
+        out_data[AtomicDataDict.FORCE_KEY] = forces
+        return out_data
+
+    def hessian_vector_product(
+        self, data: AtomicDataDict.Type, vectors: torch.Tensor, batched: bool = True
+    ) -> torch.Tensor:
+        """Products of the Hessian of the energy w.r.t. the positions with ``vectors``.
+
+        The forces are computed with ``create_graph`` and the products are vector-Jacobian
+        products of them (see ``batched_vjp``), which needs no [3n_atom, 3n_atom] matrix.
+
+        Args:
+            data: the input of ``func``
+            vectors: [n_vector, n_atom, 3] displacements, e.g. trial phonon modes
+
+        Returns:
+            [n_vector, n_atom, 3] Hessian-vector products
+        """
+        data = data.copy()
+        pos = data[AtomicDataDict.POSITIONS_KEY].detach().requires_grad_(True)
+        data[AtomicDataDict.POSITIONS_KEY] = pos
+        data.pop(AtomicDataDict.EDGE_VECTORS_KEY, None)
+        data.pop(AtomicDataDict.EDGE_LENGTH_KEY, None)
+        energy = self.func(data)[AtomicDataDict.PER_ATOM_ENERGY_KEY].sum()
+        (grad,) = torch.autograd.grad([energy], [pos], create_graph=True)
+        return batched_vjp(grad, pos, vectors.to(grad.dtype), batched=batched)
+
 
 @compile_mode("script")
 class StressOutput(GraphModuleMixin, torch.nn.Module):
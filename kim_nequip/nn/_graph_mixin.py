@@ -1,5 +1,5 @@
 import random
-from typing import Dict, Tuple, Callable, Any, Sequence, Union, Mapping, Optional
+from typing import Dict, Tuple, Callable, Any, Sequence, Union, Mapping, Optional, List
 from collections import OrderedDict
 
 import torch
@@ -9,6 +9,10 @@ from e3nn import o3
 from kim_nequip.data import AtomicDataDict
 from kim_nequip.utils import instantiate
 
+from ._segment import segment_lengths
+from ._checkpoint import grads_or_zeros
+from ._unrolled import Unrolled, names, repeat, unrolled
+
 
 class GraphModuleMixin:
     r"""Mixin parent class for ``torch.nn.Module``s that act on and return ``AtomicDataDict.Type`` graph data.
@@ -357,7 +361,24 @@ class SequentialGraphNetwork(GraphModuleMixin, torch.nn.Sequential):
         return input
 
 
-class KLIFFGraphNetwork(GraphModuleMixin, torch.nn.Sequential):
+class KLIFFGraphNetwork(Unrolled, GraphModuleMixin, torch.nn.Sequential):
+    """Energy model with explicit inputs, as called by the KIM TorchML driver.
+
+    The modules are the encodings, the embedding, the convolutions, the output head,
+    the rescaling and the reduction, in this order. ``forward`` takes one edge graph
+    per convolution, ``edge_index0`` (that of the last convolution) first; it and the
+    other methods with those inputs are generated for the number of convolutions (see
+    ``_network_methods``), so an instance is built from ``for_layers(n_layers)``, or
+    from ``from_parameters``, which counts them.
+    """
+    segment_aggregation: bool
+    prune_edges: bool
+    num_layers: int
+
+    @classmethod
+    def for_layers(cls, n_layers: int) -> type:
+        return unrolled(KLIFFGraphNetwork, n_layers, _network_methods, globals())
+
     def __init__(
         self,
         modules: Union[Sequence[GraphModuleMixin], Dict[str, GraphModuleMixin]],
@@ -382,6 +403,15 @@ class KLIFFGraphNetwork(GraphModuleMixin, torch.nn.Sequential):
         else:
             modules = OrderedDict((f"module{i}", m) for i, m in enumerate(module_list))
         super().__init__(modules)
+        # whether the convolutions sum their messages over CSR segments
+        self.segment_aggregation = any(
+            getattr(getattr(m, "conv", None), "aggregation", "scatter") != "scatter"
+            for m in module_list
+        )
+        # whether the edges beyond the cutoff are dropped before the edge embeddings
+        self.prune_edges = any(getattr(m, "prune_edges", False) for m in module_list)
+        # number of convolutions, and of edge graphs in the inputs
+        self.num_layers = sum(hasattr(m, "conv") for m in module_list)
 
     @classmethod
     def from_parameters(
@@ -445,7 +475,8 @@ class KLIFFGraphNetwork(GraphModuleMixin, torch.nn.Sequential):
 
             built_modules.append(instance)
 
-        return cls(
+        n_layers = sum(hasattr(m, "conv") for m in built_modules)
+        return cls.for_layers(n_layers)(
             OrderedDict(zip(layers.keys(), built_modules)),
         )
 
@@ -581,59 +612,212 @@ class KLIFFGraphNetwork(GraphModuleMixin, torch.nn.Sequential):
         self.insert(after=after, before=before, name=name, module=instance)
         return
 
-    # Copied from https://pytorch.org/docs/stable/_modules/torch/nn/modules/container.html#Sequential
-    # with type annotations added
-    def forward(self, species, coords,
-                edge_index0, edge_index1, edge_index2, # << ADD LAYERS HERE
-                batch):
-        x = species # assignments to match the original code
-        pos = coords
-        contributing = batch
-
-        # Embedding
-        x_embed = self[0](x.squeeze(-1))
-        x_embed = x_embed.to(dtype=pos.dtype, device=pos.device)
-        h = x_embed
-
-        # Edge embeddings
-        edge_vec0, edge_sh0 = self[1](pos, edge_index0)
-        edge_vec1, edge_sh1 = self[1](pos, edge_index1)
-        edge_vec2, edge_sh2 = self[1](pos, edge_index2)
-        # edge_vec3, edge_sh3 = self[1](pos, edge_index3)
-        # edge_vec4, edge_sh4 = self[1](pos, edge_index4) ... << ADD LAYERS HERE
-
-        # Radial basis functions
-        edge_lengths0, edge_length_embeddings0 = self[2](edge_vec0)
-        edge_lengths1, edge_length_embeddings1 = self[2](edge_vec1)
-        edge_lengths2, edge_length_embeddings2 = self[2](edge_vec2)
-        # edge_lengths3, edge_length_embeddings3 = self[2](edge_vec3)
-        # edge_lengths4, edge_length_embeddings4 = self[2](edge_vec4) ... << ADD LAYERS HERE
-
-
-        # Atomwise linear node feature
-        h = self[3](h)
-
-        # Conv
-        # << ADD LAYERS HERE
-        # h = self[4](x_embed, h, edge_length_embeddings4, edge_sh4, edge_index4)
-        # h = self[5](x_embed, h, edge_length_embeddings0, edge_sh5, edge_index5)
-        #        |  Edit indexes of layers accordingly (they should be in sequential order)
-        #        v
-        h = self[4](x_embed, h, edge_length_embeddings2, edge_sh2, edge_index2)
-        h = self[5](x_embed, h, edge_length_embeddings1, edge_sh1, edge_index1)
-        h = self[6](x_embed, h, edge_length_embeddings0, edge_sh0, edge_index0)
-
-
-        # Atomwise linear node feature
-        h = self[7](h)
-        h = self[8](h)
-
-        # Shift and scale
-        h = self[9](x, h)
-
-        # Sum to final energy
-        #h = self[10](h, contributing)
-        h = h[contributing==0]
-        energy = torch.sum(h) # yet to scale the energy
-        # if you need per particle energy, then do not sum here
-        return energy
+    def _checkpoint_grad(self, out: torch.Tensor, h_in: torch.Tensor, pos: torch.Tensor,
+                         grad_out: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        grad_outputs: List[Optional[torch.Tensor]] = [grad_out]
+        grads = torch.autograd.grad([out], [h_in, pos], grad_outputs=grad_outputs, allow_unused=True)
+        grad_h = grads[0]
+        grad_pos = grads[1]
+        if grad_h is None:
+            grad_h = torch.zeros_like(h_in)
+        if grad_pos is None:
+            grad_pos = torch.zeros_like(pos)
+        return grad_h, grad_pos
+
+
+# Methods of ``KLIFFGraphNetwork`` that take one edge graph per convolution. The
+# convolution ``c`` (module ``4 + c``) uses the graph ``n_layers - 1 - c``, since the
+# driver gives the graph of the last convolution (the smallest) first.
+_NETWORK_METHODS = '''
+def forward(self, species, coords,
+            {graphs},
+            batch):
+    contributing = batch
+    h = self.atomic_energies(species, coords,
+                             {graphs},
+                             )
+
+    # Sum to final energy
+    h = h[contributing==0]
+    energy = torch.sum(h) # yet to scale the energy
+    return energy
+
+
+@torch.jit.export
+def batched_energies(self, species, coords,
+                     {graphs},
+                     contributing, batch):
+    """Energies of the configurations of a batch, concatenated as by ``batch_driver_graphs``.
+
+    Args:
+        contributing: [n_atom] 0 for contributing atoms and 1 for padding atoms
+        batch: [n_atom] index of the configuration of every atom
+
+    Returns:
+        [n_config] the energy of every configuration, yet to scale
+    """
+    h = self.atomic_energies(species, coords,
+                             {graphs},
+                             )
+    mask = contributing == 0
+    return self[{reduce}](h[mask], batch[mask]).view(-1)
+
+
+@torch.jit.export
+def atomic_energies(self, species, coords,
+                    {graphs},
+                    ):
+    """[n_atom, 1] energies of all atoms, contributing and padding, yet to scale."""
+    x = species # assignments to match the original code
+    pos = coords
+
+    # Embedding
+    x_embed = self[0](x.squeeze(-1))
+    x_embed = x_embed.to(dtype=pos.dtype, device=pos.device)
+
+    # Drop the edges beyond the cutoff (e.g. in the skin of the neighbor lists)
+    if self.prune_edges:
+{prune}
+
+    # Edge embeddings
+{edge_sh}
+
+    # Radial basis functions
+{radial}
+
+    # CSR segments of the destination-sorted edge graphs, computed once per graph
+{declare_segments}
+    if self.segment_aggregation:
+{segments}
+
+    return self.conv_energies(x, x_embed,
+{conv_args}
+                              )
+
+
+@torch.jit.export
+def conv_energies(self, species, x_embed,
+{conv_params}
+                  ):
+    """``atomic_energies`` from the node embeddings and the edge embeddings of every graph.
+
+    Lets models with the same edge embeddings (e.g. an ensemble) compute them once.
+    """
+    x = species
+    h = x_embed
+
+    # Atomwise linear node feature
+    h = self[3](h)
+
+    # Conv
+{convs}
+
+    # Atomwise linear node feature
+    h = self[{head}](h)
+    h = self[{head_out}](h)
+
+    # Shift and scale
+    h = self[{rescale}](x, h)
+    return h
+
+
+@torch.jit.export
+def checkpointed_energy_and_forces(self, species, coords,
+                                   {graphs},
+                                   batch) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Energy and forces of ``forward``, storing only the node features between the convolutions.
+
+    The forward pass runs without autograd. The backward pass then goes through the
+    convolutions in reverse, recomputing the edge embeddings and the intermediates of
+    one convolution at a time, so peak memory is that of a single layer at the cost
+    of a second forward pass. The convolutions with ``edge_chunk_size`` are recomputed
+    one chunk of edges at a time (``ConvNetLayer.recompute_grad``), so that only the
+    intermediates of a chunk are alive.
+    """
+    x = species
+    contributing = batch
+
+    x_embed = self[0](x.squeeze(-1))
+    x_embed = x_embed.to(dtype=coords.dtype, device=coords.device)
+    pos = coords.detach().requires_grad_(True)
+
+    if self.prune_edges:
+{prune_coords}
+
+{declare_segments}
+    if self.segment_aggregation:
+{segments}
+
+    # Forward, keeping only the layer boundaries
+    with torch.no_grad():
+        h0 = self[3](x_embed)
+{checkpoint_forward}
+
+    # Output head
+    h_in = h{n_layers}.detach().requires_grad_(True)
+    h = self[{rescale}](x, self[{head_out}](self[{head}](h_in)))
+    energy = torch.sum(h[contributing == 0])
+    grad_h = self._checkpoint_grad(energy, h_in, pos, torch.ones_like(energy))[0]
+    forces = torch.zeros_like(coords)
+
+    # Backward through the convolutions, last one first
+{checkpoint_backward}
+    return energy.detach(), forces
+'''
+
+
+def _network_methods(n_layers: int) -> str:
+    """Source of the methods of ``KLIFFGraphNetwork`` with ``n_layers`` convolutions."""
+    graphs = [dict(i=i) for i in range(n_layers)]
+    convs = [
+        dict(c=c, next=c + 1, module=4 + c, g=n_layers - 1 - c) for c in range(n_layers)
+    ]
+    return _NETWORK_METHODS.format(
+        graphs=names("edge_index", n_layers),
+        n_layers=n_layers,
+        head=4 + n_layers,
+        head_out=5 + n_layers,
+        rescale=6 + n_layers,
+        reduce=7 + n_layers,
+        prune=repeat("        edge_index{i} = self[2].prune(pos, edge_index{i})", graphs),
+        prune_coords=repeat("        edge_index{i} = self[2].prune(coords, edge_index{i})", graphs),
+        edge_sh=repeat("    edge_vec{i}, edge_sh{i} = self[1](pos, edge_index{i})", graphs),
+        radial=repeat(
+            "    edge_lengths{i}, edge_length_embeddings{i} = self[2](edge_vec{i})", graphs
+        ),
+        declare_segments=repeat("    segments{i}: Optional[torch.Tensor] = None", graphs),
+        segments=repeat(
+            "        segments{i} = segment_lengths(edge_index{i}[0], pos.shape[0])", graphs
+        ),
+        conv_args=repeat(
+            "                              "
+            "edge_length_embeddings{i}, edge_sh{i}, edge_index{i}, segments{i},",
+            graphs,
+        ),
+        conv_params=repeat(
+            "                  edge_length_embeddings{i}, edge_sh{i}, edge_index{i}, "
+            "segments{i}: Optional[torch.Tensor],",
+            graphs,
+        ),
+        convs=repeat(
+            "    h = self[{module}](x_embed, h, edge_length_embeddings{g}, edge_sh{g}, "
+            "edge_index{g}, segments{g})",
+            convs,
+        ),
+        checkpoint_forward=repeat(
+            "        edge_vec, edge_sh = self[1](coords, edge_index{g})\n"
+            "        _, edge_length_embeddings = self[2](edge_vec)\n"
+            "        h{next} = self[{module}](x_embed, h{c}, edge_length_embeddings, edge_sh, "
+            "edge_index{g}, segments{g})",
+            convs,
+        ),
+        checkpoint_backward=repeat(
+            "    edge_vec, edge_sh = self[1](pos, edge_index{g})\n"
+            "    _, edge_length_embeddings = self[2](edge_vec)\n"
+            "    grad_h, grad_embeddings, grad_sh = self[{module}].recompute_grad(\n"
+            "        x_embed, h{c}, edge_length_embeddings, edge_sh, edge_index{g}, segments{g}, grad_h)\n"
+            "    forces = forces - grads_or_zeros(\n"
+            "        [edge_length_embeddings, edge_sh], [pos], [grad_embeddings, grad_sh])[0]\n",
+            convs[::-1],
+        ),
+    )
@@ -1,5 +1,5 @@
 """ Interaction Block """
-from typing import Optional, Dict, Callable
+from typing import Optional, Dict, Callable, Tuple
 
 import torch
 
@@ -12,11 +12,19 @@ from e3nn.o3 import TensorProduct, Linear, FullyConnectedTensorProduct
 from kim_nequip.data import AtomicDataDict
 from kim_nequip.nn.nonlinearities import ShiftedSoftPlus
 from ._graph_mixin import GraphModuleMixin
+from ._segment import segment_lengths, segment_sum
+from ._checkpoint import checkpoint, grads_or_zeros
+from ._uvu_tp import UVUTensorProduct
 
 
 class InteractionBlock(GraphModuleMixin, torch.nn.Module):
     avg_num_neighbors: Optional[float]
     use_sc: bool
+    aggregation: str
+    edge_chunk_size: Optional[int]
+    checkpoint_chunks: bool
+    tp_out_dim: int
+    source_subset: Optional[float]
 
     def __init__(
         self,
@@ -27,6 +35,11 @@ class InteractionBlock(GraphModuleMixin, torch.nn.Module):
         avg_num_neighbors=None,
         use_sc=True,
         nonlinearity_scalars: Dict[int, Callable] = {"e": "ssp"},
+        aggregation: str = "scatter",
+        edge_chunk_size: Optional[int] = None,
+        checkpoint_chunks: bool = True,
+        tp_kernel: str = "e3nn",
+        source_subset: Optional[float] = None,
     ) -> None:
         """
         InteractionBlock.
@@ -40,6 +53,25 @@ class InteractionBlock(GraphModuleMixin, torch.nn.Module):
         :param number_of_basis: Number or Basis function, default = 8
         :param irreps_in: Input Features, default = None
         :param use_sc: bool, use self-connection or not
+        :param aggregation: how messages are summed into atoms, ``"scatter"`` (default), or
+            for edges sorted by destination, ``"segment"`` (``torch.segment_reduce``, used in
+            eval mode; training, which needs the double backward, uses the deterministic sum) or
+            ``"index_add"`` (deterministic sum of the zero-padded CSR segments, in a fixed order).
+            The graphs must be sorted by destination, as are those built by ``kim_nequip`` and by
+            the KIM driver; this is checked outside TorchScript (see ``_segment``).
+        :param edge_chunk_size: if given, the edges go through fc -> tp -> aggregation in blocks
+            of this many edges, accumulated into the node features with ``index_add``, so that the edge
+            intermediates scale with the chunk size instead of the number of edges.
+        :param checkpoint_chunks: recompute every chunk in the backward pass instead of storing
+            its intermediates. TorchScript cannot checkpoint, so scripted models only chunk the
+            forward of autograd; their chunks are recomputed by ``messages_grad``, which the
+            exported model uses for its forces when this is set (see ``ConvNetLayer.recompute_grad``)
+        :param tp_kernel: ``"e3nn"`` (default) for ``e3nn.o3.TensorProduct``, or ``"uvu"`` for
+            ``UVUTensorProduct``, which evaluates the same tensor product with precomputed
+            Clebsch-Gordan blocks and batched matmuls. Both take the same weights.
+        :param source_subset: if given, ``linear_1`` is only applied to the atoms that are the source
+            of an edge when they are fewer than this fraction of all atoms, e.g. in the last
+            convolutions of the staged KIM graphs, where the outer padding atoms send no messages.
         """
         super().__init__()
 
@@ -66,6 +98,18 @@ class InteractionBlock(GraphModuleMixin, torch.nn.Module):
 
         self.avg_num_neighbors = avg_num_neighbors
         self.use_sc = use_sc
+        if aggregation not in ("scatter", "segment", "index_add"):
+            raise ValueError(
+                f"Unknown aggregation `{aggregation}`, should be one of scatter, segment, index_add"
+            )
+        self.aggregation = aggregation
+        if edge_chunk_size is not None and edge_chunk_size < 1:
+            raise ValueError(f"edge_chunk_size should be positive, got {edge_chunk_size}")
+        self.edge_chunk_size = edge_chunk_size
+        self.checkpoint_chunks = checkpoint_chunks
+        self.source_subset = source_subset
+        if tp_kernel not in ("e3nn", "uvu"):
+            raise ValueError(f"Unknown tp_kernel `{tp_kernel}`, should be one of e3nn, uvu")
 
         feature_irreps_in = self.irreps_in[AtomicDataDict.NODE_FEATURES_KEY]
         feature_irreps_out = self.irreps_out[AtomicDataDict.NODE_FEATURES_KEY]
@@ -101,14 +145,22 @@ class InteractionBlock(GraphModuleMixin, torch.nn.Module):
             for i_in1, i_in2, i_out, mode, train in instructions
         ]
 
-        tp = TensorProduct(
-            feature_irreps_in,
-            irreps_edge_attr,
-            irreps_mid,
-            instructions,
-            shared_weights=False,
-            internal_weights=False,
-        )
+        if tp_kernel == "uvu":
+            tp = UVUTensorProduct(
+                feature_irreps_in,
+                irreps_edge_attr,
+                irreps_mid,
+                instructions,
+            )
+        else:
+            tp = TensorProduct(
+                feature_irreps_in,
+                irreps_edge_attr,
+                irreps_mid,
+                instructions,
+                shared_weights=False,
+                internal_weights=False,
+            )
 
         # init_irreps already confirmed that the edge embeddding is all invariant scalars
         self.fc = FullyConnectedNet(
@@ -122,6 +174,7 @@ class InteractionBlock(GraphModuleMixin, torch.nn.Module):
         )
 
         self.tp = tp
+        self.tp_out_dim = tp.irreps_out.dim
 
         self.linear_2 = Linear(
             # irreps_mid has uncoallesed irreps because of the uvu instructions,
@@ -143,27 +196,191 @@ class InteractionBlock(GraphModuleMixin, torch.nn.Module):
             )
 
 
-    def forward(self, x, h, edge_length_embeddings, edge_sh, edge_index):
-        weight = self.fc(edge_length_embeddings)
+    def forward(
+        self,
+        x,
+        h,
+        edge_length_embeddings,
+        edge_sh,
+        edge_index,
+        edge_segment_lengths: Optional[torch.Tensor] = None,
+    ):
+        messages = self.aggregated_messages(
+            h, edge_length_embeddings, edge_sh, edge_index, edge_segment_lengths
+        )
+        return self.update(x, h, messages)
 
-        # x = h
+    @torch.jit.export
+    def aggregated_messages(
+        self,
+        h,
+        edge_length_embeddings,
+        edge_sh,
+        edge_index,
+        edge_segment_lengths: Optional[torch.Tensor] = None,
+    ):
+        """[n_node, tp_out_dim] sums of the messages into every node, before ``update``."""
         edge_src = edge_index[1]
         edge_dst = edge_index[0]
 
-        if self.sc is not None:
-            sc = self.sc(h, x)
-
-        h = self.linear_1(h)
-        edge_features = self.tp(h[edge_src], edge_sh, weight)
-        h = scatter(edge_features, edge_dst, dim=0, dim_size=len(h))
+        num_nodes = len(h)
+        h, edge_src = self._linear_1(h, edge_src)
+        edge_chunk_size: Optional[int] = self.edge_chunk_size
+        if edge_chunk_size is not None and edge_src.shape[0] > edge_chunk_size:
+            return self._chunked_messages(
+                h,
+                edge_length_embeddings,
+                edge_sh,
+                edge_src,
+                edge_dst,
+                edge_chunk_size,
+                num_nodes,
+            )
+        return self._aggregate(
+            self._message(h, edge_length_embeddings, edge_sh, edge_src),
+            edge_dst,
+            edge_segment_lengths,
+            num_nodes,
+        )
 
+    @torch.jit.export
+    def update(self, x, h, messages):
+        """The output node features, from the input ones ``h`` and their ``aggregated_messages``."""
         # Necessary to get TorchScript to be able to type infer when its not None
         avg_num_neigh: Optional[float] = self.avg_num_neighbors
         if avg_num_neigh is not None:
-            h = h.div(avg_num_neigh**0.5)
+            messages = messages.div(avg_num_neigh**0.5)
 
-        h = self.linear_2(h)
+        out = self.linear_2(messages)
 
         if self.sc is not None:
-            h = h + sc
-        return h
+            out = out + self.sc(h, x)
+        return out
+
+    @torch.jit.export
+    def messages_grad(
+        self, h, edge_length_embeddings, edge_sh, edge_index, grad_messages
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Gradients of ``aggregated_messages`` w.r.t. ``h``, ``edge_length_embeddings`` and ``edge_sh``.
+
+        The messages are recomputed and differentiated one chunk of ``edge_chunk_size``
+        edges at a time (all at once without it), so that, as with ``checkpoint_chunks``
+        in eager mode, only the intermediates of one chunk are alive; this is how the
+        scripted models recompute the chunks in the backward.
+
+        Args:
+            grad_messages: [n_node, tp_out_dim] gradient w.r.t. the ``aggregated_messages``
+        """
+        h = h.detach().requires_grad_(True)
+        h_linear, edge_src = self._linear_1(h, edge_index[1])
+        h_linear_in = h_linear.detach().requires_grad_(True)
+        edge_dst = edge_index[0]
+        n_edges = edge_src.shape[0]
+        edge_chunk_size: Optional[int] = self.edge_chunk_size
+        chunk = n_edges if edge_chunk_size is None else edge_chunk_size
+
+        grad_h_linear = torch.zeros_like(h_linear_in)
+        grad_embeddings = torch.zeros_like(edge_length_embeddings)
+        grad_sh = torch.zeros_like(edge_sh)
+        for start in range(0, n_edges, max(chunk, 1)):
+            stop = start + chunk
+            embeddings = edge_length_embeddings[start:stop].detach().requires_grad_(True)
+            sh = edge_sh[start:stop].detach().requires_grad_(True)
+            edge_features = self._message(h_linear_in, embeddings, sh, edge_src[start:stop])
+            # the messages are summed, so each one gets the gradient of its destination
+            grads = grads_or_zeros(
+                [edge_features],
+                [h_linear_in, embeddings, sh],
+                [grad_messages[edge_dst[start:stop]]],
+            )
+            grad_h_linear = grad_h_linear + grads[0]
+            grad_embeddings[start:stop] = grads[1]
+            grad_sh[start:stop] = grads[2]
+        grad_h = grads_or_zeros([h_linear], [h], [grad_h_linear])[0]
+        return grad_h, grad_embeddings, grad_sh
+
+    def _linear_1(self, h, edge_src):
+        """``linear_1`` of the node features, and ``edge_src`` indexing into its output."""
+        source_subset: Optional[float] = self.source_subset
+        if source_subset is not None:
+            return self._linear_on_sources(h, edge_src, source_subset)
+        return self.linear_1(h), edge_src
+
+    def _linear_on_sources(self, h, edge_src, source_subset: float):
+        """``linear_1`` of the source atoms only, if they are few enough, with ``edge_src`` indexing into them."""
+        active = torch.zeros(len(h), dtype=torch.bool, device=h.device)
+        active[edge_src] = True
+        sources = active.nonzero().view(-1)
+        if sources.shape[0] >= source_subset * len(h):
+            return self.linear_1(h), edge_src
+        position = torch.cumsum(active, dim=0) - 1
+        return self.linear_1(h[sources]), position[edge_src]
+
+    def _message(self, h, edge_length_embeddings, edge_sh, edge_src):
+        weight = self.fc(edge_length_embeddings)
+        return self.tp(h[edge_src], edge_sh, weight)
+
+    @torch.jit.unused
+    def _checkpointed_message(
+        self,
+        h: torch.Tensor,
+        edge_length_embeddings: torch.Tensor,
+        edge_sh: torch.Tensor,
+        edge_src: torch.Tensor,
+    ) -> torch.Tensor:
+        return checkpoint(
+            self._message, self, h, edge_length_embeddings, edge_sh, edge_src
+        )
+
+    def _chunked_messages(
+        self,
+        h,
+        edge_length_embeddings,
+        edge_sh,
+        edge_src,
+        edge_dst,
+        edge_chunk_size: int,
+        num_nodes: int,
+    ):
+        out = h.new_zeros((num_nodes, self.tp_out_dim))
+        for start in range(0, edge_src.shape[0], edge_chunk_size):
+            stop = start + edge_chunk_size
+            if (
+                self.checkpoint_chunks
+                and torch.is_grad_enabled()
+                and not torch.jit.is_scripting()
+            ):
+                edge_features = self._checkpointed_message(
+                    h,
+                    edge_length_embeddings[start:stop],
+                    edge_sh[start:stop],
+                    edge_src[start:stop],
+                )
+            else:
+                edge_features = self._message(
+                    h,
+                    edge_length_embeddings[start:stop],
+                    edge_sh[start:stop],
+                    edge_src[start:stop],
+                )
+            out.index_add_(0, edge_dst[start:stop], edge_features)
+        return out
+
+    def _aggregate(
+        self,
+        edge_features,
+        edge_dst,
+        edge_segment_lengths: Optional[torch.Tensor],
+        dim_size: int,
+    ):
+        if self.aggregation == "scatter":
+            return scatter(edge_features, edge_dst, dim=0, dim_size=dim_size)
+        if edge_segment_lengths is None:
+            edge_segment_lengths = segment_lengths(edge_dst, dim_size)
+        return segment_sum(
+            edge_features,
+            edge_dst,
+            edge_segment_lengths,
+            dim_size=dim_size,
+            use_segment_reduce=self.aggregation == "segment" and not self.training,
+        )
@@ -0,0 +1,82 @@
+"""Aggregation of edge messages over contiguous (CSR) segments.
+
+When the edges are sorted by destination, the messages of every atom form one
+contiguous segment and the sum over neighbors is a segment reduction instead of
+an atomic-add scatter. The segment lengths (the differences of the CSR row
+pointers) only depend on the graph, so they are computed once per edge graph.
+
+The segment aggregations of ``InteractionBlock`` need the edges sorted by
+destination, as are the graphs built by ``kim_nequip`` (the neighbor lists of
+``AtomicData``, with or without ``reorder_atoms``, and ``driver_graph``) and those
+of the KIM TorchML driver. ``segment_lengths`` checks it outside TorchScript. A
+scripted model does not, since the check synchronizes with the device on every
+call; the converter checks the graphs of the driver once, when exporting.
+"""
+from typing import Optional
+
+import torch
+
+from torch_runstats.scatter import scatter
+
+
+def check_sorted(index: torch.Tensor):
+    """Raise a ``ValueError`` if ``index`` is not sorted."""
+    if index.numel() > 1 and bool((index[1:] < index[:-1]).any()):
+        raise ValueError(
+            "The segment aggregations need the edges sorted by destination (edge_index[0]), "
+            "use aggregation: scatter for unsorted graphs"
+        )
+
+
+def segment_lengths(index: torch.Tensor, num_segments: int) -> torch.Tensor:
+    """Lengths of the segments of ``index``, which must be sorted.
+
+    Computed from the CSR row pointers on the device. Outside TorchScript, ``index`` is
+    first checked to be sorted.
+    """
+    if not torch.jit.is_scripting():
+        check_sorted(index)
+    ptr = torch.searchsorted(
+        index, torch.arange(num_segments + 1, dtype=index.dtype, device=index.device)
+    )
+    return ptr[1:] - ptr[:-1]
+
+
+def segment_sum(
+    src: torch.Tensor,
+    index: torch.Tensor,
+    lengths: Optional[torch.Tensor],
+    dim_size: int,
+    use_segment_reduce: bool = True,
+) -> torch.Tensor:
+    """Sum the rows of ``src`` into ``dim_size`` rows according to the sorted ``index``.
+
+    Args:
+        src: [n_edge, ...] values sorted by ``index``
+        index: [n_edge] destination of every row of ``src``
+        lengths: [dim_size] segment lengths from ``segment_lengths``; if ``None``,
+            falls back to ``scatter``
+        dim_size: number of output rows
+        use_segment_reduce: use ``torch.segment_reduce``, whose backward is a gather but which
+            has no double backward. Otherwise every row of ``src`` is gathered once into a
+            [dim_size, max(lengths), ...] block, padded with zeros, and the block is summed
+            over its second dimension: the sums are in a fixed order, and the gradient of
+            every row of ``src`` is a single value, so both are deterministic, at the cost
+            of the padding memory.
+    """
+    if lengths is None:
+        return scatter(src, index, dim=0, dim_size=dim_size)
+    if use_segment_reduce:
+        return torch.segment_reduce(src, "sum", lengths=lengths, axis=0, unsafe=True)
+    max_length = int(lengths.max()) if lengths.numel() > 0 else 0
+    start = torch.cumsum(lengths, dim=0) - lengths
+    slot = torch.arange(max_length, dtype=lengths.dtype, device=lengths.device)
+    position = start.unsqueeze(1) + slot
+    # the empty slots point to an extra row of zeros
+    position = torch.where(
+        slot < lengths.unsqueeze(1), position, torch.full_like(position, src.shape[0])
+    )
+    size = list(src.shape)
+    size[0] = 1
+    padded = torch.cat([src, src.new_zeros(size)])
+    return padded[position].sum(dim=1)
@@ -0,0 +1,97 @@
+"""Methods unrolled over the convolutions of a model, generated for its number of layers.
+
+The exported models take the edge graph of every convolution as a separate argument,
+the way the KIM TorchML driver passes them, and index their modules with constants,
+so that TorchScript compiles straight-line code instead of a loop over a list of
+tensors. The methods that depend on the number of convolutions are generated from
+source templates for that number and added to a subclass of the class declaring
+them, ``<Class>_<n>_layers``, which ``<Class>.for_layers(n)`` builds once and caches.
+The generated source is registered in ``linecache``, where TorchScript (and
+tracebacks) read it.
+"""
+import linecache
+from typing import Callable, Dict, List, Tuple
+
+_CLASSES: Dict[Tuple[type, int], type] = {}
+# the base class and number of layers of every generated class
+_LAYERS: Dict[type, Tuple[type, int]] = {}
+
+
+def names(prefix: str, n_layers: int) -> str:
+    """``prefix0, prefix1, ...``, one per layer."""
+    return ", ".join(f"{prefix}{i}" for i in range(n_layers))
+
+
+def repeat(template: str, items: List[Dict]) -> str:
+    """``template`` formatted with every item of ``items``, one after the other."""
+    return "\n".join(template.format(**item) for item in items)
+
+
+def unrolled(base: type, n_layers: int, methods: Callable[[int], str], namespace: Dict) -> type:
+    """Subclass of ``base`` with the functions defined by ``methods(n_layers)`` as methods.
+
+    Args:
+        base: the class declaring the methods, a subclass of ``Unrolled``
+        n_layers: number of convolutions
+        methods: returns the source of the methods, as module-level functions
+        namespace: globals of the generated functions, usually ``globals()`` of the
+            module of ``base``
+
+    Returns:
+        the subclass; it is cached, so every call with the same ``base`` and
+        ``n_layers`` returns the same class
+    """
+    key = (base, n_layers)
+    if key in _CLASSES:
+        return _CLASSES[key]
+    if n_layers < 1:
+        raise ValueError(f"The number of layers must be positive, got {n_layers}")
+    name = f"{base.__name__}_{n_layers}_layers"
+    source = methods(n_layers)
+    filename = f"<{name}>"
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    scope = dict(namespace)
+    exec(compile(source, filename, "exec"), scope)
+
+    body = {"__module__": base.__module__, "__qualname__": name}
+    for method_name, value in scope.items():
+        code = getattr(value, "__code__", None)
+        if code is not None and code.co_filename == filename:
+            value.__qualname__ = f"{name}.{method_name}"
+            body[method_name] = value
+    cls = type(name, (base,), body)
+    _CLASSES[key] = cls
+    _LAYERS[cls] = key
+    return cls
+
+
+def _new_unrolled(base: type, n_layers: int):
+    """An uninitialized instance of ``base.for_layers(n_layers)``, for unpickling."""
+    cls = base.for_layers(n_layers)
+    return cls.__new__(cls)
+
+
+class Unrolled:
+    """Base of the classes whose methods are generated for their number of layers.
+
+    Only the subclasses returned by ``for_layers`` can be instantiated. Their instances
+    are pickled (and copied) as the base class and the number of layers, so that the
+    subclass is generated again where they are loaded.
+    """
+
+    @classmethod
+    def for_layers(cls, n_layers: int) -> type:
+        """The subclass with the methods generated for ``n_layers`` convolutions."""
+        raise NotImplementedError
+
+    def __new__(cls, *args, **kwargs):
+        if cls not in _LAYERS:
+            raise TypeError(
+                f"{cls.__name__} has methods generated for its number of layers, "
+                f"build it with {cls.__name__}.for_layers(n_layers)"
+            )
+        return super().__new__(cls)
+
+    def __reduce_ex__(self, protocol):
+        reduced = super().__reduce_ex__(protocol)
+        return (_new_unrolled, _LAYERS[type(self)]) + tuple(reduced[2:])
@@ -0,0 +1,237 @@
+"""A tensor product specialized to the "uvu" instructions of ``InteractionBlock``.
+
+``InteractionBlock`` only uses ``"uvu"`` paths between the node features and the
+edge spherical harmonics, with per-edge weights. For every input irrep of the
+features, all its paths are evaluated together:
+
+1. the Clebsch-Gordan blocks of the paths are precomputed into one dense matrix
+   (with the path normalization folded in), which contracts the spherical
+   harmonics into ``Y[z, i, (path, v, k)]``;
+2. one batched matmul ``x1[z, u, i] @ Y[z, i, (path, v, k)]``;
+3. the per-edge weights are gathered into the same layout and multiplied in.
+
+The result matches ``e3nn.o3.TensorProduct`` with the same instructions, which
+``check_uvu`` verifies for a given module.
+"""
+from typing import List, Tuple
+
+import torch
+
+from e3nn import o3
+
+
+class _UVUGroup(torch.nn.Module):
+    """All paths sharing one input irrep of ``irreps_in1``."""
+
+    start: int
+    stop: int
+    mul: int
+    dim: int
+    reduce_v: bool
+
+    def __init__(
+        self,
+        start: int,
+        mul: int,
+        dim: int,
+        cg: torch.Tensor,
+        weight_index: torch.Tensor,
+        v_index: torch.Tensor,
+        n_out: int,
+    ):
+        super().__init__()
+        self.start = start
+        self.stop = start + mul * dim
+        self.mul = mul
+        self.dim = dim
+        # cg: [dim_in2, dim * n_pvk]
+        self.register_buffer("cg", cg, persistent=False)
+        # weight_index: [mul, n_pvk] position in the flat weights
+        self.register_buffer("weight_index", weight_index, persistent=False)
+        # v_index: [n_pvk] position of (path, v, k) after summing over v
+        self.register_buffer("v_index", v_index, persistent=False)
+        self.reduce_v = len(v_index) != n_out
+        self.n_out = n_out
+
+    def forward(self, x1: torch.Tensor, x2: torch.Tensor, weight: torch.Tensor):
+        z = x1.shape[0]
+        y = torch.mm(x2, self.cg).view(z, self.dim, -1)
+        out = torch.bmm(x1[:, self.start : self.stop].view(z, self.mul, self.dim), y)
+        out = out * weight[:, self.weight_index]
+        if self.reduce_v:
+            out = out.new_zeros((z, self.mul, self.n_out)).index_add(
+                2, self.v_index, out
+            )
+        return out
+
+
+class UVUTensorProduct(torch.nn.Module):
+    """Drop-in replacement of ``TensorProduct(..., shared_weights=False, internal_weights=False)``
+    for instructions that are all ``(i_in1, i_in2, i_out, "uvu", True)``.
+
+    Uses the default ``"component"`` irrep normalization and ``"element"`` path normalization.
+
+    Args:
+        irreps_in1: irreps of the first input (node features)
+        irreps_in2: irreps of the second input (spherical harmonics)
+        irreps_out: irreps of the output
+        instructions: list of ``(i_in1, i_in2, i_out, "uvu", True)``
+    """
+
+    weight_numel: int
+
+    def __init__(self, irreps_in1, irreps_in2, irreps_out, instructions: List[Tuple]):
+        super().__init__()
+        self.irreps_in1 = o3.Irreps(irreps_in1)
+        self.irreps_in2 = o3.Irreps(irreps_in2)
+        self.irreps_out = o3.Irreps(irreps_out)
+        instructions = [tuple(ins) for ins in instructions]
+        self.instructions = instructions
+        for ins in instructions:
+            if tuple(ins[3:5]) != ("uvu", True):
+                raise ValueError(f"Only weighted `uvu` instructions are supported, got {ins}")
+            assert self.irreps_in1[ins[0]].mul == self.irreps_out[ins[2]].mul
+
+        # same normalization as e3nn: component irreps, element paths
+        fan_in = {}
+        for i_in1, i_in2, i_out, _, _ in instructions:
+            fan_in[i_out] = fan_in.get(i_out, 0) + self.irreps_in2[i_in2].mul
+        path_weights = [
+            (self.irreps_out[ins[2]].ir.dim / fan_in[ins[2]]) ** 0.5
+            for ins in instructions
+        ]
+
+        weight_offsets = []
+        self.weight_numel = 0
+        for i_in1, i_in2, _, _, _ in instructions:
+            weight_offsets.append(self.weight_numel)
+            self.weight_numel += self.irreps_in1[i_in1].mul * self.irreps_in2[i_in2].mul
+
+        slices_in1 = self.irreps_in1.slices()
+        slices_in2 = self.irreps_in2.slices()
+        slices_out = self.irreps_out.slices()
+
+        groups = []
+        # output position of every (group, u, path, k), to put the results in the layout of irreps_out
+        out_positions = []
+        for i_in1, (mul, ir1) in enumerate(self.irreps_in1):
+            paths = [p for p, ins in enumerate(instructions) if ins[0] == i_in1]
+            if len(paths) == 0 or mul == 0:
+                continue
+            pvk = []  # (path, v, k) columns before the sum over v
+            pk = []  # (path, k) columns after the sum over v
+            for p in paths:
+                _, i_in2, i_out, _, _ = instructions[p]
+                ir_out = self.irreps_out[i_out].ir
+                pk += [(p, k) for k in range(ir_out.dim)]
+                pvk += [
+                    (p, v, k)
+                    for v in range(self.irreps_in2[i_in2].mul)
+                    for k in range(ir_out.dim)
+                ]
+            cg = torch.zeros(self.irreps_in2.dim, ir1.dim, len(pvk))
+            weight_index = torch.zeros(mul, len(pvk), dtype=torch.long)
+            for col, (p, v, k) in enumerate(pvk):
+                _, i_in2, i_out, _, _ = instructions[p]
+                mul2, ir2 = self.irreps_in2[i_in2]
+                w3j = o3.wigner_3j(ir1.l, ir2.l, self.irreps_out[i_out].ir.l)
+                rows = slices_in2[i_in2].start + v * ir2.dim
+                cg[rows : rows + ir2.dim, :, col] = path_weights[p] * w3j[:, :, k].T
+                weight_index[:, col] = weight_offsets[p] + torch.arange(mul) * mul2 + v
+            v_index = torch.tensor([pk.index((p, k)) for p, _, k in pvk], dtype=torch.long)
+            groups.append(
+                _UVUGroup(
+                    start=slices_in1[i_in1].start,
+                    mul=mul,
+                    dim=ir1.dim,
+                    cg=cg.reshape(self.irreps_in2.dim, -1),
+                    weight_index=weight_index,
+                    v_index=v_index,
+                    n_out=len(pk),
+                )
+            )
+            for u in range(mul):
+                for p, k in pk:
+                    i_out = instructions[p][2]
+                    out_positions.append(
+                        slices_out[i_out].start + u * self.irreps_out[i_out].ir.dim + k
+                    )
+        self.groups = torch.nn.ModuleList(groups)
+
+        out_positions = torch.tensor(out_positions, dtype=torch.long)
+        self.scatter_out = len(out_positions) != self.irreps_out.dim or len(
+            torch.unique(out_positions)
+        ) != len(out_positions)
+        # either a permutation into irreps_out, or the positions to sum into
+        self.register_buffer(
+            "out_index",
+            out_positions
+            if self.scatter_out
+            else torch.argsort(out_positions),
+            persistent=False,
+        )
+        self.out_dim = self.irreps_out.dim
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}({self.irreps_in1.simplify()} x {self.irreps_in2.simplify()} "
+            f"-> {self.irreps_out.simplify()} | {self.weight_numel} weights, uvu kernel)"
+        )
+
+    def forward(self, x1: torch.Tensor, x2: torch.Tensor, weight: torch.Tensor):
+        z = x1.shape[0]
+        outs: List[torch.Tensor] = []
+        for group in self.groups:
+            outs.append(group(x1, x2, weight).reshape(z, -1))
+        out = torch.cat(outs, dim=1)
+        if self.scatter_out:
+            return out.new_zeros((z, self.out_dim)).index_add(1, self.out_index, out)
+        return out[:, self.out_index]
+
+
+def check_uvu(tp: UVUTensorProduct, batch: int = 16, rtol: float = 1e-5, atol: float = 1e-6):
+    """Compare ``tp`` with the ``e3nn.o3.TensorProduct`` of the same instructions.
+
+    The outputs, and the gradients w.r.t. both inputs and the weights, are compared on
+    random inputs in the dtype of ``tp``, with the weights laid out as e3nn lays them
+    out, so that a difference in the path normalization or in the weight layout shows.
+
+    Raises:
+        ValueError: if they differ
+    """
+    dtype = torch.get_default_dtype() if len(tp.groups) == 0 else tp.groups[0].cg.dtype
+    ref = o3.TensorProduct(
+        tp.irreps_in1,
+        tp.irreps_in2,
+        tp.irreps_out,
+        tp.instructions,
+        shared_weights=False,
+        internal_weights=False,
+    ).to(dtype=dtype)
+    if ref.weight_numel != tp.weight_numel:
+        raise ValueError(
+            f"{tp} has {tp.weight_numel} weights, e3nn.o3.TensorProduct has {ref.weight_numel}"
+        )
+    generator = torch.Generator().manual_seed(0)
+    inputs = [
+        torch.randn(batch, dim, generator=generator, dtype=dtype).requires_grad_(True)
+        for dim in (tp.irreps_in1.dim, tp.irreps_in2.dim, tp.weight_numel)
+    ]
+    cotangent = torch.randn(batch, tp.irreps_out.dim, generator=generator, dtype=dtype)
+    for name, module in (("uvu", tp), ("e3nn", ref)):
+        out = module(*inputs)
+        grads = torch.autograd.grad(out, inputs, cotangent, allow_unused=True)
+        grads = [torch.zeros_like(x) if g is None else g for x, g in zip(inputs, grads)]
+        if name == "uvu":
+            expected = [out.detach()] + grads
+            continue
+        for what, a, b in zip(
+            ["output", "gradient of x1", "gradient of x2", "gradient of the weights"],
+            expected,
+            [out.detach()] + grads,
+        ):
+            if not torch.allclose(a, b, rtol=rtol, atol=atol):
+                raise ValueError(
+                    f"The {what} of {tp} differs from e3nn.o3.TensorProduct by "
+                    f"{(a - b).abs().max().item():.3g}"
+                )
@@ -48,6 +48,12 @@ class SphericalHarmonicEdgeAttrs(GraphModuleMixin, torch.nn.Module):
         self.sh = o3.SphericalHarmonics(
             self.irreps_edge_sh, edge_sh_normalize, edge_sh_normalization
         )
+        # recent e3nn keeps a scripted function, which cannot be copied or pickled; the
+        # plain one is compiled with the model when it is scripted
+        if isinstance(getattr(self.sh, "sph_func", None), torch.jit.ScriptFunction):
+            from e3nn.o3._spherical_harmonics import _spherical_harmonics
+
+            self.sh.sph_func = _spherical_harmonics
 
     def forward(self, pos, edge_index):
         edge_vec = pos[edge_index[1]] - pos[edge_index[0]]
@@ -57,7 +63,17 @@ class SphericalHarmonicEdgeAttrs(GraphModuleMixin, torch.nn.Module):
 
 @compile_mode("script")
 class RadialBasisEdgeEncoding(GraphModuleMixin, torch.nn.Module):
+    """Radial basis of the edge lengths, multiplied by the cutoff function.
+
+    Args:
+        prune_edges (bool, default: False): whether the model should drop the edges that
+            are not shorter than ``r_max`` (see ``prune``) before any per-edge work; the
+            cutoff function zeroes them anyway.
+    """
+
     out_field: str
+    r_max: float
+    prune_edges: bool
 
     def __init__(
         self,
@@ -67,11 +83,16 @@ class RadialBasisEdgeEncoding(GraphModuleMixin, torch.nn.Module):
         cutoff_kwargs={},
         out_field: str = AtomicDataDict.EDGE_EMBEDDING_KEY,
         irreps_in=None,
+        prune_edges: bool = False,
     ):
         super().__init__()
         self.basis = basis(**basis_kwargs)
         self.cutoff = cutoff(**cutoff_kwargs)
         self.out_field = out_field
+        self.r_max = float(cutoff_kwargs.get("r_max", basis_kwargs.get("r_max", -1.0)))
+        if prune_edges and self.r_max <= 0:
+            raise ValueError("prune_edges needs the r_max of the cutoff")
+        self.prune_edges = prune_edges
         self._init_irreps(
             irreps_in=irreps_in,
             irreps_out={self.out_field: o3.Irreps([(self.basis.num_basis, (0, 1))])},
@@ -85,3 +106,16 @@ class RadialBasisEdgeEncoding(GraphModuleMixin, torch.nn.Module):
             self.basis(edge_length) * self.cutoff(edge_length)[:, None]
         )
         return edge_length, edge_length_embedded
+
+    @torch.jit.export
+    def prune(self, pos, edge_index):
+        """The edges of ``edge_index`` shorter than ``r_max``, in the same order.
+
+        The selection is made without autograd; the kept edges are then embedded from
+        ``pos`` as usual, so the gradients are the same as with all the edges (those of
+        the dropped ones are zero, as is their cutoff function with its derivatives).
+        """
+        with torch.no_grad():
+            edge_vec = pos[edge_index[1]] - pos[edge_index[0]]
+            keep = torch.linalg.norm(edge_vec, dim=1) < self.r_max
+        return edge_index[:, keep]
@@ -3,6 +3,7 @@ import torch
 import math
 
 
-@torch.jit.script
+# a plain function, so that the modules using it can be copied and pickled; it is
+# compiled with them when they are scripted
 def ShiftedSoftPlus(x):
     return torch.nn.functional.softplus(x) - math.log(2.0)
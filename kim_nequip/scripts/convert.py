@@ -9,17 +9,23 @@ import numpy as np  # noqa: F401
 
 from os.path import isdir
 from pathlib import Path
+from typing import List, Optional, Tuple
 
 import torch
 
+from kim_nequip.data import driver_graph
 from kim_nequip.model import model_from_config
+from kim_nequip.nn._segment import check_sorted, segment_lengths
+from kim_nequip.nn._uvu_tp import UVUTensorProduct, check_uvu
+from kim_nequip.nn._unrolled import Unrolled, names, repeat, unrolled
 from kim_nequip.utils import Config
 from kim_nequip.utils import load_file
 from kim_nequip.utils._global_options import _set_global_options
 
 from e3nn.util.jit import script
 
-import shutil, os
+import copy
+import shutil, os, time
 
 default_config = dict(
     root="./",
@@ -86,6 +92,88 @@ def parse_command_line(args=None):
         action="store_true",
         default=False
     )
+    parser.add_argument(
+        "--checkpoint-layers",
+        help="Compute forces by recomputing one convolution at a time in the backward pass, "
+        "trading about one extra forward pass for the memory of a single layer",
+        action="store_true",
+        default=False
+    )
+    parser.add_argument(
+        "--tp-kernel",
+        help="Tensor product of the convolutions in the exported model: e3nn (default), or uvu "
+        "for the specialized kernel with precomputed Clebsch-Gordan blocks",
+        type=str,
+        choices=["e3nn", "uvu"],
+        default=None
+    )
+    parser.add_argument(
+        "--fused-gate",
+        help="Use FusedGate, which is checked against e3nn.nn.Gate when built, for the gate "
+        "nonlinearities of the exported model",
+        action="store_true",
+        default=False
+    )
+    parser.add_argument(
+        "--source-subset",
+        help="Apply the first linear layer of a convolution only to the atoms that send messages, "
+        "when they are fewer than this fraction of all atoms (0 to always use all atoms)",
+        type=float,
+        default=0.5
+    )
+    parser.add_argument(
+        "--keep-all-edges",
+        help="Do not drop the edges longer than the cutoff (e.g. in the skin of the neighbor lists) "
+        "before the edge embeddings",
+        action="store_true",
+        default=False
+    )
+    parser.add_argument(
+        "--batched-model",
+        help="Also export MY_MODEL_NAME_batched.pt, which takes a batch of configurations with a "
+        "batch index and returns the energy of every configuration and the forces on all atoms",
+        action="store_true",
+        default=False
+    )
+    parser.add_argument(
+        "--ensemble-models",
+        help="Other deployed models, trained with the same config; with --deployed-model they are "
+        "exported as one ensemble, MY_MODEL_NAME_ensemble.pt, that returns the mean and variance of "
+        "the energy and forces",
+        type=str,
+        nargs="+",
+        default=None
+    )
+    parser.add_argument(
+        "--optimize-for-inference",
+        help="Freeze the exported model (folding its weights and buffers into constants) and run "
+        "the TorchScript inference optimizations on it; the outputs are checked against the "
+        "unfrozen model, which is saved instead if they differ or if the optimization fails, "
+        "and the latencies of both are written to the .txt report",
+        action="store_true",
+        default=False
+    )
+    parser.add_argument(
+        "--param-methods",
+        help="Exported methods to name in file.param, after the sections that the TorchML driver "
+        "reads: energy (energy only, without autograd) and energy_forces_virial (energy, forces "
+        "and virial from one backward pass). They are not part of the driver's "
+        "file.param format, so none is written by default",
+        type=str,
+        nargs="+",
+        choices=["energy", "energy_forces_virial"],
+        default=[]
+    )
+    parser.add_argument(
+        "--warm-up",
+        help="After saving, run synthetic clusters of these numbers of atoms (default 64 256 1024) "
+        "through the exported model, and write the times of the successive calls and the "
+        "specialization of the TorchScript profiling executor to the .txt report. This is a "
+        "report only: the profiling state is not saved, so the driver pays the warm-up again",
+        type=int,
+        nargs="*",
+        default=None
+    )
     parser.add_argument(
         "--verbose",
         help="Logging verbosity level",
@@ -100,6 +188,18 @@ def parse_command_line(args=None):
     config["out-name"] = args.out_name
     config["give-kim-model"] = True
     config["verbose-conv"] = args.verbose
+    config["checkpoint-layers"] = args.checkpoint_layers
+    config["source-subset"] = args.source_subset
+    config["prune_edges"] = not args.keep_all_edges
+    config["batched-model"] = args.batched_model
+    config["ensemble-models"] = args.ensemble_models
+    config["optimize-for-inference"] = args.optimize_for_inference
+    config["warm-up"] = args.warm_up
+    config["param-methods"] = args.param_methods
+    if args.tp_kernel is not None:
+        config["tp_kernel"] = args.tp_kernel
+    if args.fused_gate:
+        config["fused_gate"] = True
     return config
 
 
@@ -119,8 +219,8 @@ def fresh_start(config):
     with open(out_file_name, "w") as f:
         f.write("This is a KIM-API NequIP model for TorchML Model driver, below is the architecture:\n")
         f.write(str(final_model))
-    # save model
-    scritped_model = script(final_model)
+    # save model; scripting a copy checks that the model survives both
+    scritped_model = script(copy.deepcopy(final_model))
     scritped_model.save(config["out-name"])
     print(f"Saved the model as {config['out-name']}")
     print(f"You can check the architecture in : {out_file_name}")
@@ -129,7 +229,49 @@ def fresh_start(config):
     except:
         raise FileNotFoundError(f"Deployed model not found at {config['deployed-model']}")
     final_model = copy_weights(deployed_model, final_model, config)
-    final_model.save(config["out-name"])
+    exported_model = final_model
+    if config.get("optimize-for-inference", False):
+        exported_model, report = optimize_for_inference(final_model, config)
+        with open(out_file_name, "a") as f:
+            f.write("\n\n" + report)
+        print(report)
+    exported_model.save(config["out-name"])
+    if config.get("warm-up", None) is not None:
+        # measured on the saved model, which it leaves unchanged
+        report = warm_up(exported_model, config, config["warm-up"] or (64, 256, 1024))
+        with open(out_file_name, "a") as f:
+            f.write("\n\n" + report)
+        print(report)
+    if config.get("batched-model", False):
+        out_name_dotted_list = config["out-name"].split(".")
+        out_name_dotted_list[-2] += "_batched"
+        batched_name = ".".join(out_name_dotted_list)
+        batched_model = torch.jit.script(
+            BatchedWrappedModel.for_layers(final_model.model.num_layers)(
+                final_model.model, final_model.scale_by
+            ).eval()
+        )
+        batched_model.save(batched_name)
+        print(f"Saved the batched model as {batched_name}")
+    if config.get("ensemble-models", None):
+        members = [final_model]
+        for path in config["ensemble-models"]:
+            try:
+                deployed_member = torch.jit.load(path)
+            except:
+                raise FileNotFoundError(f"Deployed model not found at {path}")
+            member = model_from_config(config=config, initialize=True)
+            members.append(copy_weights(deployed_member, member, config))
+        out_name_dotted_list = config["out-name"].split(".")
+        out_name_dotted_list[-2] += "_ensemble"
+        ensemble_name = ".".join(out_name_dotted_list)
+        ensemble_model = torch.jit.script(
+            EnsembleWrappedModel.for_layers(final_model.model.num_layers)(
+                [m.model for m in members], [m.scale_by for m in members]
+            ).eval()
+        )
+        ensemble_model.save(ensemble_name)
+        print(f"Saved the ensemble of {len(members)} models as {ensemble_name}")
     if config["give-kim-model"]:
         save_kim_model(final_model, config)
     return
@@ -183,31 +325,456 @@ def copy_weights(deployed_model, final_model, config):
             list(deployed_model.modules())[deployed_conv_indices[i]].conv.avg_num_neighbors)
 
     final_model.double()
+    fold_normalization(final_model, config.get("source-subset", None))
+    for module in final_model.modules():
+        if isinstance(module, UVUTensorProduct):
+            # the specialized kernel replaces the e3nn tensor product the model was trained with
+            check_uvu(module)
+    if final_model.segment_aggregation:
+        # the scripted model does not check the order of its edges on every call: check
+        # once that the graphs built as by the driver are sorted by destination
+        for edge_index in synthetic_inputs(config, 64)[2:-1]:
+            check_sorted(edge_index[0])
 
-    class WrappedModel(torch.nn.Module):
-        def __init__(self, model, scale_by):
-            super().__init__()
-            self.model = model
-            self.register_buffer("scale_by", scale_by)
-    # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
-        def forward(self, x, pos,
-                    edge_graph0, edge_graph1, edge_graph2,  # << ADD LAYERS HERE
-                    contributions):
-            energy= self.model(x, pos,
-                               edge_graph0, edge_graph1, edge_graph2, # << ADD LAYERS HERE
-                               contributions)
-            energy = energy * self.scale_by # scale total energy, shift is ususally 0
-            forces, = torch.autograd.grad([energy],[pos]) # no need to preserve or create force graph, as this is for inference
-            if forces is None:
-                forces = torch.zeros_like(pos)
-            return energy, -forces
-    # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<
-
-    model_wrapped = WrappedModel(final_model, deployed_model.scale_by)
-    model_wrapped = torch.jit.script(model_wrapped)
+    checkpoint_layers = config.get("checkpoint-layers", False)
+    if not checkpoint_layers and _checkpoints_chunks(final_model):
+        # TorchScript cannot checkpoint the edge chunks in the autograd backward, the
+        # layer-checkpointed forces recompute them one at a time instead
+        print("Edge chunks are checkpointed: computing the forces with --checkpoint-layers")
+        checkpoint_layers = True
+    model_wrapped = WrappedModel.for_layers(final_model.num_layers)(
+        final_model,
+        deployed_model.scale_by,
+        checkpoint_layers=checkpoint_layers,
+    )
+    # exported for inference: the branches on `training` (e.g. the segment_reduce
+    # aggregation) are those of eval mode
+    model_wrapped = torch.jit.script(model_wrapped.eval())
     return model_wrapped
 
 
+def _checkpoints_chunks(model) -> bool:
+    """Whether a convolution of ``model`` streams its edges in checkpointed chunks."""
+    return any(
+        getattr(m.conv, "edge_chunk_size", None) is not None and m.conv.checkpoint_chunks
+        for m in model.modules()
+        if hasattr(m, "conv")
+    )
+
+
+class WrappedModel(Unrolled, torch.nn.Module):
+    """The KIM model: energy of the contributing atoms of a ``KLIFFGraphNetwork`` and forces on all atoms.
+
+    The inputs are those of the network, with one edge graph per convolution; the
+    methods are generated for the number of convolutions of the network (see
+    ``_WRAPPED_METHODS``).
+    """
+    checkpoint_layers: bool
+
+    @classmethod
+    def for_layers(cls, n_layers: int) -> type:
+        return unrolled(WrappedModel, n_layers, _wrapped_methods, globals())
+
+    def __init__(self, model, scale_by, checkpoint_layers: bool = False):
+        super().__init__()
+        self.model = model
+        self.register_buffer("scale_by", scale_by)
+        self.checkpoint_layers = checkpoint_layers
+
+
+_WRAPPED_METHODS = '''
+def forward(self, x, pos,
+            {graphs},
+            contributions):
+    if self.checkpoint_layers:
+        # only the node features between convolutions are kept alive
+        energy, forces = self.model.checkpointed_energy_and_forces(
+            x, pos,
+            {graphs},
+            contributions)
+        return energy * self.scale_by, forces * self.scale_by
+    energy= self.model(x, pos,
+                       {graphs},
+                       contributions)
+    energy = energy * self.scale_by # scale total energy, shift is ususally 0
+    forces, = torch.autograd.grad([energy],[pos]) # no need to preserve or create force graph, as this is for inference
+    if forces is None:
+        forces = torch.zeros_like(pos)
+    return energy, -forces
+
+
+@torch.jit.export
+def energy(self, x, pos,
+           {graphs},
+           contributions):
+    # energy only: no autograd graph is built, so no activation is kept
+    with torch.no_grad():
+        energy = self.model(x, pos,
+                            {graphs},
+                            contributions)
+    return energy * self.scale_by
+
+
+@torch.jit.export
+def energy_forces_virial(self, x, pos,
+                         {graphs},
+                         contributions) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    # the positions of all (contributing and padding) atoms are strained by a
+    # symmetric displacement, and one backward pass gives the gradients w.r.t.
+    # both: virial = -dE/d(strain) = sum over atoms of pos x forces
+    if self.checkpoint_layers:
+        energy, forces = self.forward(
+            x, pos,
+            {graphs},
+            contributions)
+        virial = pos.detach().transpose(0, 1) @ forces
+        return energy, forces, 0.5 * (virial + virial.transpose(0, 1))
+    strain = torch.zeros((3, 3), dtype=pos.dtype, device=pos.device)
+    strain.requires_grad_(True)
+    symmetric_strain = 0.5 * (strain + strain.transpose(0, 1))
+    strained_pos = pos + pos @ symmetric_strain
+    energy = self.model(x, strained_pos,
+                        {graphs},
+                        contributions)
+    energy = energy * self.scale_by
+    grads = torch.autograd.grad([energy], [pos, strain])
+    forces = grads[0]
+    if forces is None:
+        forces = torch.zeros_like(pos)
+    virial = grads[1]
+    if virial is None:
+        virial = torch.zeros_like(strain)
+    return energy, -forces, -virial
+'''
+
+
+def _wrapped_methods(n_layers: int) -> str:
+    return _WRAPPED_METHODS.format(graphs=names("edge_graph", n_layers))
+
+
+class BatchedWrappedModel(Unrolled, torch.nn.Module):
+    """Energies of a batch of configurations and the forces on their atoms, for high-throughput screening.
+
+    The inputs are those of the KIM model for the configurations concatenated by
+    ``kim_nequip.data.batch_driver_graphs``, followed by the ``batch`` index of every atom.
+    """
+
+    @classmethod
+    def for_layers(cls, n_layers: int) -> type:
+        return unrolled(BatchedWrappedModel, n_layers, _batched_methods, globals())
+
+    def __init__(self, model, scale_by):
+        super().__init__()
+        self.model = model
+        self.register_buffer("scale_by", scale_by)
+
+
+_BATCHED_METHODS = '''
+def forward(self, x, pos,
+            {graphs},
+            contributions, batch):
+    energies = self.model.batched_energies(
+        x, pos,
+        {graphs},
+        contributions, batch)
+    energies = energies * self.scale_by
+    # the configurations are independent, so the gradient of the sum gives all the forces
+    forces, = torch.autograd.grad([energies.sum()], [pos])
+    if forces is None:
+        forces = torch.zeros_like(pos)
+    return energies, -forces
+
+
+@torch.jit.export
+def energies(self, x, pos,
+             {graphs},
+             contributions, batch):
+    """Energies of the configurations only, without autograd."""
+    with torch.no_grad():
+        energies = self.model.batched_energies(
+            x, pos,
+            {graphs},
+            contributions, batch)
+    return energies * self.scale_by
+'''
+
+
+def _batched_methods(n_layers: int) -> str:
+    return _BATCHED_METHODS.format(graphs=names("edge_graph", n_layers))
+
+
+class EnsembleWrappedModel(Unrolled, torch.nn.Module):
+    """Mean and variance of the energies and forces of an ensemble of models, for uncertainty estimates.
+
+    The members must be built from the same config, so that they have the same edge
+    graphs and spherical harmonics: the edge vectors, spherical harmonics and (if the
+    radial bases of all members have the same weights) the radial embeddings are
+    computed once, and only the convolutions run per member. The inputs are those of
+    the KIM model; the variances are over the members (not the unbiased estimates), and
+    those of the forces are per atom, before the forces on the padding atoms are summed
+    into their owners (use ``members`` for the energies and forces of every member).
+    """
+    share_radial: bool
+
+    @classmethod
+    def for_layers(cls, n_layers: int) -> type:
+        return unrolled(EnsembleWrappedModel, n_layers, _ensemble_methods, globals())
+
+    def __init__(self, models, scale_by):
+        super().__init__()
+        self.models = torch.nn.ModuleList(models)
+        self.register_buffer(
+            "scale_by", torch.stack([s.reshape(()) for s in scale_by]).to(torch.float64)
+        )
+        radial = [list(m[2].state_dict().values()) for m in models]
+        self.share_radial = all(
+            len(r) == len(radial[0]) and all(torch.equal(a, b) for a, b in zip(r, radial[0]))
+            for r in radial
+        )
+
+
+_ENSEMBLE_METHODS = '''
+def forward(self, x, pos,
+            {graphs},
+            contributions):
+    energies, forces = self.members(x, pos,
+                                    {graphs},
+                                    contributions)
+    return (
+        energies.mean(),
+        energies.var(unbiased=False),
+        forces.mean(0),
+        forces.var(0, unbiased=False),
+    )
+
+
+@torch.jit.export
+def members(self, x, pos,
+            {graphs},
+            contributions) -> Tuple[torch.Tensor, torch.Tensor]:
+    """[n_model] energies and [n_model, n_atom, 3] forces of every member."""
+    first = self.models[0]
+    x_embed = first[0](x.squeeze(-1)).to(dtype=pos.dtype, device=pos.device)
+
+    # Shared edge geometry
+    if first.prune_edges:
+{prune}
+{edge_sh}
+{radial}
+{declare_segments}
+    if first.segment_aggregation:
+{segments}
+
+    energies: List[torch.Tensor] = []
+    for i, model in enumerate(self.models):
+        {embs} = {shared_embs}
+        if not self.share_radial:
+{member_radial}
+        h = model.conv_energies(x, x_embed,
+{conv_args}
+                                )
+        energies.append(torch.sum(h[contributions == 0]) * self.scale_by[i])
+    energy = torch.stack(energies)
+
+    # one backward per member, through the shared geometry as well
+    forces: List[torch.Tensor] = []
+    n_models = len(energies)
+    for i in range(n_models):
+        grad, = torch.autograd.grad([energies[i]], [pos], retain_graph=i < n_models - 1)
+        if grad is None:
+            grad = torch.zeros_like(pos)
+        forces.append(-grad)
+    return energy.detach(), torch.stack(forces)
+'''
+
+
+def _ensemble_methods(n_layers: int) -> str:
+    graphs = [dict(i=i) for i in range(n_layers)]
+    return _ENSEMBLE_METHODS.format(
+        graphs=names("edge_graph", n_layers),
+        prune=repeat("        edge_graph{i} = first[2].prune(pos, edge_graph{i})", graphs),
+        edge_sh=repeat("    edge_vec{i}, edge_sh{i} = first[1](pos, edge_graph{i})", graphs),
+        radial=repeat("    _, edge_emb{i} = first[2](edge_vec{i})", graphs),
+        declare_segments=repeat("    segments{i}: Optional[torch.Tensor] = None", graphs),
+        segments=repeat(
+            "        segments{i} = segment_lengths(edge_graph{i}[0], pos.shape[0])", graphs
+        ),
+        embs=names("emb", n_layers),
+        shared_embs=names("edge_emb", n_layers),
+        member_radial=repeat("            _, emb{i} = model[2](edge_vec{i})", graphs),
+        conv_args=repeat(
+            "                                emb{i}, edge_sh{i}, edge_graph{i}, segments{i},",
+            graphs,
+        ),
+    )
+
+
+def fold_normalization(model, source_subset=None):
+    """Fold the ``1/sqrt(avg_num_neighbors)`` of every convolution into the weights of its ``linear_2``.
+
+    ``linear_2`` is linear without biases, so scaling its weights is the same as scaling its
+    input, and the division of the aggregated messages is dropped from the exported model.
+    If ``source_subset`` is given, the convolutions also apply ``linear_1`` only to the
+    atoms that send messages when they are fewer than this fraction of all atoms.
+    """
+    for module in model.modules():
+        if not (hasattr(module, "avg_num_neighbors") and hasattr(module, "linear_2")):
+            continue
+        avg_num_neighbors = module.avg_num_neighbors
+        if avg_num_neighbors is not None:
+            with torch.no_grad():
+                module.linear_2.weight.mul_(avg_num_neighbors ** -0.5)
+            module.avg_num_neighbors = None
+        if source_subset:
+            module.source_subset = float(source_subset)
+
+
+def synthetic_inputs(config, n_atoms: int, seed: int = 0):
+    """Inputs of the exported model for a cluster of ``n_atoms`` atoms of random species.
+
+    The atoms are on a jittered cubic lattice of spacing ``r_max / 2``, which gives a few
+    tens of neighbors per atom, as in condensed phases.
+    """
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(n_atoms ** (1 / 3)))
+    grid = np.stack(np.meshgrid(*[np.arange(side)] * 3, indexing="ij"), axis=-1)
+    grid = grid.reshape(-1, 3)[:n_atoms]
+    pos = (grid + rng.uniform(-0.2, 0.2, grid.shape)) * 0.5 * config["r_max"]
+    types = rng.integers(0, config["num_types"], n_atoms)
+    g = driver_graph(pos, types, r_max=config["r_max"], n_layers=config.get("num_layers", 3))
+    return (
+        g["species"].view(-1, 1),
+        g["coords"].to(torch.float64),
+        *g["edge_indices"],
+        g["contributing"],
+    )
+
+
+def _latency(model, inputs, repeats: int = 10) -> float:
+    """Median time of ``repeats`` calls of ``model`` (energy and forces), after two warm-up calls."""
+    times = []
+    for k in range(repeats + 2):
+        coords = inputs[1].clone().requires_grad_(True)
+        start = time.perf_counter()
+        model(inputs[0], coords, *inputs[2:])
+        times.append(time.perf_counter() - start)
+    return float(np.median(times[2:]))
+
+
+def _outputs(model, inputs) -> List[torch.Tensor]:
+    """Outputs of ``forward``, ``energy`` and ``energy_forces_virial`` of the exported ``model``."""
+    outputs = []
+    coords = inputs[1].clone().requires_grad_(True)
+    outputs += list(model(inputs[0], coords, *inputs[2:]))
+    outputs.append(model.energy(inputs[0], inputs[1].clone(), *inputs[2:]))
+    coords = inputs[1].clone().requires_grad_(True)
+    outputs += list(model.energy_forces_virial(inputs[0], coords, *inputs[2:]))
+    return [output.detach() for output in outputs]
+
+
+def optimize_for_inference(model, config, n_atoms: int = 256):
+    """Frozen and inference-optimized copy of the exported model, if it gives the same outputs.
+
+    ``torch.jit.freeze`` inlines the submodules and folds the weights and buffers
+    (``scale_by``, the radial basis weights, ...) and the flags into constants, and drops
+    every attribute that is not used; ``torch.jit.optimize_for_inference`` then runs the
+    TorchScript inference passes on the frozen graph. The exported methods are kept, but
+    not the ``model`` attribute that the Python tools of ``kim_nequip.inference`` use.
+
+    The outputs of ``forward``, ``energy`` and ``energy_forces_virial`` for a synthetic
+    cluster of ``n_atoms`` atoms are compared with those of ``model``; if they differ, or
+    if freezing, optimizing or running the frozen model fails, ``model`` is returned
+    unchanged.
+
+    Returns:
+        the model to save, and a report with the latencies of both models
+    """
+    methods = ["energy", "energy_forces_virial"]
+    model = model.eval()
+    inputs = synthetic_inputs(config, n_atoms)
+    header = (
+        f"# Inference optimization (torch.jit.freeze + torch.jit.optimize_for_inference)\n"
+        f"Synthetic cluster: {n_atoms} atoms, {inputs[2].shape[1]} edges in the last graph\n"
+    )
+    expected = _outputs(model, inputs)
+    try:
+        optimized = torch.jit.freeze(model, preserved_attrs=methods)
+        optimized = torch.jit.optimize_for_inference(optimized, other_methods=methods)
+        outputs = _outputs(optimized, inputs)
+    except Exception as e:
+        warnings.warn(
+            f"Optimizing the model for inference failed ({type(e).__name__}: {e}), "
+            "saving the exported model instead"
+        )
+        return model, header + f"Not applied: {type(e).__name__}: {e}\n"
+    deviation = max(float((a - b).abs().max()) for a, b in zip(expected, outputs))
+    scale = max(float(a.abs().max()) for a in expected)
+    before = _latency(model, inputs)
+    after = _latency(optimized, inputs)
+
+    report = header + (
+        f"Max deviation of forward, energy and energy_forces_virial: {deviation:.3e}\n"
+        f"Latency of energy and forces before: {before * 1e3:.3f} ms\n"
+        f"Latency of energy and forces after:  {after * 1e3:.3f} ms\n"
+    )
+    if deviation > 1e-8 * max(1.0, scale):
+        warnings.warn(
+            f"The optimized model deviates from the exported one by {deviation:.3e}, "
+            "saving the exported model instead"
+        )
+        return model, report + "Not applied: the outputs changed\n"
+    return optimized, report + f"Applied, speedup {before / after:.2f}x\n"
+
+
+def warm_up(model, config, sizes=(64, 256, 1024), calls: int = 5) -> str:
+    """Report of the JIT warm-up of the exported model on synthetic clusters of ``sizes`` atoms.
+
+    The TorchScript profiling executor records the shapes and types of the first calls
+    and then compiles a graph specialized to them, which it reuses for other sizes as
+    long as the fusion strategy is dynamic (see ``_jit_fusion_strategy``). The times of
+    the successive calls show the cost of this warm-up against the steady state. The
+    report does not make the first calls of the driver any faster: the profiling state
+    is not saved with the model, so every process that loads it pays the warm-up again.
+    """
+    lines = [
+        "# JIT warm-up (successive calls of forward on synthetic clusters)",
+        f"Fusion strategy: {config.get('_jit_fusion_strategy', None)}",
+    ]
+    for n_atoms in sizes:
+        inputs = synthetic_inputs(config, n_atoms, seed=n_atoms)
+        times = []
+        for _ in range(calls):
+            coords = inputs[1].clone().requires_grad_(True)
+            start = time.perf_counter()
+            model(inputs[0], coords, *inputs[2:])
+            times.append(time.perf_counter() - start)
+        steady = float(np.median(times[-2:]))
+        lines.append(
+            f"{n_atoms} atoms, {inputs[2].shape[1]} edges in the last graph: calls of "
+            + ", ".join(f"{t * 1e3:.1f}" for t in times)
+            + f" ms; steady state {steady * 1e3:.1f} ms, "
+            f"warm-up overhead {max(0.0, sum(times) - calls * steady) * 1e3:.1f} ms"
+        )
+
+    if hasattr(torch.jit, "last_executed_optimized_graph"):
+        optimized = torch.jit.last_executed_optimized_graph()
+        kinds = [
+            "DifferentiableGraph",
+            "TensorExprGroup",
+            "TensorExprDynamicGroup",
+            "CudaFusionGroup",
+            "FallbackGraph",
+            "TypeCheck",
+            "RequiresGradCheck",
+        ]
+        counts = [(k, len(optimized.findAllNodes(f"prim::{k}", True))) for k in kinds]
+        lines.append(
+            "Specialized graph of the last call: "
+            + ", ".join(f"{n} {k}" for k, n in counts if n > 0)
+        )
+    return "\n".join(lines) + "\n"
+
+
 def save_kim_model(model, config):
     n_layers = config["num_layers"]
     cutoff = config["r_max"]
@@ -229,9 +796,17 @@ def save_kim_model(model, config):
         f.write(f"{model_name}\n\n")
         f.write("# Return Forces\n")
         f.write("True\n\n")
-        f.write("# Number of Inputs (n_conv_layers + other inputs)\n# 3 conv layers  + 1 element embedding\n")
+        f.write(f"# Number of Inputs (n_conv_layers + other inputs)\n# {n_layers} conv layers  + 1 element embedding\n")
         f.write(f"{n_layers + 3}\n\n")
         f.write("# Descriptors\nNone\n")
+        # optional trailing sections, not read by the driver
+        methods = config.get("param-methods", [])
+        if "energy" in methods:
+            f.write("\n# Energy-only method (same inputs, no forces and no autograd)\n")
+            f.write("energy\n")
+        if "energy_forces_virial" in methods:
+            f.write("\n# Virial method (same inputs, returns energy, forces and the 3x3 virial of all atoms)\n")
+            f.write("energy_forces_virial\n")
 
     with open(f"{KIM_model_name}/CMakeLists.txt", "w") as f:
         f.write("cmake_minimum_required(VERSION 3.10)\n")
@@ -7,11 +7,34 @@ from typing import Optional, Sequence
 from opt_einsum import contract
 
 
-def solver(X, y, alpha: Optional[float] = 0.001, stride: Optional[int] = 1, **kwargs):
+def solver(
+    X,
+    y,
+    alpha: Optional[float] = 0.001,
+    stride: Optional[int] = 1,
+    down_sampling: bool = True,
+    chunk_size: Optional[int] = None,
+    **kwargs,
+):
     # results are in the same "units" as y, so same dtype too:
     dtype_out = y.dtype
     # always solve in float64 for numerical stability
     dtype = torch.float64
+
+    if not down_sampling:
+        # without the per-composition quantiles, the regression only needs
+        # the sufficient statistics, which are accumulated chunk by chunk
+        ridge = IncrementalRidgeSolver()
+        X = X[::stride]
+        y = y[::stride]
+        chunk_size = len(X) if chunk_size is None else chunk_size
+        for start in range(0, len(X), max(chunk_size, 1)):
+            ridge.accumulate(
+                X[start : start + chunk_size], y[start : start + chunk_size]
+            )
+        mean, cov = ridge.solve(alpha=alpha)
+        return mean.to(dtype_out), cov.to(dtype_out)
+
     X = X[::stride].to(dtype)
     y = y[::stride].to(dtype)
 
@@ -45,32 +68,124 @@ def solver(X, y, alpha: Optional[float] = 0.001, stride: Optional[int] = 1, **kw
     return mean.to(dtype_out), cov.to(dtype_out)
 
 
+class IncrementalRidgeSolver:
+    """Ridge regression of ``solver`` (without down sampling) from accumulated XᵀX and Xᵀy.
+
+    Only ``n_features x n_features`` sufficient statistics are kept, so the rows of
+    ``X`` can be streamed in chunks and partial solvers can be merged.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.XtX: Optional[torch.Tensor] = None
+        self.Xty: Optional[torch.Tensor] = None
+        self.X_sum: Optional[torch.Tensor] = None
+        self.y_sum = 0.0
+        self.y2_sum = 0.0
+
+    def accumulate(self, X: torch.Tensor, y: torch.Tensor):
+        X = X.to(torch.float64)
+        y = y.to(torch.float64).reshape(len(X))
+        if self.XtX is not None and X.shape[1] > self.XtX.shape[1]:
+            self._pad(X.shape[1])
+        elif self.XtX is not None and X.shape[1] < self.XtX.shape[1]:
+            X = torch.nn.functional.pad(X, (0, self.XtX.shape[1] - X.shape[1]))
+        XtX, Xty = matmul(X.T, X), matmul(X.T, y)
+        if self.XtX is None:
+            self.XtX, self.Xty, self.X_sum = XtX, Xty, X.sum(dim=0)
+        else:
+            self.XtX += XtX
+            self.Xty += Xty
+            self.X_sum += X.sum(dim=0)
+        self.n += len(X)
+        self.y_sum += y.sum().item()
+        self.y2_sum += y.square().sum().item()
+        return self
+
+    def merge(self, other: "IncrementalRidgeSolver"):
+        if other.XtX is None:
+            return self
+        if self.XtX is None:
+            self.XtX = other.XtX.clone()
+            self.Xty = other.Xty.clone()
+            self.X_sum = other.X_sum.clone()
+        else:
+            n_features = max(self.XtX.shape[1], other.XtX.shape[1])
+            self._pad(n_features)
+            other._pad(n_features)
+            self.XtX += other.XtX
+            self.Xty += other.Xty
+            self.X_sum += other.X_sum
+        self.n += other.n
+        self.y_sum += other.y_sum
+        self.y2_sum += other.y2_sum
+        return self
+
+    def _pad(self, n_features: int):
+        pad = n_features - self.XtX.shape[1]
+        if pad > 0:
+            self.XtX = torch.nn.functional.pad(self.XtX, (0, pad, 0, pad))
+            self.Xty = torch.nn.functional.pad(self.Xty, (0, pad))
+            self.X_sum = torch.nn.functional.pad(self.X_sum, (0, pad))
+
+    def solve(self, alpha: Optional[float] = 0.001):
+        # same normalization as `solver`: X and y are divided by the sum of X
+        X_norm = torch.sum(self.X_sum)
+        XtX = self.XtX / X_norm**2
+        y_mean = self.y_sum / X_norm
+
+        feature_rms = torch.sqrt(torch.diagonal(XtX) / self.n)
+        A = XtX + torch.diag(feature_rms) * alpha * alpha
+        # Xᵀ(y - X·1·y_mean), with rows of X summing to the composition size
+        Xy = (self.Xty - matmul(self.XtX, torch.ones_like(self.Xty)) * y_mean) / (
+            X_norm**2
+        )
+
+        mean = solve(A, Xy)
+
+        # residues r = (X (mean + y_mean) - y) / X_norm, expanded over the statistics
+        w = mean + y_mean
+        r2_sum = (
+            w @ self.XtX @ w - 2 * w @ self.Xty + self.y2_sum
+        ) / X_norm**2
+        r_sum = (self.X_sum @ w - self.y_sum) / X_norm
+        sigma2 = (r2_sum - r_sum**2 / self.n) / (self.n - 1)
+        Ainv = inv(A)
+        cov = torch.sqrt(sigma2 * torch.diagonal(Ainv @ XtX @ Ainv))
+
+        logging.debug(f"Ridge Regression, residue {sigma2}")
+
+        return w, cov
+
+
 def down_sampling_by_composition(
     X: torch.Tensor, y: torch.Tensor, percentage: Sequence = [0.25, 0.5, 0.75]
 ):
 
     unique_comps, comp_ids = torch.unique(X, dim=0, return_inverse=True)
-
-    n_types = torch.max(comp_ids) + 1
-
-    sort_by = torch.argsort(comp_ids)
-
-    # find out the block for each composition
-    d_icomp = comp_ids[sort_by]
-    d_icomp = d_icomp[:-1] - d_icomp[1:]
-    node_icomp = torch.where(d_icomp != 0)[0]
-    id_start = torch.cat((torch.as_tensor([0]), node_icomp + 1))
-    id_end = torch.cat((node_icomp + 1, torch.as_tensor([len(sort_by)])))
-
-    n_points = len(percentage)
-    new_X = torch.zeros(
-        (n_types * n_points, X.shape[1]), dtype=X.dtype, device=X.device
-    )
-    new_y = torch.zeros((n_types * n_points), dtype=y.dtype, device=y.device)
-    for i in range(n_types):
-        ids = sort_by[id_start[i] : id_end[i]]
-        for j, p in enumerate(percentage):
-            new_y[i * n_points + j] = torch.quantile(y[ids], p, interpolation="linear")
-            new_X[i * n_points + j] = unique_comps[i]
+    n_comps = len(unique_comps)
+
+    # sort by value, then (stably) by composition, so that every composition
+    # is a contiguous, sorted segment of y
+    y = y.reshape(len(X))
+    order = torch.argsort(y)
+    order = order[torch.sort(comp_ids[order], stable=True)[1]]
+    y_sorted = y[order]
+
+    counts = torch.bincount(comp_ids, minlength=n_comps)
+    starts = torch.cumsum(counts, dim=0) - counts
+
+    # linear interpolation between the closest ranks, as torch.quantile
+    q = torch.as_tensor(percentage, dtype=y.dtype, device=y.device)
+    rank = q.unsqueeze(0) * (counts - 1).unsqueeze(1).to(y.dtype)
+    low = torch.floor(rank)
+    frac = rank - low
+    low = low.long()
+    high = torch.minimum(low + 1, (counts - 1).unsqueeze(1))
+    y_low = y_sorted[starts.unsqueeze(1) + low]
+    y_high = y_sorted[starts.unsqueeze(1) + high]
+
+    new_y = (y_low + frac * (y_high - y_low)).reshape(-1)
+    new_X = unique_comps.repeat_interleave(len(percentage), dim=0)
 
     return new_X, new_y